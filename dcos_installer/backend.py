@@ -6,14 +6,8 @@ import json
 import logging
 import os
 
-import botocore.exceptions
-
 import gen
-import gen.build_deploy.aws
 import gen.calc
-import release
-import release.storage.aws
-import release.storage.local
 from dcos_installer import config_util, upgrade
 from dcos_installer.config import (
     Config,
@@ -59,13 +53,15 @@ def generate_node_upgrade_script(installed_cluster_version, config_path=CONFIG_P
 
     config = Config(config_path)
     try:
-        gen_out = config_util.onprem_generate(config)
+        # Config packages which didn't change since the last generation are reused.
+        gen_out = config_util.onprem_generate(config, config_util.load_config_manifest())
     except ValidationError as e:
         validation = normalize_config_validation_exception(e)
         print_messages(validation)
         return 1
 
     config_util.make_serve_dir(gen_out)
+    print("Changed config packages: " + (', '.join(gen_out.config_diff['changed_packages']) or 'none'))
 
     # generate the upgrade script
     upgrade.generate_node_upgrade_script(gen_out, installed_cluster_version)
@@ -98,12 +94,16 @@ def validate_aws_template_storage_region_name(aws_template_storage_region_name):
             region_to_endpoint.keys())
 
 
+@gen.internals.io_bound
 def validate_aws_bucket_access(aws_template_storage_region_name,
                                aws_template_storage_access_key_id,
                                aws_template_storage_secret_access_key,
                                aws_template_storage_bucket,
                                aws_template_storage_bucket_path,
                                aws_template_storage_bucket_path_autocreate):
+    # The AWS libraries are slow to import and only needed for AWS templates.
+    import botocore.exceptions
+    import release.storage.aws
 
     session = release.storage.aws.get_aws_session(
         aws_template_storage_access_key_id,
@@ -148,6 +148,8 @@ def calculate_aws_template_storage_region_name(
         aws_template_storage_access_key_id,
         aws_template_storage_secret_access_key,
         aws_template_storage_bucket):
+    import botocore.exceptions
+    import release.storage.aws
 
     session = release.storage.aws.get_aws_session(
         aws_template_storage_access_key_id,
@@ -248,6 +250,11 @@ def do_aws_cf_configure():
 
     Generates AWS templates using a custom config.yaml
     """
+    # Imported here so the rest of the installer doesn't pay for loading them.
+    import gen.build_deploy.aws
+    import release
+    import release.storage.aws
+    import release.storage.local
 
     # TODO(cmaloney): Move to Config class introduced in https://github.com/dcos/dcos/pull/623
     config = Config(CONFIG_PATH)
@@ -6,7 +6,6 @@ import os
 import sys
 
 import coloredlogs
-from passlib.hash import sha512_crypt
 
 import dcos_installer.config
 import dcos_installer.constants
@@ -184,6 +183,7 @@ def do_hash_password(password):
                 log.error('Must provide a non-empty password')
 
     print_header("HASHING PASSWORD TO SHA512")
+    from passlib.hash import sha512_crypt
     hashed_password = sha512_crypt.encrypt(password)
     return hashed_password
 
@@ -5,6 +5,7 @@ import sys
 
 import gen
 import gen.build_deploy.bash
+import gen.build_deploy.util
 import pkgpanda
 from dcos_installer.constants import ARTIFACT_DIR, CLUSTER_PACKAGES_PATH, SERVE_DIR
 from pkgpanda.util import make_directory
@@ -12,8 +13,19 @@ from pkgpanda.util import make_directory
 log = logging.getLogger(__name__)
 
 
-def onprem_generate(config):
-    return gen.generate(config.as_gen_format(), extra_sources=[gen.build_deploy.bash.onprem_source])
+def onprem_generate(config, previous_manifest=None):
+    return gen.generate(
+        config.as_gen_format(),
+        extra_sources=[gen.build_deploy.bash.onprem_source],
+        previous_manifest=previous_manifest)
+
+
+def load_config_manifest():
+    """Return the config package manifest in the serve dir, None if there isn't one."""
+    filename = SERVE_DIR + '/' + gen.build_deploy.util.config_manifest_filename
+    if not os.path.exists(filename):
+        return None
+    return pkgpanda.util.load_json(filename)
 
 
 def make_serve_dir(gen_out):
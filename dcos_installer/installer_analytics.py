@@ -1,8 +1,6 @@
 import os
 import uuid
 
-import analytics
-
 from dcos_installer.config import Config
 from dcos_installer.constants import CONFIG_PATH
 
@@ -17,6 +15,9 @@ class InstallerAnalytics():
         action: string | preflight, deploy, or postflight
         install_method: string | gui, cli or advanced
         """
+        # analytics imports requests, only load it when actually sending.
+        import analytics
+
         analytics.write_key = "51ybGTeFEFU1xo6u10XMDrr6kATFyRyh"
 
         # Set customer key here rather than __init__ since we want the most up to date config
@@ -1,3 +1,7 @@
+import json
+import subprocess
+import sys
+
 import pytest
 
 import gen
@@ -98,3 +102,19 @@ def test_stringify_config():
         "e": "[1]",
         "f": '{"g": "h"}'
     } == stringify({"a": "b", "c": True, "d": 1, "e": [1], "f": {"g": "h"}})
+
+
+@pytest.mark.parametrize('module', ['dcos_installer.cli', 'gen', 'gen.build_deploy.bash'])
+def test_startup_imports(module):
+    # Libraries which are slow to import and only needed by some commands must be imported lazily.
+    heavy = ['analytics', 'boto3', 'botocore', 'checksumdir', 'passlib.hash', 'pkg_resources', 'release', 'requests']
+    code = (
+        'import json, sys, time\n'
+        'start = time.time()\n'
+        'import {}\n'
+        'print(json.dumps([time.time() - start, [name for name in {!r} if name in sys.modules]]))'
+    ).format(module, heavy)
+    seconds, loaded = json.loads(subprocess.check_output([sys.executable, '-c', code]).decode())
+    assert loaded == []
+    # Loose bound, start-up takes well under a second.
+    assert seconds < 5
@@ -16,8 +16,12 @@ import json
 import logging as log
 import os
 import os.path
+import posixpath
 import pprint
+import re
 import textwrap
+import threading
+from collections import OrderedDict
 from copy import copy, deepcopy
 from typing import List
 
@@ -27,6 +31,7 @@ import gen.calc
 import gen.internals
 import gen.template
 import gen.util
+import gen.yaml_template
 import pkgpanda.exceptions
 from gen.exceptions import ValidationError
 from pkgpanda import PackageId
@@ -188,10 +193,102 @@ utils = Bunch({
 })
 
 
-def render_yaml(data):
+def _dump_yaml(data):
     return yaml.dump(data, default_style='|', default_flow_style=False)
 
 
+# Rendered fragments of YAML documents by (path of keys, repr of the data at the path). Variants of
+# a cloud-config share most of their files and units so those are only rendered once. The least
+# recently used fragments are dropped past max_yaml_fragments, so long running processes (ex:
+# gen.service) don't keep every cloud-config they render.
+_yaml_fragments = OrderedDict()
+_yaml_fragments_lock = threading.Lock()
+max_yaml_fragments = 2048
+_yaml_fragment_key_re = re.compile('[A-Za-z0-9_./-]{1,100}')
+_yaml_document_end_re = re.compile('(?:^|\n)\\.\\.\\.\n$')
+
+
+def _yaml_fragmentable(data):
+    """Whether rendering data fragment by fragment gives the same text as rendering it at once.
+
+    Containers referenced more than once are rendered as anchors and aliases, which are numbered
+    across the whole document."""
+    seen = set()
+    pending = [data]
+    while pending:
+        value = pending.pop()
+        if type(value) in (str, int, float, bool, type(None)):
+            continue
+        if type(value) not in (dict, list) or id(value) in seen:
+            return False
+        seen.add(id(value))
+        if type(value) is dict:
+            if not all(type(key) is str and _yaml_fragment_key_re.fullmatch(key) for key in value):
+                return False
+            pending.extend(value.values())
+        else:
+            pending.extend(value)
+    return True
+
+
+def _render_yaml_fragment(path, data):
+    """Return the header lines of the keys in path and the rest of the YAML of data at path."""
+    cache_key = (path, repr(data))
+    with _yaml_fragments_lock:
+        fragment = _yaml_fragments.get(cache_key)
+        if fragment is not None:
+            _yaml_fragments.move_to_end(cache_key)
+            return fragment
+
+    for name in reversed(path):
+        data = {name: data}
+    lines = _dump_yaml(data).split('\n', len(path))
+    fragment = (lines[:len(path)], lines[len(path)])
+    with _yaml_fragments_lock:
+        _yaml_fragments[cache_key] = fragment
+        while len(_yaml_fragments) > max_yaml_fragments:
+            _yaml_fragments.popitem(last=False)
+    return fragment
+
+
+def render_yaml(data):
+    if type(data) is not dict or not data or not _yaml_fragmentable(data):
+        return _dump_yaml(data)
+
+    # Mappings are rendered key by key, and lists entry by entry. The header line of each key
+    # leading to a fragment is written once, before its first fragment.
+    pieces = list()
+    open_path = tuple()
+
+    def write(path, value):
+        nonlocal open_path
+        headers, body = _render_yaml_fragment(path, value)
+        common = 0
+        while common < min(len(path), len(open_path)) and path[common] == open_path[common]:
+            common += 1
+        pieces.extend(header + '\n' for header in headers[common:])
+        pieces.append(body)
+        open_path = path
+
+    def write_mapping(path, mapping):
+        for name in sorted(mapping):
+            value = mapping[name]
+            if type(value) is dict and value:
+                write_mapping(path + (name,), value)
+            elif type(value) is list and value:
+                for item in value:
+                    write(path + (name,), [item])
+            else:
+                write(path, {name: value})
+
+    write_mapping(tuple(), data)
+    # Block scalars keeping their trailing line breaks end the document explicitly. That is only
+    # written once, at the end of the whole document.
+    if any(_yaml_document_end_re.search(piece) for piece in pieces):
+        return _dump_yaml(data)
+    return ''.join(pieces)
+
+
 # Recursively merge to python dictionaries.
 # If both base and addition contain the same key, that key's value will be
 # merged if it is a dictionary.
@@ -240,23 +337,21 @@ def load_templates(template_dict):
     return result
 
 
-# Render the Jinja/YAML into YAML, then load the YAML and merge it to make the
-# final configuration files.
+# Render the Jinja/YAML into YAML data (see gen.yaml_template), then merge it to
+# make the final configuration files.
 def render_templates(template_dict, arguments):
     rendered_templates = dict()
     templates = load_templates(template_dict)
     for name, templates in templates.items():
         full_template = None
         for template in templates:
-            rendered_template = template.render(arguments)
-
             # If not yaml, just treat opaquely.
             if not name.endswith('.yaml'):
                 # No merging support currently.
                 assert len(templates) == 1
-                full_template = rendered_template
+                full_template = template.render(arguments)
                 continue
-            template_data = yaml.safe_load(rendered_template)
+            template_data = gen.yaml_template.load_rendered(template, arguments)
 
             if full_template:
                 full_template = merge_dictionaries(full_template, template_data)
@@ -300,35 +395,27 @@ def write_to_non_taken(base_filename, json):
 def do_gen_package(config, package_filename):
     # Generate the specific dcos-config package.
     # Version will be setup-{sha1 of contents}
-    with gen.util.pkgpanda_package_tmpdir() as tmpdir:
-        # Only contains package, root
-        assert config.keys() == {"package"}
-
-        # Write out the individual files
-        for file_info in config["package"]:
-            assert file_info.keys() <= {"path", "content", "permissions"}
-            if is_absolute_path(file_info['path']):
-                fileinfo_drive, fileinfo_path = os.path.splitdrive(file_info['path'])
-                path = tmpdir + fileinfo_path
-            else:
-                path = tmpdir + '/' + file_info['path']
-            try:
-                if os.path.dirname(path):
-                    os.makedirs(os.path.dirname(path), mode=0o755)
-            except FileExistsError:
-                pass
-
-            with open(path, 'w') as f:
-                f.write(file_info['content'] or '')
-
-            # the file has special mode defined, handle that.
-            if 'permissions' in file_info:
-                assert isinstance(file_info['permissions'], str)
-                os.chmod(path, int(file_info['permissions'], 8))
-            else:
-                os.chmod(path, 0o644)
+    # Only contains package, root
+    assert config.keys() == {"package"}
+
+    # Collect the individual files
+    files = dict()
+    for file_info in config["package"]:
+        assert file_info.keys() <= {"path", "content", "permissions"}
+        fileinfo_drive, fileinfo_path = os.path.splitdrive(file_info['path'])
+        path = posixpath.normpath(fileinfo_path).lstrip('/')
+        assert path not in ('.', '..') and not path.startswith('../'), \
+            "Bad package file path: {}".format(file_info['path'])
+
+        # the file has special mode defined, handle that.
+        if 'permissions' in file_info:
+            assert isinstance(file_info['permissions'], str)
+            mode = int(file_info['permissions'], 8)
+        else:
+            mode = 0o644
+        files[path] = ((file_info['content'] or '').encode('utf-8'), mode)
 
-        gen.util.make_pkgpanda_package(tmpdir, package_filename)
+    gen.util.write_pkgpanda_package(files, package_filename)
 
 
 def render_late_content(content, late_values):
@@ -541,9 +628,9 @@ def build_late_package(late_files, config_id, provider):
     }
 
 
-def validate_and_raise(sources, targets):
+def validate_and_raise(sources, targets, base=None):
     # TODO(cmaloney): Make it so we only get out the dcosconfig target arguments not all the config target arguments.
-    resolver = gen.internals.resolve_configuration(sources, targets)
+    resolver = gen.internals.resolve_configuration(sources, targets, base)
     status = resolver.status_dict
 
     if status['status'] == 'errors':
@@ -617,33 +704,35 @@ def get_config_id(argument_dict: dict):
     })
 
 
-def generate(
+def resolve(
         arguments,
         extra_templates=list(),
         extra_sources=list(),
         extra_targets=list()):
-    # To maintain the old API where we passed arguments rather than the new name.
-    user_arguments = arguments
-    arguments = None
+    """Resolve the configuration generate() would for the same parameters without generating it.
 
-    sources, targets, templates = get_dcosconfig_source_target_and_templates(
-        user_arguments, extra_templates, extra_sources)
+    The returned Resolver can be passed to generate() as base when generating several variants of
+    a configuration so that arguments the variants share are only calculated once. The base
+    configuration doesn't have to be valid.
+    """
+    sources, targets, _ = get_dcosconfig_source_target_and_templates(arguments, extra_templates, extra_sources)
+    return gen.internals.resolve_configuration(sources, targets + extra_targets)
 
-    resolver = validate_and_raise(sources, targets + extra_targets)
-    argument_dict = get_final_arguments(resolver)
-    late_variables = get_late_variables(resolver, sources)
-    secret_builtins = ['expanded_config_full', 'user_arguments_full', 'config_yaml_full']
-    secret_variables = set(get_secret_variables(sources) + secret_builtins)
-    masked_value = '**HIDDEN**'
 
-    # Calculate config ID after all variables are resolved, to make sure any change in config yields a new config ID.
-    config_id = get_config_id(argument_dict)
+# Builtin variables calculated from the cluster package IDs, left out of config manifests.
+package_id_builtins = {
+    'cluster_packages', 'cluster_package_list_id', 'user_arguments_full', 'user_arguments', 'config_yaml_full',
+    'config_yaml', 'expanded_config_full', 'expanded_config'}
 
-    # Calculate values that depend on the config ID.
-    config_package_names = json.loads(argument_dict['config_package_names'])
-    package_ids = json.loads(argument_dict['package_ids'])
-    config_package_ids = ['{}--setup_{}'.format(name, config_id) for name in config_package_names]
-    cluster_packages = sorted(config_package_ids + package_ids)
+
+def render_config(argument_dict, user_arguments, secret_variables, templates, cluster_packages):
+    """Calculate the builtin variables for cluster_packages and render the templates with them.
+
+    Returns the final arguments, the rendered templates and the files of dcos-config containing
+    late bind variables, which are taken out of the rendered dcos-config."""
+    argument_dict = dict(argument_dict)
+    masked_value = '**HIDDEN**'
+    cluster_packages = sorted(cluster_packages)
     validate_cluster_packages(cluster_packages)
     cluster_package_list_id = hash_checkout(cluster_packages)
 
@@ -693,9 +782,6 @@ def generate(
             log.debug("validating template file %s", name)
             assert template.keys() <= PACKAGE_KEYS, template.keys()
 
-    stable_artifacts = []
-    channel_artifacts = []
-
     # Find all files which contain late bind variables and turn them into a "late bind package"
     # TODO(cmaloney): check there are no late bound variables in cloud-config.yaml
     late_files, regular_files = extract_files_containing_late_variables(
@@ -703,6 +789,95 @@ def generate(
     # put the regular files right back
     rendered_templates[dcos_config_yaml] = {'package': regular_files}
 
+    return argument_dict, rendered_templates, late_files
+
+
+def diff_config_manifests(previous, current):
+    """Return the config packages and (non-secret) arguments changed between two config manifests.
+
+    Everything is changed if there is no previous manifest."""
+    previous = previous or {'packages': dict(), 'arguments': dict()}
+
+    def changed(key, value):
+        return sorted(
+            name for name in previous[key].keys() | current[key].keys()
+            if value(previous[key].get(name)) != value(current[key].get(name)))
+
+    return {
+        'changed_packages': changed('packages', lambda package: package and package['id']),
+        'changed_arguments': changed('arguments', lambda value: value),
+    }
+
+
+def generate(
+        arguments,
+        extra_templates=list(),
+        extra_sources=list(),
+        extra_targets=list(),
+        base=None,
+        previous_manifest=None):
+    """Generate the configuration and its config packages.
+
+    If previous_manifest (the config_manifest of an earlier generation) is given, config packages
+    whose content hasn't changed keep their IDs from it. config_diff lists what changed.
+    """
+    # To maintain the old API where we passed arguments rather than the new name.
+    user_arguments = arguments
+    arguments = None
+
+    sources, targets, templates = get_dcosconfig_source_target_and_templates(
+        user_arguments, extra_templates, extra_sources)
+
+    resolver = validate_and_raise(sources, targets + extra_targets, base)
+    argument_dict = get_final_arguments(resolver)
+    late_variables = get_late_variables(resolver, sources)
+    secret_builtins = ['expanded_config_full', 'user_arguments_full', 'config_yaml_full']
+    secret_variables = set(get_secret_variables(sources) + secret_builtins)
+
+    # Calculate config ID after all variables are resolved, to make sure any change in config yields a new config ID.
+    config_id = get_config_id(argument_dict)
+
+    # Calculate values that depend on the config ID.
+    config_package_names = json.loads(argument_dict['config_package_names'])
+    package_ids = json.loads(argument_dict['package_ids'])
+
+    # Reuse the IDs of config packages which are the same as in the previous generation so nodes
+    # don't install them again. Packages containing the IDs of others (ex: dcos-config through
+    # expanded_config) are only the same if those are too, so repeat until no more packages change.
+    previous_packages = previous_manifest['packages'] if previous_manifest else dict()
+    reused = set(config_package_names) & previous_packages.keys()
+    while True:
+        config_package_ids = [
+            previous_packages[name]['id'] if name in reused else '{}--setup_{}'.format(name, config_id)
+            for name in config_package_names]
+        final_arguments, rendered_templates, late_files = render_config(
+            argument_dict, user_arguments, secret_variables, templates, package_ids + config_package_ids)
+        content_hashes = {
+            name: hash_checkout(json.dumps(rendered_templates[name + '.yaml'], sort_keys=True))
+            for name in config_package_names}
+        unchanged = {name for name in reused if content_hashes[name] == previous_packages[name]['content_hash']}
+        if unchanged == reused:
+            break
+        reused = unchanged
+
+    argument_dict = final_arguments
+    cluster_packages = json.loads(argument_dict['cluster_packages'])
+    cluster_package_list_id = argument_dict['cluster_package_list_id']
+    config_manifest = {
+        'packages': {
+            name: {'id': package_id, 'content_hash': content_hashes[name]}
+            for name, package_id in zip(config_package_names, config_package_ids)},
+        'arguments': {
+            name: hash_checkout(value) for name, value in argument_dict.items()
+            if name not in secret_variables and name not in package_id_builtins},
+    }
+    config_diff = diff_config_manifests(previous_manifest, config_manifest)
+    if previous_manifest is not None:
+        log.info('Changed config packages: {}'.format(', '.join(config_diff['changed_packages']) or 'none'))
+
+    stable_artifacts = []
+    channel_artifacts = []
+
     # Render cluster package list artifact.
     cluster_package_list_filename = 'package_lists/{}.package_list.json'.format(cluster_package_list_id)
     os.makedirs(os.path.dirname(cluster_package_list_filename), mode=0o755, exist_ok=True)
@@ -758,11 +933,11 @@ def generate(
             'filename': package_filename
         }
 
-    # Render config packages.
-    for package_id_str in config_package_ids:
-        package_id = PackageId(package_id_str)
-        package_filename = cluster_package_info[package_id.name]['filename']
-        do_gen_package(rendered_templates[package_id.name + '.yaml'], cluster_package_info[package_id.name]['filename'])
+    # Render config packages. Reused packages are the same as the ones of the previous generation.
+    for name in config_package_names:
+        package_filename = cluster_package_info[name]['filename']
+        if name not in reused or not os.path.exists(package_filename):
+            do_gen_package(rendered_templates[name + '.yaml'], package_filename)
         stable_artifacts.append(package_filename)
 
     # Convert cloud-config to just contain write_files rather than root
@@ -805,5 +980,7 @@ def generate(
         'stable_artifacts': stable_artifacts,
         'channel_artifacts': channel_artifacts,
         'templates': rendered_templates,
+        'config_manifest': config_manifest,
+        'config_diff': config_diff,
         'utils': utils
     })
@@ -2,6 +2,7 @@
 
 import json
 from copy import deepcopy
+from functools import partial
 from typing import Tuple
 
 import boto3
@@ -363,7 +364,7 @@ def gen_supporting_template():
             cloudformation)
 
 
-def make_advanced_bundle(variant_args, extra_sources, template_name, cc_params):
+def make_advanced_bundle(variant_args, extra_sources, template_name, cc_params, base=None):
     extra_templates = [
         'aws/dcos-config.yaml',
         'aws/templates/advanced/{}'.format(template_name)
@@ -383,7 +384,8 @@ def make_advanced_bundle(variant_args, extra_sources, template_name, cc_params):
         extra_templates=extra_templates,
         extra_sources=extra_sources + [aws_base_source],
         # TODO(cmaloney): Merge this with dcos_installer/backend.py::get_aws_advanced_target()
-        extra_targets=[gen.internals.Target(variables={'cloudformation_s3_url_full'})])
+        extra_targets=[gen.internals.Target(variables={'cloudformation_s3_url_full'})],
+        base=base)
 
     cloud_config = results.templates['cloud-config.yaml']
 
@@ -414,7 +416,41 @@ def make_advanced_bundle(variant_args, extra_sources, template_name, cc_params):
     return (cloudformation, results)
 
 
-def gen_advanced_template(arguments, variant_prefix, reproducible_artifact_path, os_type):
+def make_advanced_master(arguments, variant_prefix, reproducible_artifact_path, os_type, extra_sources,
+                         template_name, params, num_masters, base=None):
+    master_tk = '{}-advanced-master-{}'.format(os_type, num_masters)
+    print('Building {} master for num_masters = {}'.format(os_type, num_masters))
+    num_masters_source = Source()
+    num_masters_source.add_must('num_masters', str(num_masters))
+    bundle = make_advanced_bundle(arguments,
+                                  extra_sources + [num_masters_source],
+                                  template_name,
+                                  deepcopy(params),
+                                  base)
+    yield from _as_artifact_and_pkg(variant_prefix, '{}.json'.format(master_tk), bundle)
+
+    # Zen template corresponding to this number of masters
+    yield _as_cf_artifact(
+        '{}{}-zen-{}.json'.format(variant_prefix, os_type, num_masters),
+        render_cloudformation_transform(
+            resource_string("gen", "aws/templates/advanced/zen.json").decode(),
+            variant_prefix=variant_prefix,
+            reproducible_artifact_path=reproducible_artifact_path,
+            **bundle[1].arguments))
+
+
+def make_advanced_agent(arguments, variant_prefix, os_type, extra_sources, template_name, params, base=None):
+    bundle = make_advanced_bundle(arguments,
+                                  extra_sources,
+                                  template_name,
+                                  deepcopy(params),
+                                  base)
+    yield from _as_artifact_and_pkg(variant_prefix, '{}-{}'.format(os_type, template_name), bundle)
+
+
+def get_advanced_template_jobs(arguments, variant_prefix, reproducible_artifact_path, os_type, base=None):
+    """Return a list of functions which each generate some of the advanced templates for os_type."""
+    jobs = list()
     for node_type in ['master', 'priv-agent', 'pub-agent']:
         # TODO(cmaloney): This forcibly overwriting arguments might overwrite a user set argument
 
@@ -423,44 +459,43 @@ def gen_advanced_template(arguments, variant_prefix, reproducible_artifact_path,
         local_source = Source()
         local_source.add_must('os_type', os_type)
         local_source.add_must('region_to_ami_mapping', gen_ami_mapping({"coreos", "el7", "el7prereq"}))
-        params = cf_instance_groups[node_template_id]
+        params = deepcopy(cf_instance_groups[node_template_id])
         params['report_name'] = aws_advanced_report_names[node_type]
         params['os_type'] = os_type
         params['node_type'] = node_type
-        template_key = 'advanced-{}'.format(node_type)
-        template_name = template_key + '.json'
-
-        def _as_artifact(filename, bundle):
-            yield from _as_artifact_and_pkg(variant_prefix, filename, bundle)
+        template_name = 'advanced-{}.json'.format(node_type)
 
         if node_type == 'master':
             for num_masters in [1, 3, 5, 7]:
-                master_tk = '{}-{}-{}'.format(os_type, template_key, num_masters)
-                print('Building {} {} for num_masters = {}'.format(os_type, node_type, num_masters))
-                num_masters_source = Source()
-                num_masters_source.add_must('num_masters', str(num_masters))
-                bundle = make_advanced_bundle(arguments,
-                                              [node_source, local_source, num_masters_source],
-                                              template_name,
-                                              deepcopy(params))
-                yield from _as_artifact('{}.json'.format(master_tk), bundle)
-
-                # Zen template corresponding to this number of masters
-                yield _as_cf_artifact(
-                    '{}{}-zen-{}.json'.format(variant_prefix, os_type, num_masters),
-                    render_cloudformation_transform(
-                        resource_string("gen", "aws/templates/advanced/zen.json").decode(),
-                        variant_prefix=variant_prefix,
-                        reproducible_artifact_path=reproducible_artifact_path,
-                        **bundle[1].arguments))
+                jobs.append(partial(
+                    make_advanced_master,
+                    arguments,
+                    variant_prefix,
+                    reproducible_artifact_path,
+                    os_type,
+                    [node_source, local_source],
+                    template_name,
+                    params,
+                    num_masters,
+                    base))
         else:
             local_source.add_must('num_masters', '1')
             local_source.add_must('nat_ami_mapping', gen_ami_mapping({"natami"}))
-            bundle = make_advanced_bundle(arguments,
-                                          [node_source, local_source],
-                                          template_name,
-                                          deepcopy(params))
-            yield from _as_artifact('{}-{}'.format(os_type, template_name), bundle)
+            jobs.append(partial(
+                make_advanced_agent,
+                arguments,
+                variant_prefix,
+                os_type,
+                [node_source, local_source],
+                template_name,
+                params,
+                base))
+    return jobs
+
+
+def gen_advanced_template(arguments, variant_prefix, reproducible_artifact_path, os_type):
+    for job in get_advanced_template_jobs(arguments, variant_prefix, reproducible_artifact_path, os_type):
+        yield from job()
 
 
 aws_simple_source = Source({
@@ -479,15 +514,19 @@ aws_simple_source = Source({
 })
 
 
-def gen_simple_template(variant_prefix, filename, arguments, extra_source):
+simple_templates = [
+    'aws/templates/cloudformation.json',
+    'aws/dcos-config.yaml',
+    'coreos-aws/cloud-config.yaml',
+    'coreos/cloud-config.yaml']
+
+
+def gen_simple_template(variant_prefix, filename, arguments, extra_source, base=None):
     results = gen.generate(
         arguments=arguments,
-        extra_templates=[
-            'aws/templates/cloudformation.json',
-            'aws/dcos-config.yaml',
-            'coreos-aws/cloud-config.yaml',
-            'coreos/cloud-config.yaml'],
-        extra_sources=[aws_base_source, aws_simple_source, extra_source])
+        extra_templates=simple_templates,
+        extra_sources=[aws_base_source, aws_simple_source, extra_source],
+        base=base)
 
     cloud_config = results.templates['cloud-config.yaml']
 
@@ -566,34 +605,44 @@ def gen_buttons(build_name, reproducible_artifact_path, tag, commit, variant_arg
         })
 
 
+def make_simple_template(variant_prefix, arguments, num_masters, filename, base=None):
+    num_masters_source = Source()
+    num_masters_source.add_must('num_masters', str(num_masters))
+    yield from gen_simple_template(
+        variant_prefix,
+        filename,
+        arguments,
+        num_masters_source,
+        base)
+
+
 def do_create(tag, build_name, reproducible_artifact_path, commit, variant_arguments, all_completes):
     # Generate the single-master and multi-master templates.
-
+    jobs = list()
     for bootstrap_variant, variant_base_args in variant_arguments.items():
         variant_prefix = pkgpanda.util.variant_prefix(bootstrap_variant)
 
-        def make(num_masters, filename):
-            num_masters_source = Source()
-            num_masters_source.add_must('num_masters', str(num_masters))
-            yield from gen_simple_template(
-                variant_prefix,
-                filename,
-                variant_base_args,
-                num_masters_source)
+        # Calculate the arguments all the templates of the variant share once up front.
+        base = gen.resolve(variant_base_args, simple_templates, [aws_base_source, aws_simple_source])
 
         # Single master templates
-        yield from make(1, 'single-master.cloudformation.json')
+        jobs.append(partial(
+            make_simple_template, variant_prefix, variant_base_args, 1, 'single-master.cloudformation.json', base))
 
         # Multi master templates
-        yield from make(3, 'multi-master.cloudformation.json')
+        jobs.append(partial(
+            make_simple_template, variant_prefix, variant_base_args, 3, 'multi-master.cloudformation.json', base))
 
         # Advanced templates
         for os_type in ['coreos', 'el7']:
-            yield from gen_advanced_template(
+            jobs += get_advanced_template_jobs(
                 variant_base_args,
                 variant_prefix,
                 reproducible_artifact_path,
-                os_type)
+                os_type,
+                base)
+
+    yield from util.run_jobs(jobs)
 
     # Button page linking to the basic templates.
     button_page = gen_buttons(build_name, reproducible_artifact_path, tag, commit, variant_arguments)
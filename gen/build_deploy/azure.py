@@ -5,6 +5,7 @@ import re
 import sys
 import urllib
 from copy import deepcopy
+from functools import partial
 
 import pkg_resources
 import yaml
@@ -103,14 +104,16 @@ def validate_cloud_config(cc_string):
         sys.exit(1)
 
 
-def transform(cloud_config_yaml_str):
+def transform(cloud_config):
     '''
-    Transforms the given yaml into a list of strings which are concatenated
+    Transforms the given cloud-config into a list of strings which are concatenated
     together by the ARM template system. We must make it a list of strings so
     that ARM template parameters appear at the top level of the template and get
     substituted.
+
+    @param cloud_config: dict, the cloud-config as loaded from its YAML
     '''
-    cc_json = json.dumps(yaml.safe_load(cloud_config_yaml_str), sort_keys=True)
+    cc_json = json.dumps(cloud_config, sort_keys=True)
 
     def _quote_literals(parts):
         for part, is_param in parts:
@@ -130,14 +133,14 @@ def transform(cloud_config_yaml_str):
 
 def render_arm(
         arm_template,
-        master_cloudconfig_yaml_str,
-        slave_cloudconfig_yaml_str,
-        slave_public_cloudconfig_yaml_str):
+        master_cloudconfig,
+        slave_cloudconfig,
+        slave_public_cloudconfig):
 
     template_str = gen.template.parse_str(arm_template).render({
-        'master_cloud_config': transform(master_cloudconfig_yaml_str),
-        'slave_cloud_config': transform(slave_cloudconfig_yaml_str),
-        'slave_public_cloud_config': transform(slave_public_cloudconfig_yaml_str)
+        'master_cloud_config': transform(master_cloudconfig),
+        'slave_cloud_config': transform(slave_cloudconfig),
+        'slave_public_cloud_config': transform(slave_public_cloudconfig)
     })
 
     # Add in some metadata to help support engineers
@@ -147,7 +150,7 @@ def render_arm(
     return json.dumps(template_json)
 
 
-def gen_templates(gen_arguments, arm_template, extra_sources):
+def gen_templates(gen_arguments, arm_template, extra_sources, base=None):
     '''
     Render the cloud_config template given a particular set of options
 
@@ -155,11 +158,13 @@ def gen_templates(gen_arguments, arm_template, extra_sources):
                      input arguments which get filled in/prompted for.
     @param arm_template: string, path to the source arm template for rendering
                          by the gen library (e.g. 'azure/templates/azuredeploy.json')
+    @param base: Resolver, the result of gen.resolve() for arguments shared with other templates
     '''
     results = gen.generate(
         arguments=gen_arguments,
         extra_templates=['azure/' + cloud_config_yaml, 'azure/templates/' + arm_template + '.json'],
-        extra_sources=[azure_base_source] + extra_sources)
+        extra_sources=[azure_base_source] + extra_sources,
+        base=base)
 
     cloud_config = results.templates[cloud_config_yaml]
 
@@ -171,13 +176,9 @@ def gen_templates(gen_arguments, arm_template, extra_sources):
     for variant, params in INSTANCE_GROUPS.items():
         cc_variant = deepcopy(cloud_config)
 
-        # Add roles
-        cc_variant = results.utils.add_roles(cc_variant, params['roles'] + ['azure'])
-
-        # NOTE: If this gets printed in string stylerather than '|' the Azure
-        # parameters which need to be split out for the arm to
-        # interpret end up all escaped and undoing it would be hard.
-        variant_cloudconfig[variant] = results.utils.render_cloudconfig(cc_variant)
+        # Add roles. The ARM template embeds the cloud-config as JSON (see transform()) so it
+        # isn't rendered as YAML.
+        variant_cloudconfig[variant] = results.utils.add_roles(cc_variant, params['roles'] + ['azure'])
 
     # Render the arm
     arm = render_arm(
@@ -233,7 +234,7 @@ azure_acs_source = Source({
 })
 
 
-def make_template(num_masters, gen_arguments, varietal, bootstrap_variant_prefix):
+def make_template(num_masters, gen_arguments, varietal, bootstrap_variant_prefix, base=None):
     '''
     Return a tuple: the generated template for num_masters and the artifact dict.
 
@@ -241,6 +242,7 @@ def make_template(num_masters, gen_arguments, varietal, bootstrap_variant_prefix
     @param gen_arguments: dict, args to pass to the gen library. These are user
                           input arguments which get filled in/prompted for.
     @param varietal: string, indicate template varietal to build for either 'acs' or 'dcos'
+    @param base: Resolver, the result of gen.resolve() for arguments shared with other templates
     '''
 
     master_list_source = Source()
@@ -251,12 +253,14 @@ def make_template(num_masters, gen_arguments, varietal, bootstrap_variant_prefix
         arm, results = gen_templates(
             gen_arguments,
             'azuredeploy',
-            extra_sources=[master_list_source, azure_dcos_source])
+            extra_sources=[master_list_source, azure_dcos_source],
+            base=base)
     elif varietal == 'acs':
         arm, results = gen_templates(
             gen_arguments,
             'acs',
-            extra_sources=[master_list_source, azure_acs_source])
+            extra_sources=[master_list_source, azure_acs_source],
+            base=base)
     else:
         raise ValueError("Unknown Azure varietal specified")
 
@@ -273,14 +277,27 @@ def make_template(num_masters, gen_arguments, varietal, bootstrap_variant_prefix
 
 
 def do_create(tag, build_name, reproducible_artifact_path, commit, variant_arguments, all_completes):
+    # Calculate the arguments all the templates of a bootstrap variant share once up front.
+    bases = {
+        bootstrap_name: gen.resolve(
+            gen_arguments,
+            ['azure/' + cloud_config_yaml, 'azure/templates/azuredeploy.json'],
+            [azure_base_source])
+        for bootstrap_name, gen_arguments in variant_arguments.items()}
+
+    jobs = list()
     for arm_t in ['dcos', 'acs']:
         for num_masters in [1, 3, 5]:
             for bootstrap_name, gen_arguments in variant_arguments.items():
-                yield from make_template(
+                jobs.append(partial(
+                    make_template,
                     num_masters,
                     gen_arguments,
                     arm_t,
-                    pkgpanda.util.variant_prefix(bootstrap_name))
+                    pkgpanda.util.variant_prefix(bootstrap_name),
+                    bases[bootstrap_name]))
+
+    yield from util.run_jobs(jobs)
 
     yield {
         'channel_path': 'azure.html',
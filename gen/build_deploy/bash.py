@@ -7,9 +7,6 @@ import shutil
 import subprocess
 import tempfile
 
-import checksumdir
-import pkg_resources
-
 import dcos_installer.config_util
 import gen.build_deploy.util as util
 import gen.template
@@ -36,6 +33,8 @@ def calculate_custom_check_bins_provided(custom_check_bins_dir):
 
 def calculate_custom_check_bins_hash(custom_check_bins_provided, custom_check_bins_dir):
     if custom_check_bins_provided == 'true':
+        # checksumdir imports pkg_resources, which is slow, so only import it when there are bins to hash.
+        import checksumdir
         return checksumdir.dirhash(custom_check_bins_dir, 'sha1')
     return ''
 
@@ -730,6 +729,8 @@ def make_custom_check_bins_package(source_dir, package_filename):
 
 
 def make_installer_docker(variant, variant_info, installer_info):
+    import pkg_resources
+
     bootstrap_id = variant_info['bootstrap']
     assert len(bootstrap_id) > 0
 
@@ -1,10 +1,12 @@
+import multiprocessing
 import os
 import os.path
 import shutil
 from datetime import datetime
 from subprocess import check_output
 
-from pkgpanda.util import write_json, write_string
+import gen.internals
+from pkgpanda.util import is_windows, write_json, write_string
 
 dcos_image_commit = os.getenv('DCOS_IMAGE_COMMIT', None)
 
@@ -16,6 +18,42 @@ if dcos_image_commit is None:
 
 template_generation_date = str(datetime.utcnow())
 
+config_manifest_filename = 'config-package-manifest.json'
+
+
+# The jobs of the running run_jobs() call. Worker processes are forked with them in place so they
+# only need to be told the index of the job to run. Jobs usually close over gen Sources which can't
+# be pickled.
+_jobs = None
+
+
+def _run_job(index):
+    return list(_jobs[index]())
+
+
+def run_jobs(jobs, processes=None):
+    """Run jobs in a pool of forked processes, yielding the artifacts of each in order.
+
+    Each job is a function returning an iterable of artifacts, the output is identical to running
+    the jobs one after the other. State the jobs share (ex: a base Resolver) should be computed
+    before calling this so all the worker processes inherit it. Jobs are run in this process if
+    forking isn't available, there is nothing to run concurrently or resolves are being profiled.
+    """
+    global _jobs
+    if is_windows or processes == 1 or len(jobs) < 2 or gen.internals.resolver_profile.enabled:
+        for job in jobs:
+            yield from job()
+        return
+
+    assert _jobs is None, "run_jobs() calls can't be nested"
+    _jobs = jobs
+    try:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            for artifacts in pool.imap(_run_job, range(len(jobs))):
+                yield from artifacts
+    finally:
+        _jobs = None
+
 
 def try_makedirs(path):
     try:
@@ -49,6 +87,9 @@ def do_bundle_onprem(gen_out, output_dir):
     # Write cluster package list ID
     write_string(output_dir + 'cluster-package-list.latest', gen_out.arguments['cluster_package_list_id'])
 
+    # Write the manifest of the config packages for later generations to compare with
+    write_json(output_dir + config_manifest_filename, gen_out.config_manifest)
+
 
 def variant_str(variant):
     """Return a string representation of variant."""
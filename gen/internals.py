@@ -1,13 +1,17 @@
+import atexit
 import copy
 import enum
 import inspect
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from functools import partial, partialmethod
 from typing import Any, Callable, Dict, List, Set, Tuple, Union
 
 from gen.exceptions import ValidationError
-from pkgpanda.util import hash_checkout
+from pkgpanda.util import hash_checkout, write_json
 
 
 log = logging.getLogger(__name__)
@@ -50,6 +54,31 @@ def function_id(function: Callable):
     }
 
 
+def function_name(function: Callable):
+    if isinstance(function, partial):
+        return function_name(function.func)
+    return function.__name__
+
+
+def io_bound(function: Callable):
+    """Mark a validate function as spending most of its time waiting on I/O (ex: cloud API calls).
+
+    I/O bound validate functions of several arguments are run after all arguments are calculated,
+    concurrently with the other validate functions. Those of a single argument are run when the
+    argument is calculated like any other, so that arguments failing them are errors before the
+    validate functions of several arguments run."""
+    function.is_io_bound = True
+    return function
+
+
+def is_io_bound(function: Callable):
+    return getattr(function, 'is_io_bound', False)
+
+
+# The most I/O bound validate functions run at once by a Validator.
+max_io_bound_validates = 8
+
+
 class Late:
     """A value which is going to be bound 'late' / is only known at cluster launch time."""
 
@@ -98,16 +127,19 @@ class Setter:
 
         if isinstance(value, str):
             self.calc = get_value
+            self.function_name = None
             self.parameters = set()
             self.is_late = False
         elif isinstance(value, Late):
             self.calc = late_bound_raise
+            self.function_name = None
             self.parameters = set()
             self.is_late = True
             self.late_expression = value.expression
         else:
             assert callable(value), "{} should be a string or callable. Got: {}".format(name, value)
             self.calc = value
+            self.function_name = function_name(value)
             self.parameters = get_function_parameters(value)
             self.is_late = False
 
@@ -423,6 +455,15 @@ class Resolvable:
         self._state = self.State.LATE
         self._value = LATE_BIND_PLACEHOLDER.format(self.name)
 
+    def finalize_from(self, other):
+        """Take on the final state of the same resolvable from a previous resolve."""
+        assert self._state == self.State.UNRESOLVED
+        assert other.name == self.name and other.is_finalized
+        self._state = other._state
+        self.error = other.error
+        self.setter = other.setter
+        self._value = other._value
+
     @property
     def value(self):
         assert self.is_resolved or self.is_late, "is_resolved() or is_late() must return true for " \
@@ -456,6 +497,101 @@ class ArgumentDict(dict):
         self._finalized = True
 
 
+class ResolverProfile:
+    """Records where the time resolving configurations goes.
+
+    For every argument calculated (by its setter) and every validate function called this counts the
+    calls and sums the cumulative time, including calculating the arguments it depends on, and the
+    self time, excluding that. Only resolves in the current process are recorded.
+    """
+
+    def __init__(self, filename=None):
+        self.enabled = False
+        self.clear()
+        if filename:
+            self.enabled = True
+            atexit.register(self.report, filename)
+
+    def clear(self):
+        # kind ('setter' or 'validator') -> name -> {'count', 'cumulative', 'self'}
+        self._entries = {'setter': dict(), 'validator': dict()}
+        # argument name -> name of the function last used to calculate it
+        self._functions = dict()
+        # [{'seconds': time spent, 'order': names of the arguments in the order they were calculated}]
+        self._resolves = list()
+        # Time spent in nested measurements, per measurement in progress.
+        self._child_times = list()
+
+    @contextmanager
+    def measure(self, kind, name):
+        if not self.enabled:
+            yield
+            return
+
+        self._child_times.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            child_time = self._child_times.pop()
+            if self._child_times:
+                self._child_times[-1] += elapsed
+            entry = self._entries[kind].setdefault(name, {'count': 0, 'cumulative': 0.0, 'self': 0.0})
+            entry['count'] += 1
+            entry['cumulative'] += elapsed
+            entry['self'] += elapsed - child_time
+
+    def add_resolve(self, seconds, order, arguments):
+        if not self.enabled:
+            return
+        self._resolves.append({'seconds': seconds, 'order': list(order)})
+        for name in order:
+            setter = arguments[name].setter
+            self._functions[name] = setter.function_name if setter is not None else None
+
+    def to_dict(self):
+        setters = {
+            name: dict(entry, function=self._functions.get(name))
+            for name, entry in self._entries['setter'].items()}
+        return {
+            'setters': setters,
+            'validators': {name: dict(entry) for name, entry in self._entries['validator'].items()},
+            'resolves': [dict(resolve, order=list(resolve['order'])) for resolve in self._resolves],
+            'total': sum(resolve['seconds'] for resolve in self._resolves)
+        }
+
+    def top(self, count=20):
+        """Return the count setters and validate functions with the most self time.
+
+        Each is a tuple (kind, name, function, calls, cumulative seconds, self seconds)."""
+        rows = list()
+        for kind, entries in sorted(self._entries.items()):
+            for name, entry in entries.items():
+                function = self._functions.get(name) if kind == 'setter' else name
+                rows.append((kind, name, function, entry['count'], entry['cumulative'], entry['self']))
+        return sorted(rows, key=lambda row: (-row[5], row[0], row[1]))[:count]
+
+    def format_top(self, count=20):
+        lines = ["{} resolves took {:.3f}s. Top setters and validate functions by self time:".format(
+            len(self._resolves), sum(resolve['seconds'] for resolve in self._resolves))]
+        lines.append("{:<9} {:<40} {:<40} {:>6} {:>10} {:>10}".format(
+            'kind', 'name', 'function', 'calls', 'cumulative', 'self'))
+        for kind, name, function, calls, cumulative, self_time in self.top(count):
+            lines.append("{:<9} {:<40} {:<40} {:>6} {:>10.4f} {:>10.4f}".format(
+                kind, name, function or '-', calls, cumulative, self_time))
+        return '\n'.join(lines)
+
+    def report(self, filename):
+        print(self.format_top())
+        write_json(filename, self.to_dict())
+        print("Resolver profile written to {}".format(filename))
+
+
+# Setting DCOS_GEN_PROFILE to a filename profiles all resolves, writing the report to it on exit.
+resolver_profile = ResolverProfile(os.getenv('DCOS_GEN_PROFILE'))
+
+
 class Validator:
     """Holds a collection of validate functions, and can be asked to call them"""
 
@@ -469,19 +605,32 @@ class Validator:
         self._validate_by_arg = dict()
         self._multi_arg_validate = dict()
 
+        # parameter set -> (arguments it was validated with, error message or None)
+        self.multi_arg_results = dict()
+
+        # argument name or parameter set -> ids of the validate functions for it. Used to tell
+        # whether two Validators validate an argument the same way.
+        self.ids = dict()
+
         for function in validate_functions:
             parameters = get_function_parameters(function)
             # Could build up the single and multi parameter validation function maps in the same
             # thing but the timing / handling of when and how we run single vs. multi-parameter
             # validation functions is fairly different, the extra bit here simplifies the later code.
             if len(parameters) == 1:
-                self._validate_by_arg.setdefault(parameters.pop(), list()).append(function)
+                key = parameters.pop()
+                self._validate_by_arg.setdefault(key, list()).append(function)
             else:
-                self._multi_arg_validate.setdefault(frozenset(parameters), list()).append(function)
+                key = frozenset(parameters)
+                self._multi_arg_validate.setdefault(key, list()).append(function)
+            self.ids.setdefault(key, list()).append(hash_checkout(function_id(function)))
 
         for target in targets:
             for parameter, function in target.yield_validates():
                 self._validate_by_arg.setdefault(parameter, list()).append(function)
+                self.ids.setdefault(parameter, list()).append(hash_checkout({
+                    'type': 'one_of',
+                    'valid_values': sorted(function.keywords['valid_values'])}))
 
     def validate_single(self, name: str, value: str):
         """Calls all validate functions which validate the given parameter name
@@ -492,14 +641,25 @@ class Validator:
         validate_fns = self._validate_by_arg.get(name)
         if validate_fns is not None:
             for validate_fn in validate_fns:
-                validate_fn(value)
+                with resolver_profile.measure('validator', function_name(validate_fn)):
+                    validate_fn(value)
 
     # TODO(cmaloney): The distance between the validate_single and multi_arg_validate interface,
     # while necessary for efficient functioning currently, is showing that there is tension between
     # how / when each is run. Moving the multi-argument validation to as soon as possible after an
     # argument set is finalized rather than one big pass at the end would likely make it much
     # cleaner.
-    def yield_multi_argument_validate_errors(self, arguments: ArgumentDict):
+    def yield_multi_argument_validate_errors(self, arguments: ArgumentDict, previous=None):
+        """Yield (parameter set, message) for each failing multi-argument validate function.
+
+        previous is a Validator which ran before. Validate functions which it ran as well, with
+        the same arguments, aren't re-run.
+
+        Validate functions marked io_bound() run in a thread pool while the others run. Failures
+        are always yielded in the order of the validate functions.
+        """
+        # (parameter set, arguments to validate with, validate functions or None to reuse error, error)
+        checks = list()
         for parameter_set, validate_fns in self._multi_arg_validate.items():
             # Build up argument map for validate function. If any arguments are
             # unset then skip this validate function.
@@ -523,13 +683,55 @@ class Validator:
             if skip:
                 continue
 
-            # Call the validation function, catching AssertionErrors and turning them into errors in
-            # the error dictionary.
-            try:
-                for validate_fn in validate_fns:
+            previous_kwargs, error = None, None
+            if previous is not None and previous.ids.get(parameter_set) == self.ids[parameter_set]:
+                previous_kwargs, error = previous.multi_arg_results.get(parameter_set, (None, None))
+            if previous_kwargs != kwargs:
+                checks.append((parameter_set, kwargs, validate_fns, None))
+            else:
+                checks.append((parameter_set, kwargs, None, error))
+
+        # Measuring the profile isn't thread safe, so I/O bound validate functions are run in order
+        # with the others when profiling.
+        io_bound_checks = list()
+        if not resolver_profile.enabled:
+            io_bound_checks = [
+                (parameter_set, kwargs, validate_fns) for parameter_set, kwargs, validate_fns, _ in checks
+                if validate_fns is not None and any(map(is_io_bound, validate_fns))]
+
+        futures = dict()
+        executor = None
+        if io_bound_checks:
+            executor = ThreadPoolExecutor(min(max_io_bound_validates, len(io_bound_checks)))
+        try:
+            for parameter_set, kwargs, validate_fns in io_bound_checks:
+                futures[parameter_set] = executor.submit(self._run_multi_argument_validate, validate_fns, kwargs)
+
+            for parameter_set, kwargs, validate_fns, error in checks:
+                if parameter_set in futures:
+                    error = futures[parameter_set].result()
+                elif validate_fns is not None:
+                    error = self._run_multi_argument_validate(validate_fns, kwargs)
+
+                self.multi_arg_results[parameter_set] = (kwargs, error)
+                if error is not None:
+                    yield (parameter_set, error)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    @staticmethod
+    def _run_multi_argument_validate(validate_fns, kwargs):
+        """Return the error message of the first failing validate function, None if all pass."""
+        # Call the validation function, catching AssertionErrors and turning them into errors in
+        # the error dictionary.
+        try:
+            for validate_fn in validate_fns:
+                with resolver_profile.measure('validator', function_name(validate_fn)):
                     validate_fn(**kwargs)
-            except AssertionError as ex:
-                yield (parameter_set, ex.args[0])
+        except AssertionError as ex:
+            return ex.args[0]
+        return None
 
 
 # Depth first search argument calculator. Detects cycles, as well as unmet
@@ -537,7 +739,11 @@ class Validator:
 # TODO(cmaloney): Separate chain / path building when unwinding from the root
 #                 error messages.
 class Resolver:
-    def __init__(self, setters, validate_fns, targets):
+    def __init__(self, setters, validate_fns, targets, previous=None, changed: Set[str]=frozenset()):
+        """previous: a resolved Resolver to reuse the results of, see get_unaffected().
+
+        changed: names of arguments which should be recalculated rather than reused from previous
+        in addition to the ones whose setters or validate functions differ from those of previous."""
         self._resolved = False
         self._setters = setters
         self._targets = targets
@@ -556,6 +762,78 @@ class Resolver:
 
         self._validator = Validator(validate_fns, targets)
 
+        # name -> names of the arguments used to calculate it, in the order they were first used.
+        self._dependencies = dict()
+
+        # Names of the arguments calculated (not reused from previous), in the order calculating them started.
+        self._calculated = list()
+
+        self._previous = previous
+        self._reusable = set()
+        if previous is not None:
+            self._reusable = previous.get_unaffected(setters, self._validator, changed)
+
+    def get_unaffected(self, setters, validator: Validator, changed: Set[str]):
+        """Return the names of the arguments whose results a resolve with the given inputs can reuse.
+
+        Those are all arguments which don't depend on, directly or indirectly, an argument in
+        changed or an argument whose setters or validate functions differ. The targets may differ
+        as well, arguments only needed by some of the targets just aren't reused by the others.
+        """
+        assert self._resolved, "Can only reuse the arguments of a resolved Resolver"
+
+        def setter_ids(setters, name):
+            return [hash_checkout(setter.make_id()) for setter in setters.get(name, list())]
+
+        affected = set(changed)
+        for name in setters.keys() | self._setters.keys():
+            if setter_ids(setters, name) != setter_ids(self._setters, name):
+                affected.add(name)
+        for name in validator.ids.keys() | self._validator.ids.keys():
+            if isinstance(name, str) and validator.ids.get(name) != self._validator.ids.get(name):
+                affected.add(name)
+
+        dependents = dict()
+        for name, dependencies in self._dependencies.items():
+            for dependency in dependencies:
+                dependents.setdefault(dependency, set()).add(name)
+
+        to_visit = list(affected)
+        while to_visit:
+            for dependent in dependents.get(to_visit.pop(), set()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    to_visit.append(dependent)
+
+        return self._arguments.keys() - affected
+
+    def _get_dependency(self, name):
+        """Get the resolvable for name, recording it as used by the resolvable being calculated."""
+        if self._eval_stack:
+            dependencies = self._dependencies.setdefault(self._eval_stack[-1], list())
+            if name not in dependencies:
+                dependencies.append(name)
+        return self._arguments[name]
+
+    def _reuse(self, resolvable):
+        name = resolvable.name
+        resolvable.finalize_from(self._previous._arguments[name])
+        if name in self._previous._errors:
+            self._errors[name] = self._previous._errors[name]
+        if name in self._previous._unset:
+            self._unset.add(name)
+        if name in self._previous._late:
+            self._late.add(name)
+
+        # Bring in the arguments it depends on in the order they were originally calculated so the
+        # arguments are exactly those (in the same order) of calculating everything again.
+        # Dependencies of an unaffected argument are unaffected as well.
+        dependencies = self._previous._dependencies.get(name, list())
+        if dependencies:
+            self._dependencies[name] = list(dependencies)
+        for dependency in dependencies:
+            self._ensure_finalized(self._arguments[dependency])
+
     def _calculate(self, resolvable):
         # Filter out any setters which have predicates / conditions which are
         # satisfiably false.
@@ -591,7 +869,7 @@ class Resolver:
         # after we have the final values for late-bound variables.
         def has_no_late_parameters(setter) -> bool:
             for parameter in setter.parameters:
-                self._ensure_finalized(self._arguments[parameter])
+                self._ensure_finalized(self._get_dependency(parameter))
                 if self._arguments[parameter].is_late:
                     return False
             return True
@@ -656,12 +934,17 @@ class Resolver:
         if resolvable.is_finalized:
             return
 
+        if resolvable.name in self._reusable:
+            self._reuse(resolvable)
+            return
+
         # Calculate the value, noting that we're in the context of calculating it.
         # NOTE: _stack_layer is outside the try/except so if we find a loop, it will report /
         # finalize on the first instance we passed, rather than finalizing once immediately for
         # the second time the resolvable was encountered, and then trying to finalize a second time
         # when the stack unwinds.
-        with self._stack_layer(resolvable.name):
+        with self._stack_layer(resolvable.name), resolver_profile.measure('setter', resolvable.name):
+            self._calculated.append(resolvable.name)
             try:
                 resolvable.finalize_value(*self._calculate(resolvable))
             except LateBoundException:
@@ -680,7 +963,7 @@ class Resolver:
 
     def _resolve_name(self, name):
         try:
-            resolvable = self._arguments[name]
+            resolvable = self._get_dependency(name)
 
             # Ensure the resolvable is resolved
             self._ensure_finalized(resolvable)
@@ -748,13 +1031,22 @@ class Resolver:
     def resolve(self):
         assert not self._resolved, "Resolvers should only be resolved once"
         self._resolved = True
+        start = time.perf_counter()
 
         for target in self._targets:
             self._calculate_target(target)
 
-        for parameter_set, error in self._validator.yield_multi_argument_validate_errors(self._arguments):
+        previous_validator = self._previous._validator if self._previous else None
+        for parameter_set, error in self._validator.yield_multi_argument_validate_errors(
+                self._arguments, previous_validator):
             self._errors[parameter_set] = error
 
+        resolver_profile.add_resolve(time.perf_counter() - start, self._calculated, self._arguments)
+
+        # Don't keep the whole chain of previous resolvers alive.
+        self._previous = None
+        self._reusable = set()
+
     @property
     def arguments(self):
         assert self._resolved, "Can't get arguments until they've been resolved"
@@ -802,7 +1094,20 @@ class Resolver:
         }
 
 
-def resolve_configuration(sources: List[Source], targets: List[Target]):
+def resolve_configuration(
+        sources: List[Source],
+        targets: List[Target],
+        previous: Resolver=None,
+        changed: Set[str]=frozenset()):
+    """Calculate and validate all the arguments needed by targets.
+
+    When re-validating after a small change of the sources, or resolving a variant of some base
+    configuration, passing the Resolver returned for the previous / base sources as previous only
+    re-calculates the arguments affected by the differences. The result is identical to resolving
+    from scratch. Arguments whose setters or validate functions differ are detected automatically,
+    changed may name additional ones (ex: a function setter with the same name and parameters but
+    different behavior).
+    """
 
     # Merge the sources into a big dictionary of setters + validators, ensuring
     # that all setters are either strings or functions.
@@ -837,7 +1142,7 @@ def resolve_configuration(sources: List[Source], targets: List[Target]):
         validate += source.validate
 
     # Use setters to calculate every required parameter
-    resolver = Resolver(setters, validate, targets)
+    resolver = Resolver(setters, validate, targets, previous, changed)
     resolver.resolve()
 
     def target_finalized(target):
@@ -0,0 +1,205 @@
+"""Serve gen.validate() and gen.generate() from a long running process.
+
+Starting a process for every configuration generation means importing gen, parsing the templates
+and loading the calc modules every time. The service keeps all of that in memory (parsed templates,
+loaded YAML template skeletons) between requests. Results are the same as calling gen directly.
+
+Requests are JSON objects POSTed to a local HTTP server, listening either on a Unix socket or on a
+localhost TCP port:
+
+- /validate {"arguments": {...}} returns the gen.validate() status.
+- /generate {"arguments": {...}, "previous_manifest": {...}} generates the configuration into the
+  working directory of the service like gen.generate() and returns what it returned. If the
+  configuration is invalid the validation status is returned instead.
+
+Requests are handled one at a time since generating uses the working directory.
+"""
+import argparse
+import http.client
+import http.server
+import json
+import logging
+import os
+import socket
+import socketserver
+
+import gen
+from gen.exceptions import ValidationError
+
+log = logging.getLogger(__name__)
+
+
+def _status_to_json(status):
+    if 'unset' in status:
+        status = dict(status, unset=sorted(status['unset']))
+    return status
+
+
+class Service:
+    """Handles the requests, given the extra sources and templates to generate with."""
+
+    def __init__(self, extra_sources=list(), extra_templates=list()):
+        self.extra_sources = extra_sources
+        self.extra_templates = extra_templates
+
+    def validate(self, arguments):
+        try:
+            status = gen.validate(arguments, self.extra_templates, self.extra_sources)
+        except ValidationError as ex:
+            status = {'status': 'errors', 'errors': ex.errors, 'unset': ex.unset}
+        return _status_to_json(status)
+
+    def generate(self, arguments, previous_manifest=None):
+        try:
+            gen_out = gen.generate(
+                arguments,
+                extra_templates=self.extra_templates,
+                extra_sources=self.extra_sources,
+                previous_manifest=previous_manifest)
+        except ValidationError as ex:
+            return _status_to_json({'status': 'errors', 'errors': ex.errors, 'unset': ex.unset})
+        return {
+            'status': 'ok',
+            'arguments': gen_out.arguments,
+            'cluster_packages': gen_out.cluster_packages,
+            'stable_artifacts': gen_out.stable_artifacts,
+            'channel_artifacts': gen_out.channel_artifacts,
+            'templates': gen_out.templates,
+            'config_manifest': gen_out.config_manifest,
+            'config_diff': gen_out.config_diff,
+        }
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        # Handler and the parameters it accepts by path.
+        actions = {
+            '/validate': (self.server.service.validate, {'arguments'}),
+            '/generate': (self.server.service.generate, {'arguments', 'previous_manifest'}),
+        }
+        # Read the whole request before responding so the client isn't cut off.
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path not in actions:
+            self._respond(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+        action, parameters = actions[self.path]
+        try:
+            body = json.loads(body.decode('utf-8'))
+        except ValueError as ex:
+            self._respond(400, {'error': 'Invalid JSON: {}'.format(ex)})
+            return
+        if not isinstance(body, dict) or 'arguments' not in body or not body.keys() <= parameters:
+            self._respond(400, {'error': 'Expected a JSON object of {}'.format(', '.join(sorted(parameters)))})
+            return
+        try:
+            result = action(**body)
+        except Exception as ex:
+            log.exception('Handling %s failed', self.path)
+            self._respond(500, {'error': repr(ex)})
+        else:
+            self._respond(200, result)
+
+    def _respond(self, code, data):
+        body = json.dumps(data, sort_keys=True).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+
+    def __init__(self, path, service):
+        self.service = service
+        super().__init__(path, RequestHandler)
+
+
+class TCPHTTPServer(http.server.HTTPServer):
+
+    def __init__(self, port, service):
+        self.service = service
+        super().__init__(('127.0.0.1', port), RequestHandler)
+
+
+def make_server(service, socket_path=None, port=None):
+    """Return a server for service listening on socket_path or on the localhost port."""
+    assert (socket_path is None) != (port is None), 'Exactly one of socket_path and port must be given'
+    if socket_path is not None:
+        return UnixHTTPServer(socket_path, service)
+    return TCPHTTPServer(port, service)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def call(action, socket_path=None, port=None, timeout=None, **body):
+    """Send a request to a running service and return the decoded response.
+
+    ex: call('validate', socket_path='genconf/gen.sock', arguments=arguments)"""
+    assert (socket_path is None) != (port is None), 'Exactly one of socket_path and port must be given'
+    if socket_path is not None:
+        connection = UnixHTTPConnection(socket_path, timeout)
+    else:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        connection.request(
+            'POST', '/' + action, json.dumps(body).encode('utf-8'), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        data = json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise Exception('gen service request {} failed ({}): {}'.format(action, response.status, data['error']))
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve DC/OS configuration validation and generation.')
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument('--socket', help='Path of the Unix socket to listen on')
+    address.add_argument('--port', type=int, help='Localhost TCP port to listen on')
+    parser.add_argument(
+        '--onprem', action='store_true', help='Include the on-premises installer configuration like dcos_installer')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    extra_sources = list()
+    if args.onprem:
+        # Only imported when needed, it requires the DC/OS image commit.
+        import gen.build_deploy.bash
+        extra_sources.append(gen.build_deploy.bash.onprem_source)
+
+    if args.socket and os.path.exists(args.socket):
+        os.remove(args.socket)
+    server = make_server(Service(extra_sources), args.socket, args.port)
+    log.info('Serving on %s', args.socket or '127.0.0.1:{}'.format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
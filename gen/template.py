@@ -15,13 +15,19 @@
 #   switch <identifier>
 #   case <string>:
 #   endswith
+import hashlib
+import os
+import pickle
+import re
+import tempfile
 from typing import Optional, Tuple
 
-from pkg_resources import resource_string
-
 import gen.internals
 
 identifier_valid_characters = 'abcdefghijklmnopqrstuvwxyz_0123456789'
+_identifier_re = re.compile('[{}]*'.format(identifier_valid_characters))
+# Characters inside a string which need no special handling (not a quote, escape or newline).
+_string_chars_re = re.compile(r'[^"\\\n\r]*')
 
 
 class SyntaxError(Exception):
@@ -41,7 +47,9 @@ class Tokenizer:
 
     def __init__(self, corpus: str):
         self.__corpus = corpus
-        self.__to_lex = corpus
+        # Position of the next character to lex. Only positions are tracked while lexing, the
+        # corpus is never re-sliced so tokenizing is linear in the size of the template.
+        self.__lex_pos = 0
 
         self.__token_pos = 0
         self.tokens = []
@@ -51,7 +59,7 @@ class Tokenizer:
                 kind, value = self.__read_token()
             except SyntaxError as ex:
                 # TOOD(cmaloney): Calculate line and column information
-                context = "context: '{}'".format(self.__to_lex[:10])
+                context = "context: '{}'".format(self.__corpus[self.__lex_pos:self.__lex_pos + 10])
                 raise SyntaxError(
                     "ERROR parsing code near {}. {}".format(context, ex)) from ex
             self.tokens.append((kind, value))
@@ -69,150 +77,157 @@ class Tokenizer:
         self.__token_pos += 1
         return self.tokens[self.__token_pos]
 
+    def __startswith(self, prefix):
+        return self.__corpus.startswith(prefix, self.__lex_pos)
+
+    def __skip(self, count):
+        self.__lex_pos += count
+
     def __read_token(self):
-        # __to_lex is set to none after the EOF token is emitted.
-        assert self.__to_lex is not None
+        corpus = self.__corpus
 
-        if len(self.__to_lex) == 0:
-            self.__to_lex = None
+        # __lex_pos is set to none after the EOF token is emitted.
+        assert self.__lex_pos is not None
+
+        if self.__lex_pos == len(corpus):
+            self.__lex_pos = None
             return "eof", None
 
         # If not starting with '{', consume text until we find '{' as a blob
         # token.
-        if self.__to_lex[0] != '{':
-            split = self.__to_lex.split('{', 1)
-            assert(len(split) == 1 or len(split) == 2)
-
-            if len(split) == 2:
-                self.__to_lex = '{' + split[1]
-            else:
+        if corpus[self.__lex_pos] != '{':
+            start = self.__lex_pos
+            end = corpus.find('{', start)
+            if end == -1:
                 # No remaining '{' in text. This is the end of the string.
-                self.__to_lex = ''
-            return 'blob', split[0]
+                end = len(corpus)
+            self.__lex_pos = end
+            return 'blob', corpus[start:end]
 
         # Process '{' beginning control sequences.
 
         # Define some helper functions used by multiple methods below.
         def read_whitespace():
-            if self.__to_lex[0] != ' ':
+            if corpus[self.__lex_pos] != ' ':
                 raise SyntaxError("Expected exactly one space")
-            if self.__to_lex[1].isspace():
+            if corpus[self.__lex_pos + 1].isspace():
                 raise SyntaxError(
                     "Found more spaces than expected. Only one space is allowed by coding convention.")
-            self.__to_lex = self.__to_lex[1:]
+            self.__skip(1)
 
         def read_identifier():
             # Before identifiers is always whitespace / we're in control where
             # whitespace is arbitrary.
             read_whitespace()
-            identifier = ""
-            while self.__to_lex[0] in identifier_valid_characters:
-                identifier += self.__to_lex[0]
-                self.__to_lex = self.__to_lex[1:]
+            end = _identifier_re.match(corpus, self.__lex_pos).end()
+            identifier = corpus[self.__lex_pos:end]
+            self.__lex_pos = end
             return identifier
 
         def read_str():
             read_whitespace()
-            if not self.__to_lex.startswith('"'):
+            if not self.__startswith('"'):
                 raise SyntaxError(
                     "Expected string starting with '\"' as value for case but didn't find it.")
-            self.__to_lex = self.__to_lex[1:]
+            self.__skip(1)
 
-            value = ""
-            has_backslash = False
+            value = []
             while True:
-                if len(self.__to_lex) == 0:
-                    raise SyntaxError(
-                        "Unexpected end of file when reading contents of string")
-
-                cur = self.__to_lex[0]
-                self.__to_lex = self.__to_lex[1:]
+                # Consume everything up to the next character which needs special handling at once.
+                end = _string_chars_re.match(corpus, self.__lex_pos).end()
+                value.append(corpus[self.__lex_pos:end])
+                self.__lex_pos = end
+
+                cur = read_string_char()
+                if cur == '"':
+                    return ''.join(value)
+
+                # Backslash escape
+                cur = read_string_char()
+                if cur in ['"', '\\']:
+                    value.append(cur)
+                else:
+                    raise SyntaxError("Invalid escape sequence \\{} in quote".format(cur))
 
-                if cur in ['\n', '\r']:
-                    raise SyntaxError("Newlines aren't allowed in strings")
+        def read_string_char():
+            if self.__lex_pos == len(corpus):
+                raise SyntaxError(
+                    "Unexpected end of file when reading contents of string")
 
-                if has_backslash:
-                    if cur in ['"', '\\']:
-                        value += cur
-                    else:
-                        raise SyntaxError("Invalid escape sequence \\{} in quote".format(cur))
-                    has_backslash = False
-                    continue
+            cur = corpus[self.__lex_pos]
+            self.__skip(1)
 
-                if cur == '\\':
-                    has_backslash = True
-                elif cur == '"':
-                    return value
-                else:
-                    value += cur
+            if cur in ['\n', '\r']:
+                raise SyntaxError("Newlines aren't allowed in strings")
+            return cur
 
         def read_end_control_group():
             # Arbitrary whitespace is allowed before end of the control group
             read_whitespace()
-            if not self.__to_lex.startswith('%}'):
+            if not self.__startswith('%}'):
                 raise SyntaxError(
                     "Expected end of control group '%}' after control statement but didn't find it.")
-            self.__to_lex = self.__to_lex[2:]
+            self.__skip(2)
 
         # Note: We want the longest match to win. Since we are doing prefix
         # matching that means we must test the longest strings which have
         # prefixes which are also valid tokens first.
-        if self.__to_lex.startswith('{{{{'):
-            self.__to_lex = self.__to_lex[4:]
+        if self.__startswith('{{{{'):
+            self.__skip(4)
             return "blob", "{{"
-        if self.__to_lex.startswith('{{{'):
+        if self.__startswith('{{{'):
             raise SyntaxError(
                 "{{{ is illegal. To make an argument substitution use " +
                 "{{ <identifier> }}. To make '{{' use '{{{{'. To make '{{{' " +
                 "use '{{{{{' (the first for become two, then the last is left" +
                 " alone since it is all alone)")
-        elif self.__to_lex.startswith('{%'):
+        elif self.__startswith('{%'):
             # TODO(cmaloney): There is fairly specific parsing happening in control and ident rather
             # than doing what they probably _should_ be doing for generic parsing. There is some
             # duplicated code. That should be removed / refactored at some point.
             # switch <identifier>
             # case <string>
             # endswitch
-            self.__to_lex = self.__to_lex[2:]
+            self.__skip(2)
 
             # Clean leading whitespace
             read_whitespace()
 
-            if self.__to_lex.startswith("switch"):
-                self.__to_lex = self.__to_lex[6:]
+            if self.__startswith("switch"):
+                self.__skip(6)
                 identifier = read_identifier()
                 read_end_control_group()
                 return "switch", identifier
-            elif self.__to_lex.startswith("case"):
-                self.__to_lex = self.__to_lex[4:]
+            elif self.__startswith("case"):
+                self.__skip(4)
                 value = read_str()
                 read_end_control_group()
                 return "case", value
-            elif self.__to_lex.startswith("endswitch"):
-                self.__to_lex = self.__to_lex[9:]
+            elif self.__startswith("endswitch"):
+                self.__skip(9)
                 read_end_control_group()
                 return "endswitch", None
-            elif self.__to_lex.startswith("for"):
-                self.__to_lex = self.__to_lex[3:]
+            elif self.__startswith("for"):
+                self.__skip(3)
                 new_var = read_identifier()
                 read_whitespace()
-                if not self.__to_lex.startswith("in"):
+                if not self.__startswith("in"):
                     raise SyntaxError("Expected {% for foo in bar %}, didn't find the ' in'.")
-                self.__to_lex = self.__to_lex[2:]
+                self.__skip(2)
                 iterable = read_identifier()
                 read_end_control_group()
                 return "for", (new_var, iterable)
-            elif self.__to_lex.startswith("endfor"):
-                self.__to_lex = self.__to_lex[6:]
+            elif self.__startswith("endfor"):
+                self.__skip(6)
                 read_end_control_group()
                 return "endfor", None
             else:
                 raise SyntaxError(
                     "Unknown control group directive. Expected switch, case, or endswitch.")
-        elif self.__to_lex.startswith("{{"):
+        elif self.__startswith("{{"):
             # whitespace ident whitespace close_curly
             # Clean of leading whitespace
-            self.__to_lex = self.__to_lex[2:]
+            self.__skip(2)
 
             try:
                 identifier = read_identifier()
@@ -228,21 +243,21 @@ class Tokenizer:
 
             # Optionally a filter expresion
             filter_id = None
-            if self.__to_lex.startswith('|'):
-                self.__to_lex = self.__to_lex[1:]
+            if self.__startswith('|'):
+                self.__skip(1)
                 filter_id = read_identifier()
                 read_whitespace()
 
             # Close curly braces
-            if not self.__to_lex.startswith('}}'):
+            if not self.__startswith('}}'):
                 raise SyntaxError(
                     "Expected '}}' after '{{ <identifier>' but didn't find it.")
 
-            self.__to_lex = self.__to_lex[2:]
+            self.__skip(2)
             return "replacement", (identifier, filter_id)
         else:
             # Was just a single open curly, we're a single curly blob
-            self.__to_lex = self.__to_lex[1:]
+            self.__skip(1)
             return "blob", "{"
 
 # Language:
@@ -313,6 +328,19 @@ class Template:
         self.ast = ast
 
     def render(self, arguments: dict, filters: dict={}):
+        # Collect the pieces and join them once, repeatedly appending to a str is quadratic.
+        rendered = []
+        self.render_to(rendered.append, arguments, filters)
+        return ''.join(rendered)
+
+    def render_to(self, write, arguments: dict, filters: dict={}, write_replacement=None):
+        """Render the template by passing each piece of output to write().
+
+        write is typically the write method of a text file or list.append. Output already written
+        when rendering fails (ex: UnsetParameter) is not taken back. If write_replacement is given
+        the output of replacements is passed to it rather than write."""
+        if write_replacement is None:
+            write_replacement = write
 
         def get_argument(name):
             try:
@@ -321,24 +349,23 @@ class Template:
                 raise UnsetParameter("Unset parameter {}".format(name), name) from ex
 
         def render_ast(ast):
-            rendered = ""
             for chunk in ast:
                 if isinstance(chunk, Switch):
                     choice = get_argument(chunk.identifier)
                     if choice not in chunk.cases:
                         raise ValueError("switch %s: value `%s` is not in the set of handled cases" % (
                             chunk.identifier, choice))
-                    rendered += render_ast(chunk.cases[choice])
+                    render_ast(chunk.cases[choice])
                 elif isinstance(chunk, Replacement):
                     value = get_argument(chunk.identifier)
                     if chunk.filter is None:
-                        rendered += str(value)
+                        write_replacement(str(value))
                     else:
                         try:
                             filter_func = filters[chunk.filter]
                         except KeyError:
                             raise UnsetParameter("Unset filter parameter {}".format(chunk.filter), chunk.filter)
-                        rendered += str(filter_func(value))
+                        write_replacement(str(filter_func(value)))
                 elif isinstance(chunk, For):
                     # If the argument is a string, it should be a json list.
                     iterable = get_argument(chunk.iterable)
@@ -352,7 +379,7 @@ class Template:
                     assert isinstance(iterable, list)
                     for value in iterable:
                         arguments[chunk.new_var] = value
-                        rendered += render_ast(chunk.body)
+                        render_ast(chunk.body)
 
                     # Reset the argument to the original state.
                     if isinstance(original_value, UnsetMarker):
@@ -361,14 +388,12 @@ class Template:
                         arguments[chunk.new_var] = original_value
 
                 elif isinstance(chunk, str):
-                    rendered += chunk
+                    write(chunk)
                 else:
                     raise NotImplementedError(
                         "Unknown chunk type {}".format(type(chunk)))
 
-            return rendered
-
-        return render_ast(self.ast)
+        render_ast(self.ast)
 
     def target_from_ast(self):
         def variables_from_ast(ast, blacklist):
@@ -492,7 +517,74 @@ def _parse_chunks(tokenizer):
             return chunks
 
 
-def parse_str(text):
+def _get_parser_version():
+    """Return a hash of the parser's source, or None if it can't be read (ex: frozen builds).
+
+    Parse trees persisted by one version of the parser are never loaded by another."""
+    try:
+        with open(__file__, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+class TemplateCache:
+    """Parsed templates keyed by the sha256 of their text.
+
+    Templates are kept in memory for the life of the process. If a cache_dir is given they are
+    also pickled there so later processes don't have to parse them again. Entries on disk are
+    keyed by the parser version as well so changing the parser invalidates them."""
+
+    def __init__(self, cache_dir=None, parser_version=None):
+        self.cache_dir = cache_dir
+        self.parser_version = parser_version or _get_parser_version()
+        self._templates = dict()
+
+    def _get_filename(self, key):
+        if not self.cache_dir or not self.parser_version:
+            return None
+        return os.path.join(self.cache_dir, '{}-{}.pickle'.format(self.parser_version, key))
+
+    def _load(self, key):
+        filename = self._get_filename(key)
+        if filename is None:
+            return None
+        try:
+            with open(filename, 'rb') as f:
+                template = pickle.load(f)
+        except (OSError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+            return None
+        return template if isinstance(template, Template) else None
+
+    def _store(self, key, template):
+        filename = self._get_filename(key)
+        if filename is None:
+            return
+        # The cache is only an optimization, failing to write it must not fail parsing.
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile('wb', dir=self.cache_dir, delete=False) as f:
+                pickle.dump(template, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f.name, filename)
+        except OSError:
+            pass
+
+    def get(self, text):
+        key = hashlib.sha256(text.encode()).hexdigest()
+        template = self._templates.get(key)
+        if template is None:
+            template = self._load(key)
+            if template is None:
+                template = _parse(text)
+                self._store(key, template)
+            self._templates[key] = template
+        return template
+
+    def clear(self):
+        self._templates.clear()
+
+
+def _parse(text):
     tokenizer = Tokenizer(text)
     ast = _parse_chunks(tokenizer)
     token_type, _ = tokenizer.peek()
@@ -502,9 +594,22 @@ def parse_str(text):
     return Template(ast)
 
 
+# Setting DCOS_TEMPLATE_CACHE_DIR persists parsed templates across processes.
+template_cache = TemplateCache(os.getenv('DCOS_TEMPLATE_CACHE_DIR'))
+
+
+def parse_str(text):
+    """Parse a template, reusing the parse tree of identical text parsed before.
+
+    The returned template is shared between callers so must not be modified."""
+    return template_cache.get(text)
+
+
 def parse_resources(filename):
+    # pkg_resources is slow to import and not needed until templates are loaded.
+    import pkg_resources
     try:
-        return parse_str(resource_string(__name__, filename).decode())
+        return parse_str(pkg_resources.resource_string(__name__, filename).decode())
     except SyntaxError as ex:
         # Don't accidentally overwrite a previously set filename. Shouldn't
         # happen since no code this calls sets ex.filename.
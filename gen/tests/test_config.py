@@ -844,3 +844,27 @@ def test_edited_ip_detect_script_yields_new_packages():
 
         # Running genconf with an edited IP detect script yields a new set of packages.
         assert initial_cluster_packages != edited_cluster_packages
+
+
+@pytest.mark.skipif(pkgpanda.util.is_windows, reason='TODO: Needs porting on Windows')
+def test_unchanged_config_packages_are_reused():
+    arguments = make_arguments(new_arguments={})
+    initial = gen.generate(arguments)
+    assert initial.config_diff['changed_packages'] == ['dcos-config', 'dcos-metadata']
+
+    # Nothing changed, everything is reused.
+    rerun = gen.generate(arguments, previous_manifest=initial.config_manifest)
+    assert rerun.cluster_packages == initial.cluster_packages
+    assert rerun.config_manifest == initial.config_manifest
+    assert rerun.config_diff == {'changed_packages': [], 'changed_arguments': []}
+
+    # Only dcos-config contains the cluster name.
+    arguments['cluster_name'] = 'edited'
+    edited = gen.generate(arguments, previous_manifest=initial.config_manifest)
+    assert edited.config_diff['changed_packages'] == ['dcos-config']
+    assert 'cluster_name' in edited.config_diff['changed_arguments']
+    assert edited.cluster_packages['dcos-metadata'] == initial.cluster_packages['dcos-metadata']
+    assert edited.cluster_packages['dcos-config'] != initial.cluster_packages['dcos-config']
+    # The cluster package list contains the reused ID.
+    assert edited.arguments['cluster_packages'] == json.dumps(sorted(
+        package['id'] for package in edited.cluster_packages.values()))
@@ -2,10 +2,14 @@ import os
 import stat
 import tarfile
 import tempfile
+from collections import OrderedDict
+from functools import partial
 
 import pytest
+import yaml
 
 import gen
+import gen.build_deploy.util
 import pkgpanda.util
 
 
@@ -207,3 +211,54 @@ def test_validate_downstream_entry():
                 'bar': 'bar',
             },
         })
+
+
+def test_run_jobs():
+    def job(i):
+        yield from range(i * 10, i * 10 + i)
+
+    jobs = [partial(job, i) for i in range(6)]
+    expected = [x for i in range(6) for x in range(i * 10, i * 10 + i)]
+    assert list(gen.build_deploy.util.run_jobs(jobs)) == expected
+    assert list(gen.build_deploy.util.run_jobs(jobs, processes=2)) == expected
+    assert list(gen.build_deploy.util.run_jobs(jobs, processes=1)) == expected
+
+
+def test_render_yaml(monkeypatch):
+    monkeypatch.setattr(gen, '_yaml_fragments', OrderedDict())
+    shared = {'path': '/etc/shared', 'content': 'a'}
+
+    def cloud_config(role):
+        return {
+            'write_files': [
+                {'path': '/etc/a', 'content': 'line 1\nline 2\n', 'permissions': '0644'},
+                {'path': '/etc/b', 'content': 'kept\n\n'},
+                {'path': '/etc/roles/' + role, 'content': ''}],
+            'coreos': {'units': [{'name': 'a.service', 'enable': True, 'command': 'start'}], 'update': {}},
+            'runcmd': [['systemctl', 'enable', role], 'echo "{ \'a\': 1 }"'],
+            'root': [],
+            'manage_etc_hosts': False,
+            'timezone': None,
+        }
+
+    for data in [
+            cloud_config('master'),
+            cloud_config('slave'),
+            # Fall back to rendering all at once.
+            {'write_files': [shared, shared]},
+            {'long key ' * 20: 'x'},
+            {},
+            ['a', {'b': 'c'}]]:
+        assert gen.render_yaml(data) == yaml.dump(data, default_style='|', default_flow_style=False)
+
+    # Only the fragments which differ between the variants were rendered for the second.
+    assert len([key for key in gen._yaml_fragments if key[0] == ('write_files',)]) == 4
+
+    # The cache is bounded, dropping the least recently used fragments.
+    monkeypatch.setattr(gen, 'max_yaml_fragments', 5)
+    for role in ['a', 'b', 'c']:
+        data = cloud_config(role)
+        assert gen.render_yaml(data) == yaml.dump(data, default_style='|', default_flow_style=False)
+        assert len(gen._yaml_fragments) <= 5
+    assert (('write_files',), repr([{'path': '/etc/roles/c', 'content': ''}])) in gen._yaml_fragments
+    assert (('write_files',), repr([{'path': '/etc/roles/a', 'content': ''}])) not in gen._yaml_fragments
@@ -1,6 +1,10 @@
 import json
+import time
+from collections import OrderedDict
 
+import gen
 import gen.build_deploy.aws
+import gen.build_deploy.util
 
 
 def test_gen_aws_mapping():
@@ -9,3 +13,42 @@ def test_gen_aws_mapping():
     assert len(result) == 10
     # check format of response
     assert result["ap-northeast-1"] == {'stable': gen.build_deploy.aws.region_to_ami_map['ap-northeast-1']['stable']}
+
+
+def test_do_create(monkeypatch, tmpdir):
+    # Benchmark of generating all the AWS templates, which must be the same with and without
+    # rendering cloud-config fragments once.
+    monkeypatch.setenv('DCOS_IMAGE_COMMIT', gen.build_deploy.util.dcos_image_commit)
+    monkeypatch.setattr(gen.build_deploy.aws, 'validate_cf', lambda template_body: None)
+    variant_arguments = {None: {
+        'bootstrap_url': 'https://example.com/repository',
+        'provider': 'aws',
+        'bootstrap_id': 'bootstrap_id',
+        'bootstrap_variant': '',
+        'package_ids': json.dumps(['package--version']),
+        'cloudformation_s3_url_full': 'https://s3.example.com/cloudformation'}}
+
+    def do_create(directory):
+        # Generating writes the late config packages, which must not exist yet.
+        monkeypatch.chdir(tmpdir.mkdir(directory))
+        start = time.perf_counter()
+        artifacts = list(gen.build_deploy.aws.do_create(
+            tag='tag',
+            build_name='build',
+            reproducible_artifact_path='path',
+            commit='commit',
+            variant_arguments=variant_arguments,
+            all_completes=None))
+        return artifacts, time.perf_counter() - start
+
+    monkeypatch.setattr(gen, '_yaml_fragments', OrderedDict())
+    artifacts, elapsed = do_create('cached')
+    print('do_create: {:.2f}s'.format(elapsed))
+    templates = [artifact for artifact in artifacts if 'local_content' in artifact]
+    assert len(templates) == 24
+
+    with monkeypatch.context() as m:
+        m.setattr(gen, 'render_yaml', gen._dump_yaml)
+        uncached_artifacts, uncached_elapsed = do_create('uncached')
+    print('do_create rendering whole cloud-configs: {:.2f}s'.format(uncached_elapsed))
+    assert artifacts == uncached_artifacts
@@ -0,0 +1,15 @@
+import json
+
+import gen.build_deploy.azure
+
+
+def test_transform():
+    cloud_config = {
+        'write_files': [{'path': '/etc/a', 'content': "name=[[[variables('uniqueName')]]]\n"}],
+        'runcmd': [['systemctl', 'start', 'a']]}
+    # The cloud-config is embedded as JSON with the ARM expressions concatenated in.
+    assert json.loads(gen.build_deploy.azure.transform(cloud_config)) == (
+        "[base64(concat('#cloud-config\n\n', "
+        "'{\"runcmd\": [[\"systemctl\", \"start\", \"a\"]], \"write_files\": [{\"content\": \"name=', "
+        "variables('uniqueName'), "
+        "'\\n\", \"path\": \"/etc/a\"}]}'))]")
@@ -1,3 +1,5 @@
+import threading
+import time
 from copy import deepcopy
 
 import pytest
@@ -5,6 +7,7 @@ import pytest
 import gen.internals
 from gen.exceptions import ValidationError
 from gen.internals import Scope, Source, Target
+from pkgpanda.util import load_json
 
 
 def sample_fn_small():
@@ -146,3 +149,176 @@ def test_source_secrets():
     extra_secret_entry['secret'].append('d')
     with pytest.raises(Exception):
         Source(extra_secret_entry)
+
+
+def test_resolve_incremental():
+    calls = list()
+
+    def calc_e(a):
+        calls.append('e')
+        return a + '_e'
+
+    def calc_f(e, b):
+        calls.append('f')
+        return e + b
+
+    def calc_g(b):
+        calls.append('g')
+        return b
+
+    def validate_e_g(e, g):
+        calls.append('validate_e_g')
+        if e == g:
+            raise AssertionError('e and g must differ')
+
+    def validate_b_g(b, g):
+        calls.append('validate_b_g')
+
+    source = Source({
+        'validate': [validate_e_g, validate_b_g],
+        'must': {
+            'e': calc_e,
+            'f': calc_f,
+            'g': calc_g,
+        },
+        'conditional': {
+            'd': {
+                'd_1': {'must': {'d_1_b': 'd_1_b_str'}},
+                'd_2': {'must': {'d_2_b': 'd_2_b_str'}},
+            },
+        },
+    })
+
+    def get_target():
+        return Target(
+            {'a', 'b', 'f', 'g'},
+            {'d': Scope('d', {'d_1': Target({'d_1_b'}), 'd_2': Target({'d_2_a', 'd_2_b'})})})
+
+    def resolve(arguments, previous=None):
+        user_source = Source(is_user=True)
+        for name, value in arguments.items():
+            user_source.add_must(name, value)
+        return gen.internals.resolve_configuration([source, user_source], [get_target()], previous)
+
+    def summarize(resolver):
+        return (
+            [(r.name, str(r._state), str(r.error), r.is_error or r.value) for r in resolver.arguments.values()],
+            resolver.status_dict,
+            resolver.late)
+
+    arguments = {'a': 'a', 'b': 'b', 'd': 'd_1'}
+    resolver = resolve(arguments)
+    assert resolver.status_dict == {'status': 'ok'}
+    assert sorted(calls) == ['e', 'f', 'g', 'validate_b_g', 'validate_e_g']
+
+    # Only what depends on a is recalculated and re-validated.
+    del calls[:]
+    arguments['a'] = 'x'
+    resolver = resolve(arguments, resolver)
+    assert sorted(calls) == ['e', 'f', 'validate_e_g']
+    assert summarize(resolver) == summarize(resolve(arguments))
+
+    # Switching cases, unset arguments and errors match resolving from scratch.
+    for changes in [{'d': 'd_2'}, {'d': 'd_3'}, {'b': 'x_e', 'd': 'd_1'}, {'b': 'b'}]:
+        arguments.update(changes)
+        resolver = resolve(arguments, resolver)
+        assert summarize(resolver) == summarize(resolve(arguments))
+        if changes == {'b': 'x_e', 'd': 'd_1'}:
+            assert resolver.status_dict['errors'] == {
+                'e': {'message': 'e and g must differ'},
+                'g': {'message': 'e and g must differ'}}
+
+    # Nothing changed, nothing recalculated.
+    del calls[:]
+    assert summarize(resolve(arguments, resolver)) == summarize(resolver)
+    assert calls == []
+
+    # A base resolved for a subset of the targets and sources can be shared by variants adding more.
+    del calls[:]
+    base = gen.internals.resolve_configuration([source], [Target({'b', 'g'})])
+    assert base.status_dict == {'status': 'errors', 'errors': {}, 'unset': {'b'}}
+    for extra in [{'b': 'b', 'd': 'd_1', 'a': 'a'}, {'b': 'c', 'd': 'd_2', 'a': 'a', 'd_2_a': 'y'}]:
+        user_source = Source(is_user=True)
+        for name, value in extra.items():
+            user_source.add_must(name, value)
+        variant = gen.internals.resolve_configuration(
+            [source, user_source], [get_target()], base, {'a', 'b', 'd', 'd_2_a'})
+        assert variant.status_dict == {'status': 'ok'}
+        assert summarize(variant) == summarize(resolve(extra))
+
+
+def test_resolver_profile(monkeypatch, tmpdir):
+    profile = gen.internals.resolver_profile
+    monkeypatch.setattr(profile, 'enabled', True)
+    profile.clear()
+
+    def calc_c(b):
+        return b + '_c'
+
+    source = Source({
+        'validate': [validate_a, lambda a, c: None],
+        'must': {'a': 'a_str', 'b': 'b_str', 'c': calc_c, 'd': 'd_1', 'd_1_a': 'x', 'd_1_b': 'y'},
+    })
+    gen.internals.resolve_configuration([source], [get_test_target()])
+    gen.internals.resolve_configuration([source], [get_test_target()])
+
+    report = profile.to_dict()
+    assert len(report['resolves']) == 2
+    assert report['resolves'][0]['order'] == report['resolves'][1]['order']
+    assert set(report['resolves'][0]['order']) == {'a', 'b', 'c', 'd', 'd_1_a', 'd_1_b'}
+    assert report['setters']['c']['function'] == 'calc_c'
+    assert report['setters']['a']['function'] is None
+    assert {name: entry['count'] for name, entry in report['setters'].items()} == {
+        'a': 2, 'b': 2, 'c': 2, 'd': 2, 'd_1_a': 2, 'd_1_b': 2}
+    # The switch on d is validated with validate_one_of.
+    assert {name: entry['count'] for name, entry in report['validators'].items()} == {
+        'validate_a': 2, '<lambda>': 2, 'validate_one_of': 2}
+    for entry in list(report['setters'].values()) + list(report['validators'].values()):
+        assert 0 <= entry['self'] <= entry['cumulative']
+
+    top = profile.top(3)
+    assert len(top) == 3
+    assert top[0][5] >= top[1][5] >= top[2][5]
+    assert 'calc_c' in profile.format_top()
+
+    filename = str(tmpdir.join('profile.json'))
+    profile.report(filename)
+    assert load_json(filename) == profile.to_dict()
+    profile.clear()
+
+
+def test_io_bound_validate():
+    # Stand-ins for validate functions making cloud API calls. Both must be waiting at once to pass.
+    barrier = threading.Barrier(2, timeout=10)
+
+    @gen.internals.io_bound
+    def validate_bucket(a, b):
+        barrier.wait()
+        time.sleep(0.1)
+        raise AssertionError('no bucket {}'.format(b))
+
+    @gen.internals.io_bound
+    def validate_region(a, d_1_a):
+        barrier.wait()
+
+    @gen.internals.io_bound
+    def validate_template(c):
+        if c != 'x':
+            raise AssertionError('bad template')
+
+    def validate_a_c(a, c):
+        raise AssertionError('a and c conflict')
+
+    source = Source({
+        'validate': [validate_bucket, validate_a_c, validate_region, validate_template],
+        'must': {'a': 'a_str', 'b': 'b_str', 'c': 'c_str', 'd': 'd_1', 'd_1_a': 'x', 'd_1_b': 'y'},
+    })
+    resolver = gen.internals.resolve_configuration([source], [get_test_target()])
+    # c fails its own validation, so validate_a_c isn't run with it.
+    assert list(resolver._errors.items()) == [
+        ('c', 'bad template'),
+        (frozenset({'a', 'b'}), 'no bucket b_str')]
+    assert resolver.status_dict['errors'] == {
+        'a': {'message': 'no bucket b_str'},
+        'b': {'message': 'no bucket b_str'},
+        'c': {'message': 'bad template'}}
@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+import gen
+import gen.service
+from gen.tests.utils import make_arguments
+
+
+@pytest.fixture
+def socket_path(tmpdir):
+    socket_path = str(tmpdir.join('gen.sock'))
+    server = gen.service.make_server(gen.service.Service(), socket_path=socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield socket_path
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_service(socket_path):
+    arguments = make_arguments({})
+    assert gen.service.call('validate', socket_path=socket_path, arguments=arguments) == {'status': 'ok'}
+    assert gen.service.call('validate', socket_path=socket_path, arguments=dict(arguments, master_list='foo')) == \
+        dict(gen.validate(dict(arguments, master_list='foo')), unset=[])
+    del arguments['bootstrap_url']
+    assert gen.service.call('validate', socket_path=socket_path, arguments=arguments) == \
+        {'status': 'errors', 'errors': {}, 'unset': ['bootstrap_url']}
+    assert gen.service.call('generate', socket_path=socket_path, arguments=arguments) == \
+        {'status': 'errors', 'errors': {}, 'unset': ['bootstrap_url']}
+
+    arguments = make_arguments({})
+    generated = gen.service.call('generate', socket_path=socket_path, arguments=arguments)
+    expected = gen.generate(arguments)
+    assert generated['status'] == 'ok'
+    assert generated['cluster_packages'] == expected.cluster_packages
+    assert generated['stable_artifacts'] == expected.stable_artifacts
+    assert generated['config_manifest'] == expected.config_manifest
+
+    rerun = gen.service.call(
+        'generate', socket_path=socket_path, arguments=arguments, previous_manifest=generated['config_manifest'])
+    assert rerun['config_diff'] == {'changed_packages': [], 'changed_arguments': []}
+
+    with pytest.raises(Exception, match='400'):
+        gen.service.call('validate', socket_path=socket_path, config=arguments)
+    with pytest.raises(Exception, match='404'):
+        gen.service.call('deploy', socket_path=socket_path, arguments=arguments)
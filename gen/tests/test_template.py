@@ -1,8 +1,10 @@
+import time
+
 import pytest
 
 import gen.template
 from gen.internals import Scope, Target
-from gen.template import For, parse_str, Replacement, Switch, Tokenizer, UnsetParameter
+from gen.template import For, parse_str, Replacement, Switch, TemplateCache, Tokenizer, UnsetParameter
 
 
 just_text = "foo"
@@ -150,3 +152,73 @@ def test_render():
             "btcelsefoo")
     with pytest.raises(UnsetParameter):
         parse_str("{% for a in b %}{{ a }}{% endfor %}else{{ a }}").render({"b": ['b', 't', 'c']})
+
+
+def test_tokenize_large_template_linear():
+    # Tokenizing must not re-slice the remaining text for every token, which made it quadratic in
+    # the size of the template. Compare against a small template so the check is machine independent.
+    chunk = '"key": "{{ value | json }}",{% switch foo %}{% case "a\\"b" %}text{% endswitch %}\n'
+
+    def tokenize_time(count):
+        text = chunk * count
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            tokens = get_tokens(text)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        assert len(tokens) == 7 * count + 2
+        return best
+
+    small = tokenize_time(1000)
+    large = tokenize_time(8000)
+    # 8x the text should take roughly 8x as long, far less than the 64x of a quadratic tokenizer.
+    assert large < small * 24
+
+
+def test_template_cache(tmpdir, monkeypatch):
+    text = '{{ a }}{% switch b %}{% case "c" %}{{ d | e }}{% endswitch %}'
+    cache = TemplateCache(str(tmpdir), 'version1')
+    template = cache.get(text)
+    assert template == gen.template._parse(text)
+    # Parsed once per process.
+    assert cache.get(text) is template
+
+    # Parse trees persisted to disk are reused by other processes (cache instances).
+    def fail_parse(text):
+        raise AssertionError("template should not be parsed again")
+    monkeypatch.setattr(gen.template, '_parse', fail_parse)
+    assert TemplateCache(str(tmpdir), 'version1').get(text) == template
+    monkeypatch.undo()
+
+    # Changed text and parser versions don't hit old entries.
+    assert TemplateCache(str(tmpdir), 'version1').get(text + 'f') == parse_str(text + 'f')
+    assert len(tmpdir.listdir()) == 2
+    assert TemplateCache(str(tmpdir), 'version2').get(text) == template
+    assert len(tmpdir.listdir()) == 3
+
+    # Corrupt entries are parsed again.
+    for filename in tmpdir.listdir():
+        filename.write('corrupt')
+    assert TemplateCache(str(tmpdir), 'version1').get(text) == template
+
+
+def test_render_to(tmpdir):
+    template = parse_str('a{{ b }}{% for c in d %}{% switch c %}{% case "x" %}{{ c | up }}{% case "y" %}y{% endswitch %}{% endfor %}e')  # noqa
+    arguments = {'b': 1, 'd': ['x', 'y'] * 10000}
+    filters = {'up': lambda value: value.upper()}
+    expected = 'a1' + 'Xy' * 10000 + 'e'
+    assert template.render(arguments, filters) == expected
+
+    filename = str(tmpdir.join('rendered'))
+    with open(filename, 'w') as f:
+        template.render_to(f.write, arguments, filters)
+    with open(filename) as f:
+        assert f.read() == expected
+    # The for loop variable doesn't leak into the arguments.
+    assert arguments.keys() == {'b', 'd'}
+
+    # Replacements can be written separately.
+    pieces = list()
+    template.render_to(pieces.append, arguments, filters, lambda value: pieces.append('<{}>'.format(value)))
+    assert ''.join(pieces) == 'a<1>' + '<X>y' * 10000 + 'e'
@@ -0,0 +1,58 @@
+import pytest
+import yaml
+
+import gen.yaml_template
+from gen.template import parse_str
+
+templates = [
+    # Values within and making up whole literal block scalars.
+    'a: |\n  x {{ v }} y\n  {{ w }}\nb:\n  c: |\n{{ v }}\n',
+    # Other values are loaded with their top level sequence entry.
+    'root:\n- path: /x\n  content: |\n{{ v }}\n- path: /y\n  content: {{ w }}\n- path: /z\n  content: |\n    pre {{ v }}\nother: 1\n',  # noqa
+    '- path: /x\n  content: |\n{{ v }}\n- path: /y\n  content: "{{ w }}"\n',
+    # Anything else is loaded as a whole.
+    'a: {{ v }}\n',
+    '{{ v }}: 1\n',
+    'a: [{{ v }}]\n',
+    '# {{ v }}\na: |\n  {{ w }}\n',
+    'a: &a |\n  {{ v }}\nb: *a\n',
+]
+
+values = [
+    '', 'x', '  x', '  x\n  y\n\n', '    x\n      y\n   \n  \n', '\tx', 'x\ny', '  x\ny', '\n', '- x', 'b: c',
+    '"', '|', '#', '[', '\ue000', '\ue0000\ue001', 'x\r', '  x\x85...', '\x07', '\n---\n', '\nnew: key',
+    '\n- path: /q', '  x\u2028y',
+]
+
+
+def load(template, arguments):
+    try:
+        return yaml.safe_load(template.render(arguments))
+    except yaml.YAMLError as ex:
+        return type(ex), str(ex)
+
+
+def load_rendered(template, arguments):
+    try:
+        return gen.yaml_template.load_rendered(template, arguments)
+    except yaml.YAMLError as ex:
+        return type(ex), str(ex)
+
+
+@pytest.mark.parametrize('text', templates)
+def test_load_rendered(text):
+    template = parse_str(text)
+    for v in values:
+        for w in values:
+            arguments = {'v': v, 'w': w}
+            assert load_rendered(template, arguments) == load(template, arguments), arguments
+
+
+def test_load_rendered_copies():
+    template = parse_str('a:\n- b: |\n    {{ v }}\n')
+    data = gen.yaml_template.load_rendered(template, {'v': 'x'})
+    assert data == {'a': [{'b': 'x\n'}]}
+    data['a'].append('y')
+    assert gen.yaml_template.load_rendered(template, {'v': 'z'}) == {'a': [{'b': 'z\n'}]}
+    # Loaded without loading the rendered text.
+    assert all(skeleton.supported for skeleton in gen.yaml_template._skeletons.values() if 'b: |' in skeleton.text)
@@ -4,7 +4,7 @@ import os.path
 
 from tempfile import TemporaryDirectory
 
-from pkgpanda.util import make_tar
+from pkgpanda.util import make_tar, make_tar_from_files
 
 
 def pkgpanda_package_tmpdir():
@@ -24,3 +24,12 @@ def make_pkgpanda_package(contents_dir, package_filename):
 
     make_tar(package_filename, contents_dir)
     logging.info("Package filename: %s", package_filename)
+
+
+def write_pkgpanda_package(files, package_filename):
+    """Write a package of the in memory files, see pkgpanda.util.make_tar_from_files()."""
+    if os.path.dirname(package_filename):
+        os.makedirs(os.path.dirname(package_filename), exist_ok=True)
+
+    make_tar_from_files(package_filename, files)
+    logging.info("Package filename: %s", package_filename)
@@ -0,0 +1,333 @@
+"""Load rendered YAML templates without loading the whole rendered text.
+
+Loading the YAML text of a rendered template is slow, while most of the text is the same for every
+configuration. Instead templates are rendered with a placeholder in place of each replacement (a
+skeleton). Skeletons are loaded once and cached. The values of the replacements are then put into a
+copy of the loaded skeleton where that is guaranteed to give the same result as loading the rendered
+text:
+
+- Single line values within a line of a literal block scalar (`|`).
+- Values making up a whole literal block scalar, as lines indented like the block.
+
+Entries of top level sequences with any other replacement are loaded on their own from their
+rendered text. Templates using YAML features not accounted for here (anchors, merge keys,
+directives, ...), and values which don't meet the conditions above, fall back to loading the whole
+rendered text.
+"""
+import copy
+import re
+
+import yaml
+from yaml.reader import Reader
+
+_STR_TAG = 'tag:yaml.org,2002:str'
+_MERGE_TAG = 'tag:yaml.org,2002:merge'
+
+# Placeholders are made of characters from the unicode private use area which templates don't
+# contain. Replacements starting a line are preceded by the leading spaces of their value so the
+# skeleton keeps the indentation of the rendered text.
+_PLACEHOLDER_START = '\ue000'
+_INLINE_END = '\ue001'
+_LINE_START_END = '\ue002'
+_placeholder_re = re.compile('( *)\ue000([0-9]+)([\ue001\ue002])')
+_line_break_re = re.compile('[\r\n\x85\u2028\u2029]')
+_other_line_break_re = re.compile('[\r\x85\u2028\u2029]')
+_directive_or_document_re = re.compile('^(?:---|\\.\\.\\.|%)', re.MULTILINE)
+_dash_re = re.compile(' *- +')
+
+
+class _Unsupported(Exception):
+    pass
+
+
+class _Loader(yaml.SafeLoader):
+    """SafeLoader noting whether any anchors or aliases are used."""
+
+    has_anchors = False
+
+    def compose_node(self, parent, index):
+        if self.peek_event().anchor is not None:
+            self.has_anchors = True
+        return super().compose_node(parent, index)
+
+
+def _render_skeleton(template, arguments):
+    """Return the skeleton text of template and the values of its placeholders.
+
+    The text is None if the template contains placeholder characters."""
+    pieces = list()
+    values = list()
+    at_line_start = True
+    supported = True
+
+    def write(text):
+        nonlocal at_line_start, supported
+        if text:
+            pieces.append(text)
+            at_line_start = text.endswith('\n')
+            supported = supported and _PLACEHOLDER_START not in text
+
+    def write_replacement(value):
+        nonlocal at_line_start
+        if at_line_start:
+            lead = value[:len(value) - len(value.lstrip(' '))]
+            pieces.append('{}{}{}{}'.format(lead, _PLACEHOLDER_START, len(values), _LINE_START_END))
+        else:
+            pieces.append('{}{}{}'.format(_PLACEHOLDER_START, len(values), _INLINE_END))
+        values.append(value)
+        at_line_start = False
+
+    template.render_to(write, arguments, write_replacement=write_replacement)
+    return ''.join(pieces) if supported else None, values
+
+
+def _fill_in(text, values):
+    """Return the rendered text of some skeleton text."""
+    def replace(match):
+        spaces, index, end = match.groups()
+        if end == _INLINE_END:
+            return spaces + values[int(index)]
+        # The spaces are the leading spaces of the value.
+        return values[int(index)]
+    return _placeholder_re.sub(replace, text)
+
+
+def _inline_value(value, starts_line):
+    """Return value if it can be put straight into a line of a literal block scalar, None if not."""
+    if _line_break_re.search(value) or Reader.NON_PRINTABLE.search(value):
+        return None
+    # Blank lines and extra leading spaces at the start of a line change how blocks are read.
+    if starts_line and (not value or value[0] in ' \t'):
+        return None
+    return value
+
+
+def _literal_block(value, indent):
+    """Return what a literal block scalar of the lines of value reads as, None if not known.
+
+    The lines must all be indented by (at least) indent spaces, and the first must not be blank."""
+    if _other_line_break_re.search(value) or Reader.NON_PRINTABLE.search(value):
+        return None
+    prefix = ' ' * indent
+    lines = value.split('\n')
+    if not lines[0].startswith(prefix) or lines[0][indent:indent + 1] in ('', ' '):
+        return None
+
+    content = list()
+    for line in lines:
+        if line.startswith(prefix):
+            content.append(line[indent:])
+        elif line.strip(' '):
+            # Ends the block early.
+            return None
+        else:
+            # Lines of fewer spaces than the indentation are empty lines.
+            content.append('')
+
+    # Trailing empty lines are dropped, the last line keeps its line break.
+    while not content[-1]:
+        content.pop()
+    return '\n'.join(content) + '\n'
+
+
+class _Unit:
+    """An entry of a top level sequence, which can be loaded on its own."""
+
+    def __init__(self, sequence, index, start, end, key):
+        self.sequence = sequence
+        self.index = index
+        self.start = start
+        self.end = end
+        # Entries of sequences in a mapping are loaded as the value of a key.
+        self.key = key
+        # Whether the entry contains replacements which can't be put into the skeleton.
+        self.always_load = False
+
+    def load(self, text, values):
+        """Return the entry loaded from its rendered text, raising _Unsupported if it isn't one."""
+        rendered = _fill_in(text[self.start:self.end], values)
+        # Document markers would end the whole document, not just the entry.
+        if _other_line_break_re.search(rendered) or _directive_or_document_re.search(rendered):
+            raise _Unsupported()
+        try:
+            if self.key:
+                loaded = yaml.safe_load('x:\n' + rendered)
+                if not isinstance(loaded, dict) or list(loaded.keys()) != ['x']:
+                    raise _Unsupported()
+                loaded = loaded['x']
+            else:
+                loaded = yaml.safe_load(rendered)
+        except yaml.YAMLError as ex:
+            raise _Unsupported() from ex
+        if not isinstance(loaded, list) or len(loaded) != 1:
+            raise _Unsupported()
+        return loaded[0]
+
+
+class _Skeleton:
+    """A loaded skeleton and where in it to put the values of its placeholders."""
+
+    def __init__(self, text):
+        self.text = text
+        # [(container, key, unit, placeholder index, indent)] for whole literal block scalars.
+        self._blocks = list()
+        # [(container, key, unit, scalar value, {placeholder index: whether it starts a line})]
+        self._inlines = list()
+        self._units = list()
+        try:
+            self.data = self._load(text)
+            self.supported = True
+        except _Unsupported:
+            self.data = None
+            self.supported = False
+
+    def _load(self, text):
+        if _directive_or_document_re.search(text):
+            raise _Unsupported()
+
+        loader = _Loader(text)
+        try:
+            node = loader.get_single_node()
+            if node is None or loader.has_anchors:
+                raise _Unsupported()
+            data = loader.construct_object(node, deep=True)
+            objects = loader.constructed_objects
+        except yaml.YAMLError as ex:
+            raise _Unsupported() from ex
+        finally:
+            loader.dispose()
+
+        placeholders = [int(match.group(2)) for match in _placeholder_re.finditer(text)]
+        found = list()
+
+        def line_start(index):
+            return text.rfind('\n', 0, index) + 1
+
+        def visit_scalar(node, container, key, unit):
+            matches = list(_placeholder_re.finditer(node.value))
+            if not matches:
+                return
+            found.extend(int(match.group(2)) for match in matches)
+
+            if container is not None and node.tag == _STR_TAG and node.style == '|':
+                match = matches[0]
+                if len(matches) == 1 and match.group(3) == _LINE_START_END and match.start() == 0 and \
+                        node.value == match.group(0) + '\n' and text.startswith('|\n', node.start_mark.index):
+                    position = text.index(match.group(0)[len(match.group(1)):])
+                    indent = position - line_start(position)
+                    if indent > 0 and text.startswith('\n', position + len(match.group(0)) - len(match.group(1))):
+                        self._blocks.append((container, key, unit, int(match.group(2)), indent))
+                        return
+                if all(match.group(3) == _INLINE_END for match in matches):
+                    starts_line = {
+                        int(match.group(2)): match.start() == 0 or node.value[match.start() - 1] == '\n'
+                        for match in matches}
+                    self._inlines.append((container, key, unit, node.value, starts_line))
+                    return
+
+            if unit is None:
+                raise _Unsupported()
+            unit.always_load = True
+
+        def visit(node, container, key, unit):
+            if isinstance(node, yaml.ScalarNode):
+                visit_scalar(node, container, key, unit)
+            elif isinstance(node, yaml.SequenceNode):
+                for index, item in enumerate(node.value):
+                    visit(item, objects[node], index, units.get(item, unit))
+            else:
+                keys = set()
+                for key_node, value_node in node.value:
+                    if key_node.tag == _MERGE_TAG:
+                        raise _Unsupported()
+                    key_data = objects[key_node]
+                    if key_data in keys:
+                        raise _Unsupported()
+                    keys.add(key_data)
+                    # Keys can't be filled in.
+                    visit(key_node, None, None, unit)
+                    visit(value_node, objects[node], key_data, unit)
+
+        # The entries of the top level sequences are the units.
+        units = dict()
+        if isinstance(node, yaml.SequenceNode):
+            sequences = [(node, False, len(text))]
+        elif isinstance(node, yaml.MappingNode):
+            key_starts = [line_start(key_node.start_mark.index) for key_node, _ in node.value] + [len(text)]
+            sequences = [
+                (value_node, True, key_starts[index + 1])
+                for index, (_, value_node) in enumerate(node.value) if isinstance(value_node, yaml.SequenceNode)]
+        else:
+            sequences = list()
+        for sequence, key, end in sequences:
+            if sequence.flow_style:
+                continue
+            starts = list()
+            for item in sequence.value:
+                start = line_start(item.start_mark.index)
+                if not _dash_re.fullmatch(text, start, item.start_mark.index):
+                    raise _Unsupported()
+                starts.append(start)
+            for index, item in enumerate(sequence.value):
+                item_end = starts[index + 1] if index + 1 < len(starts) else end
+                units[item] = _Unit(objects[sequence], index, starts[index], item_end, key)
+        self._units = list(units.values())
+
+        visit(node, None, None, None)
+        # Every placeholder must be somewhere it is known how to fill in (not a comment, ...).
+        if sorted(found) != sorted(placeholders) or len(set(found)) != len(found):
+            raise _Unsupported()
+        return data
+
+    def fill_in(self, values):
+        """Return the data of the rendered text given the values of the placeholders.
+
+        Raises _Unsupported if the rendered text must be loaded instead."""
+        load_units = set(unit for unit in self._units if unit.always_load)
+        filled_in = list()
+        for container, key, unit, index, indent in self._blocks:
+            filled_in.append((container, key, unit, _literal_block(values[index], indent)))
+        for container, key, unit, scalar, starts_line in self._inlines:
+            inline_values = {index: _inline_value(values[index], starts) for index, starts in starts_line.items()}
+            if None in inline_values.values():
+                filled_in.append((container, key, unit, None))
+            else:
+                filled_in.append((container, key, unit, _placeholder_re.sub(
+                    lambda match: match.group(1) + inline_values[int(match.group(2))], scalar)))
+
+        for container, key, unit, value in filled_in:
+            if value is None:
+                if unit is None:
+                    raise _Unsupported()
+                load_units.add(unit)
+
+        # Map the containers of the skeleton data to those of the copy through the memo.
+        memo = dict()
+        data = copy.deepcopy(self.data, memo)
+        for container, key, unit, value in filled_in:
+            if unit not in load_units:
+                memo[id(container)][key] = value
+        for unit in load_units:
+            memo[id(unit.sequence)][unit.index] = unit.load(self.text, values)
+        return data
+
+
+# Loaded skeletons by their text.
+_skeletons = dict()
+
+
+def load_rendered(template, arguments):
+    """Return yaml.safe_load(template.render(arguments)) without loading all the rendered text.
+
+    The data returned is not shared with other calls."""
+    text, values = _render_skeleton(template, arguments)
+    if text is not None:
+        skeleton = _skeletons.get(text)
+        if skeleton is None:
+            skeleton = _skeletons[text] = _Skeleton(text)
+        if skeleton.supported:
+            try:
+                return skeleton.fill_in(values)
+            except _Unsupported:
+                pass
+    return yaml.safe_load(template.render(arguments))
@@ -35,7 +35,8 @@ from pkgpanda.constants import (DCOS_SERVICE_CONFIGURATION_FILE,
 from pkgpanda.exceptions import (InstallError, PackageError, PackageNotFound,
                                  ValidationError)
 from pkgpanda.util import (download, extract_tarball, if_exists, is_windows,
-                           load_json, make_directory, remove_directory, write_json, write_string)
+                           load_json, make_directory, remove_directory, rewrite_symlink_target, write_json,
+                           write_string)
 
 if not is_windows:
     assert 'grp' in sys.modules
@@ -507,8 +508,10 @@ class ConflictingFile(ValidationError):
 
 
 # Create folders and symlink files inside the folders. Allows multiple
-# packages to have the same folder and provide it publicly.
-def symlink_tree(src, dest):
+# packages to have the same folder and provide it publicly. If given,
+# link_target maps the path of each source file to what the symlink should
+# point at.
+def symlink_tree(src, dest, link_target=None):
     for name in os.listdir(src):
         src_path = os.path.join(src, name)
         dest_path = os.path.join(dest, name)
@@ -529,10 +532,10 @@ def symlink_tree(src, dest):
                 os.makedirs(dest_path)
 
             # Recurse into the directory symlinking everything so long as the directory isn't
-            symlink_tree(src_path, dest_path)
+            symlink_tree(src_path, dest_path, link_target)
         else:
             try:
-                os.symlink(src_path, dest_path)
+                os.symlink(link_target(src_path) if link_target else src_path, dest_path)
             except FileNotFoundError as ex:
                 raise ConflictingFile(src_path, dest_path, ex) from ex
 
@@ -676,10 +679,16 @@ class Install:
             manage_users=False,
             add_users=False,
             manage_state_dir=False,
-            state_dir_root=STATE_DIR_ROOT):
+            state_dir_root=STATE_DIR_ROOT,
+            symlink_rewrite=None):
 
         assert type(rooted_systemd) == bool
         assert type(fake_path) == bool
+        # Staging systemd units follows the symlinks made during activation,
+        # so those must point at real files.
+        assert symlink_rewrite is None or skip_systemd_dirs, \
+            "symlink_rewrite can only be used along with skip_systemd_dirs"
+
         self.__root = os.path.abspath(root)
         self.__config_dir = os.path.abspath(config_dir) if config_dir else None
         if rooted_systemd:
@@ -710,6 +719,10 @@ class Install:
         assert not state_dir_root.endswith('/')
         self.__state_dir_root = state_dir_root
 
+        # (old_prefix, new_prefix) applied to the target of every symlink made
+        # during activation. Used when the activated tree will be relocated.
+        self.__symlink_rewrite = symlink_rewrite
+
         self.systemd = Systemd(self._make_abs(self.__systemd_dir), self.__manage_systemd, self.__block_systemd)
 
     def _get_dcos_configuration_template(self):
@@ -793,11 +806,16 @@ class Install:
         for name in new_dirs:
             os.makedirs(name)
 
+        def link_target(path):
+            if self.__symlink_rewrite is None:
+                return path
+            return rewrite_symlink_target(path, *self.__symlink_rewrite)
+
         def symlink_all(src, dest):
             if not os.path.isdir(src):
                 return
 
-            symlink_tree(src, dest)
+            symlink_tree(src, dest, link_target)
 
         # Set the new LD_LIBRARY_PATH, PATH.
         env_contents = env_header.format("/opt/mesosphere" if self.__fake_path else self.__root)
@@ -857,7 +875,7 @@ class Install:
                                                                                     ex.src))
 
             # Add to the active folder
-            os.symlink(package.path, os.path.join(self._make_abs("active.new"), package.name))
+            os.symlink(link_target(package.path), os.path.join(self._make_abs("active.new"), package.name))
 
             # Add to the environment and environment.export contents
 
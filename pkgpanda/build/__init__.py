@@ -1,9 +1,11 @@
+import collections.abc
+import concurrent.futures
 import copy
+import functools
 import json
 import multiprocessing
 import os
 import random
-import shutil
 import string
 import tempfile
 from contextlib import contextmanager
@@ -16,12 +18,13 @@ import pkgpanda.build.src_fetchers
 from pkgpanda import expand_require as expand_require_exceptions
 from pkgpanda import Install, PackageId, Repository
 from pkgpanda.actions import add_package_file
+from pkgpanda.build.report import build_report, package_label
 from pkgpanda.constants import install_root, PKG_DIR, RESERVED_UNIT_NAMES
 from pkgpanda.exceptions import FetchError, PackageError, ValidationError
-from pkgpanda.util import (check_forbidden_services, download_atomic,
+from pkgpanda.util import (check_forbidden_services, download_atomic, extract_tarball,
                            hash_checkout, is_windows, load_json, load_string, logger,
-                           make_directory, make_file, make_tar, remove_directory, rewrite_symlinks, write_json,
-                           write_string)
+                           make_directory, make_file, make_tar, remove_directory, rewrite_symlinks, TarStream,
+                           write_json, write_string)
 
 
 class BuildError(Exception):
@@ -34,6 +37,14 @@ class BuildError(Exception):
         return self.msg
 
 
+def random_container_name(name):
+    return "{}-{}".format(
+        name, ''.join(
+            random.choice(string.ascii_lowercase) for _ in range(10)
+        )
+    )
+
+
 class DockerCmd:
 
     def __init__(self):
@@ -41,12 +52,12 @@ class DockerCmd:
         self.environment = dict()
         self.container = str()
 
-    def run(self, name, cmd):
-        container_name = "{}-{}".format(
-            name, ''.join(
-                random.choice(string.ascii_lowercase) for _ in range(10)
-            )
-        )
+    def run(self, name, cmd, pool=None):
+        """Run cmd in a fresh container, or in a long-lived one from pool if given."""
+        if pool is not None and pool.run(self, name, cmd):
+            return
+
+        container_name = random_container_name(name)
 
         docker = ["docker", "run", "--name={}".format(container_name)]
 
@@ -74,6 +85,144 @@ class DockerCmd:
         check_call(["docker", "rm", "-v", name])
 
 
+class BuilderContainerPool:
+    """Long-lived containers which commands are run in with `docker exec`.
+
+    There is one container per docker image and set of volumes, since volumes
+    can't be changed once a container is started. This saves starting and
+    removing a whole container for every quick step like cleaning up between
+    builds. If a container can't be started the pool is disabled and callers
+    fall back to running a fresh container per command.
+    """
+
+    def __init__(self):
+        self._containers = dict()
+        self._disabled = is_windows
+
+    def _start(self, cmd, name):
+        container_name = random_container_name(name)
+        docker = ["docker", "run", "--detach", "--name={}".format(container_name)]
+        for host_path, container_path in sorted(cmd.volumes.items()):
+            docker += ["-v", "{0}:{1}".format(host_path, container_path)]
+        # Keep the container alive until the pool is closed.
+        docker += ["--entrypoint", "sleep", cmd.container, "infinity"]
+        check_call(docker)
+        return container_name
+
+    def run(self, cmd, name, command):
+        """Run command in the pooled container matching cmd.
+
+        Returns False without running anything if the pool isn't usable."""
+        if self._disabled:
+            return False
+
+        key = (cmd.container, tuple(sorted(cmd.volumes.items())))
+        if key not in self._containers:
+            try:
+                self._containers[key] = self._start(cmd, name)
+            except CalledProcessError as ex:
+                print("WARNING: Unable to start a pooled builder container, falling back to a container per "
+                      "command: {}".format(ex))
+                self._disabled = True
+                return False
+
+        docker = ["docker", "exec"]
+        for k, v in sorted(cmd.environment.items()):
+            docker += ["-e", "{0}={1}".format(k, v)]
+        docker.append(self._containers[key])
+        docker += command
+        check_call(docker)
+        return True
+
+    def close(self):
+        for container_name in self._containers.values():
+            check_call(["docker", "rm", "--force", "-v", container_name])
+        self._containers.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CompilerCache:
+    """Persistent ccache directories mounted into package builds.
+
+    Each package gets its own cache per docker image so builds with a
+    different toolchain never share cache entries. Only the build environment
+    is changed, the cache never influences package ids. Builds run in a copy
+    of the builder image with ccache added on top, and compilers are routed
+    through ccache by putting its compiler wrappers first on the PATH of the
+    image. The package id still records the builder image itself, so enabling
+    the cache doesn't change any package id.
+    """
+
+    # Where ccache installs the wrappers named after the compilers it masquerades as.
+    WRAPPERS_DIR = '/usr/lib/ccache'
+    # PATH docker uses for images which don't set one.
+    DEFAULT_PATH = '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin'
+
+    # Indexes of the counters in ccache's stats files.
+    STATS_CACHE_MISS = 4
+    STATS_CACHE_HIT_PREPROCESSED = 8
+    STATS_CACHE_HIT_DIRECT = 22
+
+    def __init__(self, cache_dir, max_size='5G'):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self._images = dict()
+
+    def get_dir(self, name, docker_id):
+        # Docker ids are of the form sha256:<hex>, ':' isn't allowed in volume paths.
+        return os.path.join(self.cache_dir, name, docker_id.replace(':', '-'))
+
+    def add_to(self, cmd, name, docker_id):
+        """Mount the cache of the package into the docker command, returning the host directory of the cache."""
+        directory = self.get_dir(name, docker_id)
+        make_directory(directory)
+        cmd.volumes[directory] = PKG_DIR + "/ccache:rw"
+        cmd.environment["CCACHE_DIR"] = PKG_DIR + "/ccache"
+        cmd.environment["CCACHE_MAXSIZE"] = self.max_size
+        if docker_id not in self._images:
+            self._images[docker_id] = get_ccache_image(docker_id)
+        cmd.container = self._images[docker_id]
+        image_path = get_docker_env(docker_id).get('PATH', self.DEFAULT_PATH)
+        cmd.environment["PATH"] = self.WRAPPERS_DIR + ':' + image_path
+        return directory
+
+    @classmethod
+    def get_stats(cls, directory):
+        """Sum up the hit and miss counters of all the stats files in a ccache directory."""
+        counters = list()
+        for root, _, filenames in os.walk(directory):
+            if 'stats' not in filenames:
+                continue
+            try:
+                values = [int(value) for value in load_string(os.path.join(root, 'stats')).split()]
+            except (OSError, ValueError):
+                continue
+            counters.extend([0] * (len(values) - len(counters)))
+            for i, value in enumerate(values):
+                counters[i] += value
+
+        def counter(index):
+            return counters[index] if index < len(counters) else 0
+
+        return {
+            'hits': counter(cls.STATS_CACHE_HIT_DIRECT) + counter(cls.STATS_CACHE_HIT_PREPROCESSED),
+            'misses': counter(cls.STATS_CACHE_MISS)
+        }
+
+    @staticmethod
+    def format_stats(before, after):
+        hits = after['hits'] - before['hits']
+        misses = after['misses'] - before['misses']
+        if hits + misses == 0:
+            return "ccache: no cacheable compilations"
+        return "ccache: {} hits, {} misses ({:.0f}% hit rate)".format(hits, misses, 100 * hits / (hits + misses))
+
+
 def get_variants_from_filesystem(directory, extension):
     results = set()
     for filename in os.listdir(directory):
@@ -247,6 +396,25 @@ class PackageSet:
                                  "but is excluded according to the treeinfo.json.".format(package_name))
 
 
+class LazyMapping(collections.abc.Mapping):
+    """Read-only mapping with a fixed set of keys whose values are computed on first access by `load`."""
+
+    def __init__(self, keys, load):
+        self._keys = keys
+        self._load = load
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        return self._load(key)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
 class PackageStore:
 
     def __init__(self, packages_dir, repository_url):
@@ -254,19 +422,16 @@ class PackageStore:
         self._repository_url = repository_url.rstrip('/') if repository_url is not None else None
         self._packages_dir = packages_dir.rstrip('/')
 
-        # Load all possible packages, making a dictionary from (name, variant) -> buildinfo
-        self._packages = dict()
-        self._packages_by_name = dict()
+        # Find all possible packages, recording (name, variant) pairs. The
+        # buildinfo of each is only loaded once it is needed, then memoized.
+        self._package_variants = dict()
         self._package_folders = dict()
+        self._buildinfos = dict()
 
         # Load an upstream if one exists
         # TODO(cmaloney): Allow upstreams to have upstreams
         self._package_cache_dir = self._packages_dir + "/cache/packages"
-        self._upstream_dir = self._packages_dir + "/cache/upstream/checkout"
         self._upstream = None
-        self._upstream_package_dir = self._upstream_dir + "/packages"
-        # TODO(cmaloney): Make it so the upstream directory can be kept around
-        remove_directory(self._upstream_dir)
         upstream_config = self._packages_dir + '/upstream.json'
         if os.path.exists(upstream_config):
             try:
@@ -274,7 +439,8 @@ class PackageStore:
                     load_optional_json(upstream_config),
                     self._packages_dir + '/cache/upstream',
                     packages_dir)
-                self._upstream.checkout_to(self._upstream_dir)
+                self._upstream_dir = self._checkout_upstream()
+                self._upstream_package_dir = self._upstream_dir + "/packages"
                 if os.path.exists(self._upstream_package_dir + "/upstream.json"):
                     raise Exception("Support for upstreams which have upstreams is not currently implemented")
             except Exception as ex:
@@ -296,7 +462,7 @@ class PackageStore:
 
                 # If we've already found this package, it means 1+ versions have been defined. Use
                 # those and ignore everything in the upstreams.
-                if name in self._packages_by_name:
+                if name in self._package_variants:
                     continue
 
                 if is_windows:
@@ -307,18 +473,49 @@ class PackageStore:
                     self._builders[name] = builder_folder
 
                 # Search the directory for buildinfo.json files, record the variants
-                for variant in get_variants_from_filesystem(package_folder, 'buildinfo.json'):
-                    # Only adding the default dictionary once we know we have a package.
-                    self._packages_by_name.setdefault(name, dict())
+                variants = get_variants_from_filesystem(package_folder, 'buildinfo.json')
+                if variants:
+                    self._package_variants[name] = variants
+                    self._package_folders[name] = package_folder
+
+        self._packages = LazyMapping(
+            {(name, variant) for name, variants in self._package_variants.items() for variant in variants},
+            lambda package_tuple: self.get_buildinfo(*package_tuple))
+        self._packages_by_name = {
+            name: LazyMapping(variants, functools.partial(self.get_buildinfo, name))
+            for name, variants in self._package_variants.items()
+        }
 
-                    buildinfo = load_buildinfo(package_folder, variant)
-                    self._packages[(name, variant)] = buildinfo
-                    self._packages_by_name[name][variant] = buildinfo
+    def _checkout_upstream(self):
+        """Check out the upstream, reusing the checkout from a previous run if the upstream is unchanged.
 
-                    if name in self._package_folders:
-                        assert self._package_folders[name] == package_folder
-                    else:
-                        self._package_folders[name] = package_folder
+        Checkouts are keyed by the id of the upstream source (git commit,
+        sha1 of the tarball, etc.) so a changed upstream.json gets a fresh
+        checkout. Checkouts of other upstream versions are removed.
+        """
+        checkouts_dir = self._packages_dir + "/cache/upstream/checkouts"
+        checkout_name = hash_checkout(self._upstream.get_id())
+        checkout_dir = checkouts_dir + '/' + checkout_name
+
+        if os.path.exists(checkout_dir):
+            print("Reusing upstream checkout {}".format(checkout_dir))
+        else:
+            make_directory(checkouts_dir)
+            # Check out to a temporary location first so an interrupted
+            # checkout is never mistaken for a complete one.
+            tmp_dir = checkout_dir + '.tmp'
+            remove_directory(tmp_dir)
+            self._upstream.checkout_to(tmp_dir)
+            os.rename(tmp_dir, checkout_dir)
+
+        for name in os.listdir(checkouts_dir):
+            if name != checkout_name:
+                remove_directory(checkouts_dir + '/' + name)
+
+        # Upstream checkouts used to always be made fresh here.
+        remove_directory(self._packages_dir + "/cache/upstream/checkout")
+
+        return checkout_dir
 
     def get_package_folder(self, name):
         return self._package_folders[name]
@@ -330,7 +527,11 @@ class PackageStore:
         return self._packages_dir + "/cache/complete"
 
     def get_buildinfo(self, name, variant):
-        return self._packages[(name, variant)]
+        if (name, variant) not in self._buildinfos:
+            if variant not in self._package_variants.get(name, set()):
+                raise KeyError((name, variant))
+            self._buildinfos[(name, variant)] = load_buildinfo(self._package_folders[name], variant)
+        return self._buildinfos[(name, variant)]
 
     def get_last_complete_set(self, variants):
         def get_last_complete(variant):
@@ -363,6 +564,40 @@ class PackageStore:
         make_directory(directory)
         return directory
 
+    def get_package_cache_dir(self):
+        make_directory(self._package_cache_dir)
+        return self._package_cache_dir
+
+    def get_extracted_cache_dir(self):
+        """Directory of extracted packages, keyed by package id, shared between builds.
+
+        Package ids are derived from everything that goes into a package so
+        an extracted package never goes stale. Extracted packages must never be
+        modified, they're mounted read-only into builds."""
+        directory = self._packages_dir + "/cache/extracted"
+        make_directory(directory)
+        return directory
+
+    def get_extracted_package(self, pkg_id):
+        """Load a built package from the extracted package cache, extracting it first if it isn't there yet."""
+        repository = Repository(self.get_extracted_cache_dir())
+        if os.path.exists(repository.package_path(pkg_id)):
+            print("Auto-adding dependency: {} (already extracted)".format(pkg_id))
+        else:
+            print("Auto-adding dependency: {}".format(pkg_id))
+            add_package_file(repository, self.get_package_path(PackageId(pkg_id)))
+        return repository.load(pkg_id)
+
+    def prune_extracted_packages(self, pkg_ids):
+        """Remove every extracted package other than pkg_ids.
+
+        Also removes leftovers of interrupted extractions."""
+        directory = self.get_extracted_cache_dir()
+        for name in os.listdir(directory):
+            if name not in pkg_ids:
+                print("Removing extracted package {}".format(name))
+                remove_directory(directory + '/' + name)
+
     def list_trees(self):
         return get_variants_from_filesystem(self._packages_dir, 'treeinfo.json')
 
@@ -437,6 +672,31 @@ def get_docker_id(docker_name):
     return check_output(["docker", "inspect", "-f", "{{ .Id }}", docker_name]).decode('utf-8').strip()
 
 
+def get_docker_env(docker_id):
+    """Return the environment variables a docker image sets."""
+    env = json.loads(check_output(["docker", "inspect", "-f", "{{ json .Config.Env }}", docker_id]).decode('utf-8'))
+    return dict(variable.split('=', 1) for variable in env or list())
+
+
+def get_ccache_image(docker_id):
+    """Return the name of the image adding ccache to a builder image, building it if it doesn't exist yet."""
+    # Docker ids are of the form sha256:<hex>, tags can't contain ':'.
+    image_name = "pkgpanda-ccache:" + docker_id.split(':')[-1]
+    try:
+        get_docker_id(image_name)
+        return image_name
+    except CalledProcessError:
+        pass
+
+    print("Adding ccache to builder image {}".format(docker_id))
+    with tempfile.TemporaryDirectory(prefix="pkgpanda_ccache") as context:
+        write_string(context + "/Dockerfile", (
+            "FROM {}\n"
+            "RUN apt-get -qq update && apt-get -y install ccache && rm -rf /var/lib/apt/lists/*\n").format(docker_id))
+        check_call(["docker", "build", "--tag", image_name, context])
+    return image_name
+
+
 def hash_files_in_folder(directory):
     """Given a relative path, hashes all files inside that folder and subfolders
 
@@ -562,6 +822,11 @@ def make_bootstrap_tarball(package_store, packages, variant):
         return bootstrap_id
 
     if (os.path.exists(bootstrap_name)):
+        # The tarball only depends on the package ids, so if just the
+        # active.json metadata is missing or stale rewrite it and reuse the tarball.
+        if not os.path.exists(active_name) or load_json(active_name) != pkg_ids:
+            print("Bootstrap active.json out of date, rewriting")
+            write_json(active_name, pkg_ids)
         print("Bootstrap already up to date, not recreating")
         return mark_latest()
 
@@ -583,42 +848,55 @@ def make_bootstrap_tarball(package_store, packages, variant):
 
     pkgpanda_root = make_abs("opt/mesosphere")
     repository = Repository(os.path.join(pkgpanda_root, "packages"))
-
-    # Fetch all the packages to the root
-    for pkg_path in packages:
-        filename = os.path.basename(pkg_path)
-        pkg_id = filename[:-len(".tar.xz")]
-
-        def local_fetcher(id, target):
-            shutil.unpack_archive(pkg_path, target, "gztar")
-        repository.add(local_fetcher, pkg_id, False)
-
-    # Activate the packages inside the repository.
-    # Do generate dcos.target.wants inside the root so that we don't
-    # try messing with /etc/systemd/system.
-    install = Install(
-        root=pkgpanda_root,
-        config_dir=None,
-        rooted_systemd=True,
-        manage_systemd=False,
-        block_systemd=True,
-        fake_path=True,
-        skip_systemd_dirs=True,
-        manage_users=False,
-        manage_state_dir=False)
-    install.activate(repository.load_packages(pkg_ids))
-
-    # Mark the tarball as a bootstrap tarball/filesystem so that
-    # dcos-setup.service will fire.
-    make_file(make_abs("opt/mesosphere/bootstrap"))
+    make_directory(repository.path)
+
+    tmp_bootstrap_name = bootstrap_name + '.tmp'
+    with TarStream(tmp_bootstrap_name) as tar:
+        tar.add(pkgpanda_root, '.', recursive=False)
+        tar.add(repository.path, './packages', recursive=False)
+
+        # Extract all the packages to the root in parallel, streaming each one
+        # into the tarball (in a stable order) as soon as it is extracted.
+        def add_package(pkg_path):
+            pkg_id = os.path.basename(pkg_path)[:-len(".tar.xz")]
+            repository.add(lambda id, target: extract_tarball(pkg_path, target), pkg_id, False)
+            return pkg_id
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
+            for pkg_id in executor.map(add_package, packages):
+                tar.add(repository.package_path(pkg_id), './packages/' + pkg_id)
+
+        # Activate the packages inside the repository.
+        # Do generate dcos.target.wants inside the root so that we don't
+        # try messing with /etc/systemd/system.
+        # All the symlinks are made pointing to /opt/mesosphere since that is
+        # where the tarball will be extracted.
+        install = Install(
+            root=pkgpanda_root,
+            config_dir=None,
+            rooted_systemd=True,
+            manage_systemd=False,
+            block_systemd=True,
+            fake_path=True,
+            skip_systemd_dirs=True,
+            manage_users=False,
+            manage_state_dir=False,
+            symlink_rewrite=(work_dir, "/"))
+        install.activate(repository.load_packages(pkg_ids))
+
+        # Mark the tarball as a bootstrap tarball/filesystem so that
+        # dcos-setup.service will fire.
+        make_file(make_abs("opt/mesosphere/bootstrap"))
+
+        # Everything besides the packages was made by activation.
+        for name in sorted(os.listdir(pkgpanda_root)):
+            if name != 'packages':
+                tar.add(os.path.join(pkgpanda_root, name), './' + name)
 
     # Write out an active.json for the bootstrap tarball
     write_json(active_name, pkg_ids)
 
-    # Rewrite all the symlinks to point to /opt/mesosphere
-    rewrite_symlinks(work_dir, work_dir, "/")
-
-    make_tar(bootstrap_name, pkgpanda_root)
+    os.replace(tmp_bootstrap_name, bootstrap_name)
 
     remove_directory(work_dir)
 
@@ -629,7 +907,48 @@ def make_bootstrap_tarball(package_store, packages, variant):
     return mark_latest()
 
 
-def build_tree_variants(package_store, mkbootstrap):
+def get_package_sources(buildinfo, name):
+    """Return the sources of a package, expanding single_source the same way _build does."""
+    if 'sources' in buildinfo:
+        return buildinfo['sources']
+    if 'single_source' in buildinfo:
+        return {name: buildinfo['single_source']}
+    return dict()
+
+
+def prefetch_sources(package_store, package_tuples, max_workers=8):
+    """Populate the source caches of all the given packages concurrently.
+
+    Only sources with a cache (url, url_extract, git) are fetched. Builds can
+    then check the sources out of the cache without any network access.
+    """
+    fetchers = dict()
+    for name, variant in sorted(package_tuples, key=lambda t: (t[0], pkgpanda.util.variant_str(t[1]))):
+        for src_name, src_info in sorted(get_package_sources(package_store.get_buildinfo(name, variant), name).items()):
+            if src_info.get('kind') not in {'git', 'url', 'url_extract'}:
+                continue
+            cache_dir = package_store.get_package_cache_folder(name) + '/' + src_name
+            # Variants of a package share the source cache folder.
+            if cache_dir in fetchers:
+                continue
+            make_directory(cache_dir)
+            fetchers[cache_dir] = get_src_fetcher(src_info, cache_dir, package_store.get_package_folder(name))
+
+    with logger.scope("Prefetching {} sources".format(len(fetchers))):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(fetcher.fetch): cache_dir for cache_dir, fetcher in fetchers.items()}
+            errors = list()
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except (CalledProcessError, FetchError, ValidationError) as ex:
+                    errors.append("{}: {}".format(futures[future], ex))
+
+    if errors:
+        raise BuildError("Unable to prefetch sources:\n{}".format('\n'.join(sorted(errors))))
+
+
+def build_tree_variants(package_store, mkbootstrap, prefetch=False, builder_pool=None, compiler_cache=None):
     """ Builds all possible tree variants in a given package store
     """
     result = dict()
@@ -637,17 +956,36 @@ def build_tree_variants(package_store, mkbootstrap):
     if len(tree_variants) == 0:
         raise Exception('No treeinfo.json can be found in {}'.format(package_store.packages_dir))
     for variant in tree_variants:
-        result[variant] = pkgpanda.build.build_tree(package_store, mkbootstrap, variant)
+        result[variant] = pkgpanda.build.build_tree(
+            package_store, mkbootstrap, variant, prefetch, builder_pool, compiler_cache, prune_extracted=False)
+    # Pruning after each variant would remove the packages the other variants still use.
+    package_store.prune_extracted_packages({
+        pkg_id
+        for variant_result in result.values()
+        for info in variant_result.values()
+        for pkg_id in info['packages']})
     return result
 
 
-def build_tree(package_store, mkbootstrap, tree_variants):
+def build_tree(package_store, mkbootstrap, tree_variants, prefetch=False, builder_pool=None, compiler_cache=None,
+               prune_extracted=True):
     """Build packages and bootstrap tarballs for one or all tree variants.
 
     Returns a dict mapping tree variants to bootstrap IDs.
 
     If tree_variant is None, builds all available tree variants.
 
+    If prefetch is True, the sources of every package in the tree are
+    downloaded concurrently before any package is built.
+
+    If builder_pool is given, quick steps such as cleaning up between builds
+    are run in its long-lived containers.
+
+    If compiler_cache is given, it is mounted into every package build.
+
+    If prune_extracted is True, extracted packages which aren't part of the
+    tree are removed from the extracted package cache afterwards.
+
     """
     # TODO(cmaloney): Add support for circular dependencies. They are doable
     # long as there is a pre-built version of enough of the packages.
@@ -718,6 +1056,10 @@ def build_tree(package_store, mkbootstrap, tree_variants):
         for package_set in package_sets:
             visit_packages(package_set.all_packages)
 
+    if prefetch:
+        with build_report.phase('<tree>', 'prefetch sources'):
+            prefetch_sources(package_store, build_order)
+
     built_packages = dict()
     for (name, variant) in build_order:
         built_packages.setdefault(name, dict())
@@ -728,7 +1070,9 @@ def build_tree(package_store, mkbootstrap, tree_variants):
             package_store,
             name,
             variant,
-            True)
+            True,
+            builder_pool=builder_pool,
+            compiler_cache=compiler_cache)
 
     # Build bootstrap tarballs for all tree variants.
     def make_bootstrap(package_set):
@@ -738,10 +1082,11 @@ def build_tree(package_store, mkbootstrap, tree_variants):
                 package_paths.append(built_packages[name][pkg_variant])
 
             if mkbootstrap:
-                return make_bootstrap_tarball(
-                    package_store,
-                    list(sorted(package_paths)),
-                    package_set.variant)
+                with build_report.phase(package_label('<bootstrap>', package_set.variant), 'bootstrap'):
+                    return make_bootstrap_tarball(
+                        package_store,
+                        list(sorted(package_paths)),
+                        package_set.variant)
 
     # Build bootstraps and and package lists for all variants.
     # TODO(cmaloney): Allow distinguishing between "build all" and "build the default one".
@@ -759,6 +1104,10 @@ def build_tree(package_store, mkbootstrap, tree_variants):
             info)
         results[package_set.variant] = info
 
+    if prune_extracted:
+        # Later builds of the tree can only depend on the packages just built.
+        package_store.prune_extracted_packages({pkg_id for info in results.values() for pkg_id in info['packages']})
+
     return results
 
 
@@ -769,7 +1118,8 @@ def assert_no_duplicate_keys(lhs, rhs):
 
 
 # Find all build variants and build them
-def build_package_variants(package_store, name, clean_after_build=True, recursive=False):
+def build_package_variants(
+        package_store, name, clean_after_build=True, recursive=False, builder_pool=None, compiler_cache=None):
     # Find the packages dir / root of the packages tree, and create a PackageStore
     results = dict()
     for variant in package_store.packages_by_name[name].keys():
@@ -778,7 +1128,9 @@ def build_package_variants(package_store, name, clean_after_build=True, recursiv
             name,
             variant,
             clean_after_build=clean_after_build,
-            recursive=recursive)
+            recursive=recursive,
+            builder_pool=builder_pool,
+            compiler_cache=compiler_cache)
     return results
 
 
@@ -825,16 +1177,20 @@ class IdBuilder():
         return self._buildinfo
 
 
-def build(package_store: PackageStore, name: str, variant, clean_after_build, recursive=False):
+def build(package_store: PackageStore, name: str, variant, clean_after_build, recursive=False, builder_pool=None,
+          compiler_cache=None):
     msg = "Building package {} variant {}".format(name, pkgpanda.util.variant_name(variant))
     with logger.scope(msg):
-        return _build(package_store, name, variant, clean_after_build, recursive)
+        return _build(package_store, name, variant, clean_after_build, recursive, builder_pool, compiler_cache)
 
 
-def _build(package_store, name, variant, clean_after_build, recursive):
+def _build(package_store, name, variant, clean_after_build, recursive, builder_pool, compiler_cache):
     assert isinstance(package_store, PackageStore)
-    tmpdir = tempfile.TemporaryDirectory(prefix="pkgpanda_repo")
-    repository = Repository(tmpdir.name)
+    label = package_label(name, variant)
+    # Dependencies are extracted into a repository shared by all builds and
+    # mounted read-only into the build, so each package is only extracted
+    # once per host rather than once per package depending on it.
+    repository = Repository(package_store.get_extracted_cache_dir())
 
     package_dir = package_store.get_package_folder(name)
 
@@ -917,12 +1273,13 @@ def _build(package_store, name, variant, clean_after_build, recursive):
     cmd.container = docker_name
 
     # Add the id of the docker build environment to the build_ids.
-    try:
-        docker_id = get_docker_id(docker_name)
-    except CalledProcessError:
-        # docker pull the container and try again
-        check_call(['docker', 'pull', docker_name])
-        docker_id = get_docker_id(docker_name)
+    with build_report.phase(label, 'docker pull'):
+        try:
+            docker_id = get_docker_id(docker_name)
+        except CalledProcessError:
+            # docker pull the container and try again
+            check_call(['docker', 'pull', docker_name])
+            docker_id = get_docker_id(docker_name)
 
     builder.update('docker', docker_id)
 
@@ -1012,7 +1369,8 @@ def _build(package_store, name, variant, clean_after_build, recursive):
         if not os.path.exists(requires_last_build):
             if recursive:
                 # Build the dependency
-                build(package_store, requires_name, requires_variant, clean_after_build, recursive)
+                build(package_store, requires_name, requires_variant, clean_after_build, recursive, builder_pool,
+                      compiler_cache)
             else:
                 raise BuildError("No last build file found for dependency {} variant {}. Rebuild "
                                  "the dependency".format(requires_name, requires_variant))
@@ -1087,6 +1445,7 @@ def _build(package_store, name, variant, clean_after_build, recursive):
     # Done if it exists locally
     if exists(pkg_path):
         print("Package up to date. Not re-building.")
+        build_report.set_size(label, os.path.getsize(pkg_path))
 
         # TODO(cmaloney): Updating / filling last_build should be moved out of
         # the build function.
@@ -1095,7 +1454,8 @@ def _build(package_store, name, variant, clean_after_build, recursive):
         return pkg_path
 
     # Try downloading.
-    dl_path = package_store.try_fetch_by_id(pkg_id)
+    with build_report.phase(label, 'download'):
+        dl_path = package_store.try_fetch_by_id(pkg_id)
     if dl_path:
         print("Package up to date. Not re-building. Downloaded from repository-url.")
         # TODO(cmaloney): Updating / filling last_build should be moved out of
@@ -1103,6 +1463,7 @@ def _build(package_store, name, variant, clean_after_build, recursive):
         write_string(package_store.get_last_build_filename(name, variant), str(pkg_id))
         print(dl_path, pkg_path)
         assert dl_path == pkg_path
+        build_report.set_size(label, os.path.getsize(pkg_path))
         return pkg_path
 
     # Fall out and do the build since it couldn't be downloaded
@@ -1119,7 +1480,16 @@ def _build(package_store, name, variant, clean_after_build, recursive):
         cmd.volumes = {
             package_store.get_package_cache_folder(name): PKG_DIR + "/:rw",
         }
-        if is_windows:
+        if builder_pool is not None and not is_windows:
+            # Mount the cache folder of every package so that one pooled
+            # container can clean up after all the builds.
+            cmd.volumes = {
+                package_store.get_package_cache_dir(): PKG_DIR + "/:rw",
+            }
+            cmd.container = "ubuntu:14.04.4"
+            package_folder = PKG_DIR + "/" + name
+            cmd.run("package-cleaner", ["rm", "-rf", package_folder + "/src", package_folder + "/result"], builder_pool)
+        elif is_windows:
             cmd.container = "microsoft/windowsservercore:1709"
             filename = PKG_DIR + "\\src"
             cmd.run("package-cleaner",
@@ -1131,7 +1501,8 @@ def _build(package_store, name, variant, clean_after_build, recursive):
             cmd.container = "ubuntu:14.04.4"
             cmd.run("package-cleaner", ["rm", "-rf", PKG_DIR + "/src", PKG_DIR + "/result"])
 
-    clean()
+    with build_report.phase(label, 'clean'):
+        clean()
 
     # Only fresh builds are allowed which don't overlap existing artifacts.
     result_dir = cache_abs("result")
@@ -1140,13 +1511,9 @@ def _build(package_store, name, variant, clean_after_build, recursive):
                          "built. {}".format(result_dir))
 
     # 'mkpanda add' all implicit dependencies since we actually need to build.
-    for dep in auto_deps:
-        print("Auto-adding dependency: {}".format(dep))
-        # NOTE: Not using the name pkg_id because that overrides the outer one.
-        id_obj = PackageId(dep)
-        add_package_file(repository, package_store.get_package_path(id_obj))
-        package = repository.load(dep)
-        active_packages.append(package)
+    with build_report.phase(label, 'extract dependencies'):
+        for dep in auto_deps:
+            active_packages.append(package_store.get_extracted_package(dep))
 
     # Checkout all the sources int their respective 'src/' folders.
     try:
@@ -1157,11 +1524,12 @@ def _build(package_store, name, variant, clean_after_build, recursive):
                 "Currently all builds must be from scratch. Support should be " +
                 "added for re-using a src directory when possible. src={}".format(src_dir))
         os.mkdir(src_dir)
-        for src_name, fetcher in sorted(fetchers.items()):
-            root = cache_abs('src/' + src_name)
-            os.mkdir(root)
+        with build_report.phase(label, 'fetch sources'):
+            for src_name, fetcher in sorted(fetchers.items()):
+                root = cache_abs('src/' + src_name)
+                os.mkdir(root)
 
-            fetcher.checkout_to(root)
+                fetcher.checkout_to(root)
     except ValidationError as ex:
         raise BuildError("Validation error when fetching sources for package: {}".format(ex))
 
@@ -1169,22 +1537,23 @@ def _build(package_store, name, variant, clean_after_build, recursive):
     # variables.
     # TODO(cmaloney): RAII type thing for temproary directory so if we
     # don't get all the way through things will be cleaned up?
-    install = Install(
-        root=install_dir,
-        config_dir=None,
-        rooted_systemd=True,
-        manage_systemd=False,
-        block_systemd=True,
-        fake_path=True,
-        manage_users=False,
-        manage_state_dir=False)
-    install.activate(active_packages)
-    # Rewrite all the symlinks inside the active path because we will
-    # be mounting the folder into a docker container, and the absolute
-    # paths to the packages will change.
-    # TODO(cmaloney): This isn't very clean, it would be much nicer to
-    # just run pkgpanda inside the package.
-    rewrite_symlinks(install_dir, repository.path, install_root + "/packages/")
+    with build_report.phase(label, 'extract dependencies'):
+        install = Install(
+            root=install_dir,
+            config_dir=None,
+            rooted_systemd=True,
+            manage_systemd=False,
+            block_systemd=True,
+            fake_path=True,
+            manage_users=False,
+            manage_state_dir=False)
+        install.activate(active_packages)
+        # Rewrite all the symlinks inside the active path because we will
+        # be mounting the folder into a docker container, and the absolute
+        # paths to the packages will change.
+        # TODO(cmaloney): This isn't very clean, it would be much nicer to
+        # just run pkgpanda inside the package.
+        rewrite_symlinks(install_dir, repository.path, install_root + "/packages/")
 
     print("Building package in docker")
 
@@ -1239,14 +1608,23 @@ def _build(package_store, name, variant, clean_after_build, recursive):
         "NUM_CORES": multiprocessing.cpu_count()
     }
 
+    ccache_dir = None
+    if compiler_cache is not None and not is_windows:
+        ccache_dir = compiler_cache.add_to(cmd, name, docker_id)
+        ccache_stats = compiler_cache.get_stats(ccache_dir)
+
     try:
         # TODO(cmaloney): Run a wrapper which sources
         # /opt/mesosphere/environment then runs a build. Also should fix
         # ownership of /opt/mesosphere/packages/{pkg_id} post build.
         command = [PKG_DIR + "/build/" + build_script_file]
-        cmd.run("package-builder", command)
+        with build_report.phase(label, 'build script'):
+            cmd.run("package-builder", command)
     except CalledProcessError as ex:
         raise BuildError("docker exited non-zero: {}\nCommand: {}".format(ex.returncode, ' '.join(ex.cmd)))
+    finally:
+        if ccache_dir is not None:
+            print(compiler_cache.format_stats(ccache_stats, compiler_cache.get_stats(ccache_dir)))
 
     # Clean up the temporary install dir used for dependencies.
     # TODO(cmaloney): Move to an RAII wrapper.
@@ -1265,9 +1643,12 @@ def _build(package_store, name, variant, clean_after_build, recursive):
 
     # Bundle the artifacts into the pkgpanda package
     tmp_name = pkg_path + "-tmp.tar.xz"
-    make_tar(tmp_name, cache_abs("result"))
+    with build_report.phase(label, 'compress'):
+        make_tar(tmp_name, cache_abs("result"))
     os.replace(tmp_name, pkg_path)
+    build_report.set_size(label, os.path.getsize(pkg_path))
     print("Package built.")
     if clean_after_build:
-        clean()
+        with build_report.phase(label, 'clean'):
+            clean()
     return pkg_path
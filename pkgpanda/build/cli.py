@@ -6,10 +6,22 @@ the necessary dependencies.
 
 Usage:
   mkpanda [--repository-url=<repository_url>] [--dont-clean-after-build] [--recursive] [--variant=<variant>]
-  mkpanda tree [--mkbootstrap] [--repository-url=<repository_url>] [--variant=<variant>]
+    [--report=<report_json>] [--ccache-dir=<dir> [--ccache-max-size=<size>]]
+  mkpanda tree [--mkbootstrap] [--prefetch] [--repository-url=<repository_url>] [--variant=<variant>]
+    [--report=<report_json>] [--no-builder-pool] [--ccache-dir=<dir> [--ccache-max-size=<size>]]
+  mkpanda compare-reports <old_report_json> <new_report_json> [--threshold=<fraction>]
+
+Options:
+  --prefetch                Download the sources of all packages in the tree concurrently before building.
+  --no-builder-pool         Start a fresh docker container for every clean up step instead of reusing one.
+  --report=<report_json>    Write the wall time of each build phase and size of each package as JSON.
+  --threshold=<fraction>    Fraction a phase must slow down by to count as a regression [default: 0.1].
+  --ccache-dir=<dir>        Keep a ccache per package and docker image in <dir>, mounted into builds as CCACHE_DIR.
+  --ccache-max-size=<size>  Size limit of each compiler cache, passed as CCACHE_MAXSIZE [default: 5G].
 """
 
 import sys
+from contextlib import ExitStack
 from os import getcwd, umask
 from os.path import basename, normpath
 
@@ -17,6 +29,29 @@ from docopt import docopt
 
 import pkgpanda.build
 import pkgpanda.build.constants
+from pkgpanda.build.report import (build_report, compare_reports, format_regressions, format_report_table,
+                                   load_report)
+
+
+def write_report(filename):
+    print("Build times (seconds):")
+    print(build_report.format_table())
+    if filename:
+        build_report.write(filename)
+        print("Build report written to {}".format(filename))
+
+
+def compare(old_filename, new_filename, threshold):
+    old = load_report(old_filename)
+    new = load_report(new_filename)
+    print(format_report_table(new))
+    regressions = compare_reports(old, new, threshold)
+    if not regressions:
+        print("No build time regressions.")
+        return 0
+    print("Build time regressions:")
+    print(format_regressions(regressions))
+    return 1
 
 
 def main():
@@ -27,13 +62,37 @@ def main():
         # map the keyword 'default' to None to build default as this is how default is internally
         # represented, but use the None argument (i.e. the lack of variant arguments) to trigger all variants
         target_variant = variant_arg if variant_arg != 'default' else None
+        if arguments['compare-reports']:
+            sys.exit(compare(
+                arguments['<old_report_json>'],
+                arguments['<new_report_json>'],
+                float(arguments['--threshold'])))
+        compiler_cache = None
+        if arguments['--ccache-dir']:
+            compiler_cache = pkgpanda.build.CompilerCache(arguments['--ccache-dir'], arguments['--ccache-max-size'])
         # Make a local repository for build dependencies
         if arguments['tree']:
             package_store = pkgpanda.build.PackageStore(getcwd(), arguments['--repository-url'])
-            if variant_arg is None:
-                pkgpanda.build.build_tree_variants(package_store, arguments['--mkbootstrap'])
-            else:
-                pkgpanda.build.build_tree(package_store, arguments['--mkbootstrap'], [target_variant])
+            with ExitStack() as stack:
+                builder_pool = None
+                if not arguments['--no-builder-pool']:
+                    builder_pool = stack.enter_context(pkgpanda.build.BuilderContainerPool())
+                if variant_arg is None:
+                    pkgpanda.build.build_tree_variants(
+                        package_store,
+                        arguments['--mkbootstrap'],
+                        arguments['--prefetch'],
+                        builder_pool,
+                        compiler_cache)
+                else:
+                    pkgpanda.build.build_tree(
+                        package_store,
+                        arguments['--mkbootstrap'],
+                        [target_variant],
+                        arguments['--prefetch'],
+                        builder_pool,
+                        compiler_cache)
+            write_report(arguments['--report'])
             sys.exit(0)
 
         # Package name is the folder name.
@@ -56,7 +115,8 @@ def main():
                 package_store,
                 name,
                 clean_after_build,
-                recursive)
+                recursive,
+                compiler_cache=compiler_cache)
         else:
             # variant given, only build that one package variant
             pkg_dict = {
@@ -65,9 +125,12 @@ def main():
                     name,
                     target_variant,
                     clean_after_build,
-                    recursive)
+                    recursive,
+                    compiler_cache=compiler_cache)
             }
 
+        write_report(arguments['--report'])
+
         print("Package variants available as:")
         for k, v in pkg_dict.items():
             if k is None:
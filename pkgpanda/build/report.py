@@ -0,0 +1,139 @@
+"""Per-package, per-phase timing of mkpanda builds.
+
+Phases are timed with `build_report.phase()`. The resulting report can be
+saved as JSON, printed as a table, and compared against a report from a
+previous build to catch build time regressions.
+"""
+import time
+from contextlib import contextmanager
+
+import pkgpanda.util
+from pkgpanda.util import load_json, write_json
+
+
+def package_label(name, variant):
+    return name + pkgpanda.util.variant_suffix(variant, ':')
+
+
+class BuildReport:
+
+    def __init__(self):
+        # label -> {'phases': {phase: seconds}, 'size': bytes or None}
+        self._packages = dict()
+
+    def _get_package(self, label):
+        return self._packages.setdefault(label, {'phases': dict(), 'size': None})
+
+    @contextmanager
+    def phase(self, label, phase):
+        """Time the body of the `with` statement as phase of the given package.
+
+        Time spent in the same phase multiple times is summed. Failed phases
+        are recorded as well since slow failures are interesting too."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            phases = self._get_package(label)['phases']
+            phases[phase] = phases.get(phase, 0.0) + time.monotonic() - start
+
+    def set_size(self, label, size):
+        self._get_package(label)['size'] = size
+
+    def to_dict(self):
+        return {
+            'packages': {
+                label: {
+                    'phases': dict(info['phases']),
+                    'size': info['size'],
+                    'total': sum(info['phases'].values())
+                }
+                for label, info in self._packages.items()
+            },
+            'total': sum(sum(info['phases'].values()) for info in self._packages.values())
+        }
+
+    def write(self, filename):
+        write_json(filename, self.to_dict())
+
+    def format_table(self):
+        return format_report_table(self.to_dict())
+
+    def clear(self):
+        self._packages.clear()
+
+
+def load_report(filename):
+    return load_json(filename)
+
+
+def _format_size(size):
+    if size is None:
+        return '-'
+    for unit in ['B', 'KiB', 'MiB']:
+        if size < 1024:
+            return "{:.1f}{}".format(size, unit)
+        size /= 1024
+    return "{:.1f}GiB".format(size)
+
+
+def _format_rows(rows):
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = list()
+    for row in rows:
+        # Left align the first column (names), right align the numbers.
+        cells = [row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+        lines.append('  '.join(cells).rstrip())
+    return '\n'.join(lines)
+
+
+def format_report_table(report):
+    """Return a human readable table of a report, slowest packages first."""
+    packages = report['packages']
+    phases = sorted(set(phase for info in packages.values() for phase in info['phases']))
+    rows = [['package'] + phases + ['total', 'size']]
+    for label, info in sorted(packages.items(), key=lambda item: (-item[1]['total'], item[0])):
+        rows.append(
+            [label] +
+            ["{:.1f}".format(info['phases'][phase]) if phase in info['phases'] else '-' for phase in phases] +
+            ["{:.1f}".format(info['total']), _format_size(info['size'])])
+    rows.append(['total'] + [''] * len(phases) + ["{:.1f}".format(report['total']), ''])
+    return _format_rows(rows)
+
+
+def compare_reports(old, new, threshold=0.1, min_seconds=1.0):
+    """Compare two reports, returning a list of regressions.
+
+    A regression is a package phase (or package total) which got slower by
+    more than `threshold` (a fraction of the old time) and more than
+    `min_seconds`, so that noise in very quick phases is ignored. Packages
+    or phases which only appear in one of the reports aren't regressions.
+
+    Each regression is a tuple (package label, phase, old seconds, new seconds).
+    """
+    regressions = list()
+
+    def check(label, phase, old_time, new_time):
+        if new_time - old_time > min_seconds and new_time > old_time * (1 + threshold):
+            regressions.append((label, phase, old_time, new_time))
+
+    for label in sorted(old['packages'].keys() & new['packages'].keys()):
+        old_info = old['packages'][label]
+        new_info = new['packages'][label]
+        for phase in sorted(old_info['phases'].keys() & new_info['phases'].keys()):
+            check(label, phase, old_info['phases'][phase], new_info['phases'][phase])
+        check(label, 'total', old_info['total'], new_info['total'])
+    check('<all>', 'total', old['total'], new['total'])
+
+    return regressions
+
+
+def format_regressions(regressions):
+    rows = [['package', 'phase', 'old', 'new', 'change']]
+    for label, phase, old_time, new_time in regressions:
+        change = "+{:.0f}%".format((new_time / old_time - 1) * 100) if old_time else 'new'
+        rows.append([label, phase, "{:.1f}".format(old_time), "{:.1f}".format(new_time), change])
+    return _format_rows(rows)
+
+
+build_report = BuildReport()
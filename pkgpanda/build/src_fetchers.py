@@ -4,7 +4,7 @@ import shutil
 from subprocess import CalledProcessError, check_call, check_output
 
 from pkgpanda.exceptions import ValidationError
-from pkgpanda.util import download_atomic, is_windows, logger, sha1
+from pkgpanda.util import download_atomic, is_windows, load_json, logger, sha1, write_json
 
 
 # Ref must be a git sha-1. We then pass it through get_sha1 to make
@@ -57,6 +57,12 @@ class SourceFetcher(metaclass=abc.ABCMeta):
         """Makes the artifact appear in the passed directory"""
         pass
 
+    def fetch(self):
+        """Populates the local cache of the source without checking it out anywhere.
+
+        Sources which don't have a cache (git_local) have nothing to do here."""
+        pass
+
 
 def get_git_sha1(bare_folder, ref):
         try:
@@ -92,11 +98,14 @@ class GitSrcFetcher(SourceFetcher):
     def get_id(self):
         return {"commit": self.ref}
 
-    def checkout_to(self, directory):
+    def fetch(self):
         # fetch into a bare repository so if we're on a host which has a cache we can
         # only get the new commits.
         fetch_git(self.bare_folder, self.url)
 
+    def checkout_to(self, directory):
+        self.fetch()
+
         # Warn if the ref_origin is set and gives a different sha1 than the
         # current ref.
         try:
@@ -309,23 +318,64 @@ class UrlSrcFetcher(SourceFetcher):
             "downloaded_sha1": self.sha
         }
 
-    def checkout_to(self, directory):
+    def _get_verified_filename(self):
+        return self.cache_filename + '.verified.json'
+
+    def _get_verified_sha(self):
+        """Return the sha1 recorded when the cached download was last verified.
+
+        The recorded sha1 is only trusted if the size and mtime of the cached
+        download still match what they were at verification time, otherwise
+        None is returned and the file must be re-hashed.
+        """
+        try:
+            verified = load_json(self._get_verified_filename())
+            stat = os.stat(self.cache_filename)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(verified, dict):
+            return None
+        if verified.get('size') != stat.st_size or verified.get('mtime_ns') != stat.st_mtime_ns:
+            return None
+        return verified.get('sha1')
+
+    def _write_verified_sha(self, file_sha):
+        stat = os.stat(self.cache_filename)
+        write_json(self._get_verified_filename(), {
+            'sha1': file_sha,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns
+        })
+
+    def fetch(self):
         # Download file to cache if it isn't already there
         if not os.path.exists(self.cache_filename):
             print("Downloading source tarball {}".format(self.url))
             download_atomic(self.cache_filename, self.url, self.working_directory)
 
+        # Skip re-hashing the cached download if it is unchanged since it was last verified.
+        if self._get_verified_sha() == self.sha:
+            return
+
         # Validate the sha1 of the source is given and matches the sha1
         file_sha = sha1(self.cache_filename)
 
         if self.sha != file_sha:
             corrupt_filename = self.cache_filename + '.corrupt'
             os.replace(self.cache_filename, corrupt_filename)
+            if os.path.exists(self._get_verified_filename()):
+                os.remove(self._get_verified_filename())
             raise ValidationError(
                 "Provided sha1 didn't match sha1 of downloaded file, corrupt download saved as {}. "
                 "Provided: {}, Download file's sha1: {}, Url: {}".format(
                     corrupt_filename, self.sha, file_sha, self.url))
 
+        self._write_verified_sha(file_sha)
+
+    def checkout_to(self, directory):
+        self.fetch()
+
         if self.extract:
             extract_archive(self.cache_filename, directory)
         else:
@@ -0,0 +1,71 @@
+from subprocess import CalledProcessError
+
+import pytest
+
+import pkgpanda.build
+from pkgpanda.util import is_windows
+
+
+class FakeDockerCmd:
+
+    def __init__(self, container, volumes, environment=None):
+        self.container = container
+        self.volumes = volumes
+        self.environment = environment or dict()
+
+
+@pytest.fixture
+def docker_calls(monkeypatch):
+    calls = list()
+
+    def fake_check_call(cmd):
+        calls.append(cmd)
+        if cmd[:3] == ['docker', 'run', '--detach'] and 'broken' in cmd:
+            raise CalledProcessError(1, cmd)
+
+    monkeypatch.setattr(pkgpanda.build, 'check_call', fake_check_call)
+    monkeypatch.setattr(pkgpanda.build, 'random_container_name', lambda name: name + '-x')
+    return calls
+
+
+@pytest.mark.skipif(is_windows, reason="The builder pool isn't used on Windows")
+def test_builder_pool_reuses_containers(docker_calls):
+    with pkgpanda.build.BuilderContainerPool() as pool:
+        cmd = FakeDockerCmd('ubuntu', {'/cache': '/pkg:rw'})
+        assert pool.run(cmd, 'cleaner', ['rm', '-rf', '/pkg/a/src'])
+        assert pool.run(cmd, 'cleaner', ['rm', '-rf', '/pkg/b/src'])
+        # Different volumes need a different container.
+        assert pool.run(FakeDockerCmd('ubuntu', {'/other': '/pkg:rw'}, {'FOO': 'bar'}), 'other', ['true'])
+
+    assert docker_calls == [
+        ['docker', 'run', '--detach', '--name=cleaner-x', '-v', '/cache:/pkg:rw',
+         '--entrypoint', 'sleep', 'ubuntu', 'infinity'],
+        ['docker', 'exec', 'cleaner-x', 'rm', '-rf', '/pkg/a/src'],
+        ['docker', 'exec', 'cleaner-x', 'rm', '-rf', '/pkg/b/src'],
+        ['docker', 'run', '--detach', '--name=other-x', '-v', '/other:/pkg:rw',
+         '--entrypoint', 'sleep', 'ubuntu', 'infinity'],
+        ['docker', 'exec', '-e', 'FOO=bar', 'other-x', 'true'],
+        ['docker', 'rm', '--force', '-v', 'cleaner-x'],
+        ['docker', 'rm', '--force', '-v', 'other-x'],
+    ]
+
+
+@pytest.mark.skipif(is_windows, reason="The builder pool isn't used on Windows")
+def test_docker_cmd_falls_back_without_pool(docker_calls):
+    pool = pkgpanda.build.BuilderContainerPool()
+    cmd = pkgpanda.build.DockerCmd()
+    cmd.container = 'broken'
+    cmd.volumes = {'/cache': '/pkg:rw'}
+    cmd.run('cleaner', ['true'], pool)
+    # Once a pooled container fails to start the pool stays disabled.
+    cmd.run('cleaner', ['true'], pool)
+    pool.close()
+
+    fresh_container = [
+        ['docker', 'run', '--name=cleaner-x', '-v', '/cache:/pkg:rw', 'broken', 'true'],
+        ['docker', 'rm', '-v', 'cleaner-x'],
+    ]
+    assert docker_calls == [
+        ['docker', 'run', '--detach', '--name=cleaner-x', '-v', '/cache:/pkg:rw',
+         '--entrypoint', 'sleep', 'broken', 'infinity'],
+    ] + fresh_container * 2
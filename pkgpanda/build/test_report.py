@@ -0,0 +1,73 @@
+import pytest
+
+from pkgpanda.build.report import BuildReport, compare_reports, format_report_table, load_report, package_label
+
+
+def test_build_report(tmpdir, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+
+    report = BuildReport()
+    label = package_label('mesos', None)
+    with report.phase(label, 'build script'):
+        now[0] += 10
+    with report.phase(label, 'clean'):
+        now[0] += 1
+    # Time spent in the same phase again is added up.
+    with report.phase(label, 'clean'):
+        now[0] += 2
+    with pytest.raises(ValueError):
+        with report.phase(package_label('dcos-image', 'installer'), 'fetch sources'):
+            now[0] += 5
+            raise ValueError()
+    report.set_size(label, 2048)
+
+    assert report.to_dict() == {
+        'packages': {
+            'mesos': {'phases': {'build script': 10.0, 'clean': 3.0}, 'size': 2048, 'total': 13.0},
+            'dcos-image:installer': {'phases': {'fetch sources': 5.0}, 'size': None, 'total': 5.0},
+        },
+        'total': 18.0
+    }
+
+    filename = str(tmpdir.join('report.json'))
+    report.write(filename)
+    assert load_report(filename) == report.to_dict()
+
+    table = format_report_table(report.to_dict()).splitlines()
+    assert table[0].split() == ['package', 'build', 'script', 'clean', 'fetch', 'sources', 'total', 'size']
+    # Slowest package first.
+    assert table[1].split() == ['mesos', '10.0', '3.0', '-', '13.0', '2.0KiB']
+    assert table[2].split() == ['dcos-image:installer', '-', '-', '5.0', '5.0', '-']
+    assert table[3].split() == ['total', '18.0']
+
+
+def make_report(phases):
+    return {
+        'packages': {
+            label: {'phases': package_phases, 'size': None, 'total': sum(package_phases.values())}
+            for label, package_phases in phases.items()
+        },
+        'total': sum(sum(package_phases.values()) for package_phases in phases.values())
+    }
+
+
+def test_compare_reports():
+    old = make_report({
+        'mesos': {'build script': 100.0, 'clean': 0.5},
+        'removed': {'build script': 10.0},
+    })
+    new = make_report({
+        'mesos': {'build script': 105.0, 'clean': 1.2},
+        'added': {'build script': 10.0},
+    })
+    # Small relative and small absolute changes aren't regressions.
+    assert compare_reports(old, new) == []
+
+    new['packages']['mesos']['phases']['build script'] = 150.0
+    new['packages']['mesos']['total'] = 151.2
+    assert compare_reports(old, new) == [
+        ('mesos', 'build script', 100.0, 150.0),
+        ('mesos', 'total', 100.5, 151.2),
+    ]
+    assert compare_reports(old, new, threshold=0.6) == []
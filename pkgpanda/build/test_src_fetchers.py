@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+import pkgpanda.build.src_fetchers
+from pkgpanda.exceptions import ValidationError
+from pkgpanda.util import sha1
+
+
+def make_url_fetcher(tmpdir, contents):
+    src = tmpdir.join("work/foo.tar.gz")
+    src.write(contents, ensure=True)
+    cache_dir = tmpdir.join("cache")
+    cache_dir.ensure(dir=True)
+    return pkgpanda.build.src_fetchers.UrlSrcFetcher(
+        {'kind': 'url', 'url': 'file://foo.tar.gz', 'sha1': sha1(str(src))},
+        str(cache_dir),
+        str(tmpdir.join("work")))
+
+
+def test_url_fetch_records_verified_sha(tmpdir, monkeypatch):
+    fetcher = make_url_fetcher(tmpdir, "foo contents")
+    fetcher.fetch()
+    assert os.path.exists(fetcher.cache_filename)
+    assert fetcher._get_verified_sha() == fetcher.sha
+
+    # An unchanged cached download is trusted without being re-hashed.
+    def fail_sha1(filename):
+        raise AssertionError("sha1 should not be recomputed for {}".format(filename))
+    monkeypatch.setattr(pkgpanda.build.src_fetchers, 'sha1', fail_sha1)
+    fetcher.fetch()
+
+    out_dir = tmpdir.join("out")
+    out_dir.ensure(dir=True)
+    fetcher.checkout_to(str(out_dir))
+    assert out_dir.join("foo.tar.gz").read() == "foo contents"
+
+
+def test_url_fetch_rehashes_modified_cache(tmpdir):
+    fetcher = make_url_fetcher(tmpdir, "foo contents")
+    fetcher.fetch()
+
+    # Changing the cached file invalidates the recorded sha1.
+    with open(fetcher.cache_filename, 'w') as f:
+        f.write("corrupted contents")
+    assert fetcher._get_verified_sha() is None
+
+    with pytest.raises(ValidationError):
+        fetcher.fetch()
+    assert os.path.exists(fetcher.cache_filename + '.corrupt')
+    assert not os.path.exists(fetcher._get_verified_filename())
@@ -1,4 +1,11 @@
+import os
+import tarfile
+from subprocess import check_call
+
+import pytest
+
 import pkgpanda.build
+from pkgpanda.util import is_windows, load_json, make_tar, resources_test_dir
 
 
 def test_hash_files_in_folder(tmpdir):
@@ -84,3 +91,187 @@ def test_hash_files_in_folder(tmpdir):
             'baz/bang/new': '15bc116ce980d703d62a16531b0ef5bb42fef91c',
             'baz/bang/swish/swipe': 'e855a8aca0e15c14144901428df7042798a622d6'
         }
+
+
+class BootstrapPackageStore:
+
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+
+    def get_bootstrap_cache_dir(self):
+        return self._cache_dir
+
+    def try_fetch_bootstrap_and_active(self, bootstrap_id):
+        return False
+
+
+@pytest.mark.skipif(is_windows, reason="Bootstrap tarballs are xz compressed on Linux only")
+def test_make_bootstrap_tarball(tmpdir):
+    package_ids = ['mesos--0.23.0', 'mesos-config--justmesos']
+    package_paths = list()
+    for pkg_id in package_ids:
+        pkg_path = str(tmpdir.join(pkg_id + '.tar.xz'))
+        make_tar(pkg_path, resources_test_dir('packages/' + pkg_id))
+        package_paths.append(pkg_path)
+
+    package_store = BootstrapPackageStore(str(tmpdir.join('bootstrap')))
+    bootstrap_id = pkgpanda.build.make_bootstrap_tarball(package_store, package_paths, None)
+    bootstrap_name = str(tmpdir.join('bootstrap/{}.bootstrap.tar.xz'.format(bootstrap_id)))
+    active_name = str(tmpdir.join('bootstrap/{}.active.json'.format(bootstrap_id)))
+    assert load_json(active_name) == package_ids
+
+    with tarfile.open(bootstrap_name) as tar:
+        members = {member.name.rstrip('/'): member for member in tar.getmembers()}
+    assert {'./bootstrap', './environment', './packages/mesos--0.23.0/lib/libmesos.so'} <= members.keys()
+    assert all(member.uid == 0 and member.gid == 0 for member in members.values())
+    # Symlinks made by activation point inside the final install root.
+    assert members['./active/mesos'].linkname == '/opt/mesosphere/packages/mesos--0.23.0'
+    assert members['./bin/mesos'].linkname == '/opt/mesosphere/packages/mesos--0.23.0/bin/mesos'
+    assert members['./etc/foobar'].linkname == '/opt/mesosphere/packages/mesos-config--justmesos/etc/foobar'
+
+    # A missing active.json is rewritten without rebuilding the tarball.
+    os.remove(active_name)
+    bootstrap_mtime = os.stat(bootstrap_name).st_mtime_ns
+    assert pkgpanda.build.make_bootstrap_tarball(package_store, package_paths, None) == bootstrap_id
+    assert load_json(active_name) == package_ids
+    assert os.stat(bootstrap_name).st_mtime_ns == bootstrap_mtime
+
+
+def test_package_store_lazy_buildinfo(tmpdir):
+    packages_dir = tmpdir.join('packages')
+    packages_dir.join('foo/buildinfo.json').write('{"requires": ["bar"]}', ensure=True)
+    packages_dir.join('foo/extra.buildinfo.json').write('{}', ensure=True)
+    packages_dir.join('bar/buildinfo.json').write('not json', ensure=True)
+    packages_dir.join('not_a_package/README').write('', ensure=True)
+
+    # Broken buildinfo files are only an error once they're needed.
+    package_store = pkgpanda.build.PackageStore(str(packages_dir), None)
+    assert set(package_store.packages) == {('foo', None), ('foo', 'extra'), ('bar', None)}
+    assert set(package_store.packages_by_name['foo']) == {None, 'extra'}
+    assert ('foo', 'extra') in package_store.packages
+    assert ('baz', None) not in package_store.packages
+
+    buildinfo = package_store.get_buildinfo('foo', None)
+    assert buildinfo['requires'] == ['bar']
+    assert package_store.packages[('foo', None)] is buildinfo
+    assert package_store.packages_by_name['foo'][None] is buildinfo
+
+    with pytest.raises(pkgpanda.build.BuildError):
+        package_store.get_buildinfo('bar', None)
+    with pytest.raises(KeyError):
+        package_store.get_buildinfo('not_a_package', None)
+
+
+def test_package_store_reuses_upstream_checkout(tmpdir):
+    upstream_dir = tmpdir.join('upstream')
+    upstream_dir.join('packages/foo/buildinfo.json').write('{}', ensure=True)
+
+    def git(*args):
+        check_call(['git', '-C', str(upstream_dir), '-c', 'user.name=test', '-c', 'user.email=test@example.com'] +
+                   list(args))
+    git('init', '-q')
+    git('add', '.')
+    git('commit', '-q', '-m', 'foo')
+
+    packages_dir = tmpdir.join('packages')
+    packages_dir.join('upstream.json').write(
+        '{"kind": "git_local", "rel_path": "../upstream"}', ensure=True)
+    package_store = pkgpanda.build.PackageStore(str(packages_dir), None)
+    assert package_store.get_package_folder('foo').startswith(str(packages_dir.join('cache/upstream/checkouts')))
+
+    # An unchanged upstream is reused rather than checked out again.
+    checkouts = packages_dir.join('cache/upstream/checkouts').listdir()
+    assert len(checkouts) == 1
+    checkouts[0].join('marker').write('')
+    pkgpanda.build.PackageStore(str(packages_dir), None)
+    assert checkouts[0].join('marker').exists()
+
+    # A changed upstream gets a fresh checkout, replacing the old one.
+    upstream_dir.join('packages/bar/buildinfo.json').write('{}', ensure=True)
+    git('add', '.')
+    git('commit', '-q', '-m', 'bar')
+    package_store = pkgpanda.build.PackageStore(str(packages_dir), None)
+    assert set(package_store.packages_by_name) == {'foo', 'bar'}
+    assert not checkouts[0].exists()
+
+
+@pytest.mark.skipif(is_windows, reason="Package tarballs are xz compressed on Linux only")
+def test_package_store_extracted_packages(capsys, tmpdir):
+    packages_dir = tmpdir.join('packages')
+    packages_dir.join('mesos/buildinfo.json').write('{}', ensure=True)
+    package_store = pkgpanda.build.PackageStore(str(packages_dir), None)
+    for pkg_id in ['mesos--0.23.0', 'mesos--0.22.0']:
+        make_tar(package_store.get_package_cache_folder('mesos') + '/' + pkg_id + '.tar.xz',
+                 resources_test_dir('packages/mesos--0.23.0'))
+    extracted_dir = packages_dir.join('cache/extracted')
+
+    package = package_store.get_extracted_package('mesos--0.23.0')
+    assert str(package.id) == 'mesos--0.23.0'
+    assert package.path == str(extracted_dir.join('mesos--0.23.0'))
+    assert extracted_dir.join('mesos--0.23.0/lib/libmesos.so').exists()
+    assert capsys.readouterr().out == "Auto-adding dependency: mesos--0.23.0\n"
+
+    # A later build reuses the extracted package rather than extracting it again.
+    extracted_dir.join('mesos--0.23.0/marker').write('')
+    package = package_store.get_extracted_package('mesos--0.23.0')
+    assert package.path == str(extracted_dir.join('mesos--0.23.0'))
+    assert extracted_dir.join('mesos--0.23.0/marker').exists()
+    assert capsys.readouterr().out == "Auto-adding dependency: mesos--0.23.0 (already extracted)\n"
+
+    # Pruning removes other package versions and interrupted extractions.
+    package_store.get_extracted_package('mesos--0.22.0')
+    extracted_dir.join('mesos--0.21.0_tmp/pkginfo.json').write('{}', ensure=True)
+    package_store.prune_extracted_packages({'mesos--0.23.0'})
+    assert {path.basename for path in extracted_dir.listdir()} == {'mesos--0.23.0'}
+    assert extracted_dir.join('mesos--0.23.0/marker').exists()
+
+
+def test_compiler_cache(monkeypatch, tmpdir):
+    image_env = {'sha256:1234': {'PATH': '/pkg/bin:/usr/local/go/bin:/usr/bin:/bin', 'GOPATH': '/pkg'}}
+    monkeypatch.setattr(pkgpanda.build, 'get_docker_env', lambda docker_id: image_env.get(docker_id, {}))
+    built_images = list()
+
+    def get_ccache_image(docker_id):
+        built_images.append(docker_id)
+        return 'pkgpanda-ccache:' + docker_id.split(':')[-1]
+
+    monkeypatch.setattr(pkgpanda.build, 'get_ccache_image', get_ccache_image)
+    compiler_cache = pkgpanda.build.CompilerCache(str(tmpdir.join('ccache')), '1G')
+    cmd = pkgpanda.build.DockerCmd()
+    cmd.container = 'dcos/dcos-builder:latest'
+    cmd.environment = {'PKG_NAME': 'mesos'}
+    directory = compiler_cache.add_to(cmd, 'mesos', 'sha256:1234')
+    assert directory == str(tmpdir.join('ccache/mesos/sha256-1234'))
+    assert os.path.isdir(directory)
+    assert cmd.volumes[directory].endswith('/ccache:rw')
+    # Compilers on the PATH of the image are found through the ccache wrappers first.
+    assert cmd.environment == {
+        'PKG_NAME': 'mesos',
+        'CCACHE_DIR': '/pkg/ccache',
+        'CCACHE_MAXSIZE': '1G',
+        'PATH': '/usr/lib/ccache:/pkg/bin:/usr/local/go/bin:/usr/bin:/bin'}
+    # The build runs in the builder image with ccache added, which is only made once.
+    assert cmd.container == 'pkgpanda-ccache:1234'
+    compiler_cache.add_to(pkgpanda.build.DockerCmd(), 'dcos-net', 'sha256:1234')
+    assert built_images == ['sha256:1234']
+
+    # Images without a PATH get docker's default one.
+    cmd = pkgpanda.build.DockerCmd()
+    compiler_cache.add_to(cmd, 'mesos', 'sha256:5678')
+    assert cmd.environment['PATH'] == '/usr/lib/ccache:' + pkgpanda.build.CompilerCache.DEFAULT_PATH
+
+    empty = compiler_cache.get_stats(directory)
+    assert empty == {'hits': 0, 'misses': 0}
+    assert compiler_cache.format_stats(empty, empty) == "ccache: no cacheable compilations"
+
+    # ccache spreads its counters over a stats file per cache subdirectory.
+    counters = [0] * 23
+    counters[compiler_cache.STATS_CACHE_MISS] = 1
+    counters[compiler_cache.STATS_CACHE_HIT_DIRECT] = 2
+    tmpdir.join('ccache/mesos/sha256-1234/0/stats').write(' '.join(map(str, counters)), ensure=True)
+    counters[compiler_cache.STATS_CACHE_HIT_PREPROCESSED] = 3
+    tmpdir.join('ccache/mesos/sha256-1234/f/stats').write(' '.join(map(str, counters)), ensure=True)
+
+    stats = compiler_cache.get_stats(directory)
+    assert stats == {'hits': 7, 'misses': 2}
+    assert compiler_cache.format_stats(empty, stats) == "ccache: 7 hits, 2 misses (78% hit rate)"
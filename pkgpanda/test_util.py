@@ -1,4 +1,5 @@
 import os
+import tarfile
 import tempfile
 from subprocess import CalledProcessError
 
@@ -407,3 +408,38 @@ def test_write_string(tmpdir):
     st_mode = os.stat(filename).st_mode
     expected_permission = 0o777
     assert (st_mode & 0o777) == expected_permission
+
+
+def test_make_tar_from_files(tmpdir):
+    filename = str(tmpdir.join('package.tar.xz'))
+    files = {'etc/foo': (b'foo', 0o600), 'etc/bar/baz': (b'baz', 0o644), 'qux': (b'', 0o755)}
+    pkgpanda.util.make_tar_from_files(filename, files)
+    with tarfile.open(filename) as tar:
+        members = tar.getmembers()
+        assert [(m.name, m.type, m.mode) for m in members] == [
+            ('.', tarfile.DIRTYPE, 0o755),
+            ('./etc', tarfile.DIRTYPE, 0o755),
+            ('./etc/bar', tarfile.DIRTYPE, 0o755),
+            ('./etc/bar/baz', tarfile.REGTYPE, 0o644),
+            ('./etc/foo', tarfile.REGTYPE, 0o600),
+            ('./qux', tarfile.REGTYPE, 0o755)]
+        assert {(m.uid, m.gid, m.uname, m.gname, m.mtime) for m in members} == {(0, 0, '', '', 0)}
+        assert tar.extractfile('./etc/foo').read() == b'foo'
+    with open(filename, 'rb') as f:
+        tarball = f.read()
+
+    # The same files make the same tarball, which isn't written again.
+    os.utime(filename, (0, 0))
+    pkgpanda.util.make_tar_from_files(filename, dict(reversed(list(files.items()))))
+    assert os.stat(filename).st_mtime == 0
+    with open(filename, 'rb') as f:
+        assert f.read() == tarball
+
+    files['qux'] = (b'qux', 0o755)
+    pkgpanda.util.make_tar_from_files(filename, files)
+    assert os.stat(filename).st_mtime != 0
+    with tarfile.open(filename) as tar:
+        assert tar.extractfile('./qux').read() == b'qux'
+
+    with pytest.raises(ValueError):
+        pkgpanda.util.make_tar_from_files(filename, {'etc': (b'', 0o644), 'etc/foo': (b'', 0o644)})
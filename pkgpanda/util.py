@@ -1,14 +1,18 @@
 import hashlib
 import http.server
+import io
 import json
 import logging
+import lzma
 import os
 import platform
+import posixpath
 import re
 import shutil
 import socketserver
 import stat
 import subprocess
+import tarfile
 import tempfile
 from contextlib import contextmanager, ExitStack
 from itertools import chain
@@ -17,11 +21,8 @@ from shutil import rmtree, which
 from subprocess import check_call
 from typing import List
 
-import requests
 import teamcity
 import yaml
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 from teamcity.messages import TeamcityServiceMessages
 
 from pkgpanda.exceptions import FetchError, ValidationError
@@ -70,8 +71,7 @@ def make_directory(path):
     if is_windows:
         path = path.replace('/', '\\')
 
-    if not os.path.exists(path):
-        os.makedirs(path)
+    os.makedirs(path, exist_ok=True)
 
 
 def copy_file(src_path, dst_path):
@@ -135,6 +135,11 @@ def variant_suffix(variant, delim='.'):
 
 
 def get_requests_retry_session(max_retries=4, backoff_factor=1, status_forcelist=None):
+    # requests is slow to import and only needed for downloads.
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.packages.urllib3.util.retry import Retry
+
     status_forcelist = status_forcelist or [500, 502, 504]
     # Default max retries 4 with sleeping between retries 1s, 2s, 4s, 8s
     session = requests.Session()
@@ -369,6 +374,123 @@ def make_tar(result_filename, change_folder):
     check_call(tar_cmd)
 
 
+def make_tar_from_files(result_filename, files):
+    """Write an xz compressed tarball of the in memory files to result_filename.
+
+    files maps paths within the tarball to (content bytes, mode). The parent directories of the
+    files are added with mode 0755. Entries are sorted and have fixed owners and mtimes so the same
+    files always make the same tarball. An existing result_filename with the same content is left
+    as is rather than compressed again.
+    """
+    directories = set()
+    for path in files:
+        parent = posixpath.dirname(path)
+        while parent and parent not in directories:
+            directories.add(parent)
+            parent = posixpath.dirname(parent)
+    both = directories & files.keys()
+    if both:
+        raise ValueError("Paths can't be both files and directories: {}".format(', '.join(sorted(both))))
+
+    def tarinfo(path, mode):
+        info = tarfile.TarInfo(posixpath.join('.', path))
+        info.mode = mode
+        info.mtime = 0
+        info.uid = info.gid = 0
+        info.uname = info.gname = ''
+        return info
+
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w', format=tarfile.GNU_FORMAT) as tar:
+        for path in [''] + sorted(directories | files.keys()):
+            if path in files:
+                content, mode = files[path]
+                info = tarinfo(path, mode)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+            else:
+                info = tarinfo(path, 0o755)
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+    tar_data = tar_buffer.getvalue()
+    tar_hash = hashlib.sha256(tar_data).digest()
+
+    try:
+        with open(result_filename, 'rb') as f:
+            if hashlib.sha256(lzma.decompress(f.read())).digest() == tar_hash:
+                return
+    except (OSError, lzma.LZMAError, EOFError):
+        pass
+    with open(result_filename, 'wb') as f:
+        f.write(lzma.compress(tar_data))
+
+
+class TarStream:
+    """Incrementally write a compressed tarball.
+
+    Entries are compressed as soon as they are added rather than after the
+    whole tree has been assembled on disk. Owners are normalized to root the
+    same way make_tar does so the result can be extracted anywhere.
+    """
+
+    def __init__(self, result_filename):
+        self.__result_file = open(result_filename, 'wb')
+        if is_windows:
+            # Matches the bzip2 compression make_tar uses on Windows.
+            self.__compressor = None
+            self.__tar = tarfile.open(fileobj=self.__result_file, mode='w|bz2', format=tarfile.GNU_FORMAT)
+        else:
+            compressor = "pxz" if which("pxz") else "xz"
+            self.__compressor = subprocess.Popen(
+                [compressor, "-c"],
+                stdin=subprocess.PIPE,
+                stdout=self.__result_file)
+            self.__tar = tarfile.open(fileobj=self.__compressor.stdin, mode='w|', format=tarfile.GNU_FORMAT)
+
+    @staticmethod
+    def _reset_owner(tarinfo):
+        tarinfo.uid = tarinfo.gid = 0
+        tarinfo.uname = tarinfo.gname = ''
+        return tarinfo
+
+    def add(self, path, arcname, recursive=True):
+        self.__tar.add(path, arcname, recursive=recursive, filter=self._reset_owner)
+
+    def close(self):
+        try:
+            self.__tar.close()
+            if self.__compressor is None:
+                return
+            self.__compressor.stdin.close()
+            returncode = self.__compressor.wait()
+        finally:
+            self.__result_file.close()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.__compressor.args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # Don't leave a compressor waiting on input behind when bailing out.
+        if self.__compressor is not None:
+            self.__compressor.kill()
+            self.__compressor.wait()
+        self.__result_file.close()
+
+
+def rewrite_symlink_target(target, old_prefix, new_prefix):
+    """Return target moved from old_prefix to new_prefix.
+
+    Targets not beginning with old_prefix are returned unchanged."""
+    if not target.startswith(old_prefix):
+        return target
+    return os.path.join(new_prefix, target[len(old_prefix) + 1:].lstrip('/'))
+
+
 def rewrite_symlinks(root, old_prefix, new_prefix):
     # Find the symlinks and rewrite them from old_prefix to new_prefix
     # All symlinks not beginning with old_prefix are ignored because
@@ -380,7 +502,7 @@ def rewrite_symlinks(root, old_prefix, new_prefix):
                 # Rewrite old_prefix to new_prefix if present.
                 target = os.readlink(full_path)
                 if target.startswith(old_prefix):
-                    new_target = os.path.join(new_prefix, target[len(old_prefix) + 1:].lstrip('/'))
+                    new_target = rewrite_symlink_target(target, old_prefix, new_prefix)
                     # Remove the old link and write a new one.
                     os.remove(full_path)
                     os.symlink(new_target, full_path)
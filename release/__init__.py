@@ -7,18 +7,24 @@ Co-ordinates across all gen.build_deploy
 """
 
 import argparse
+import collections
 import copy
+import hashlib
 import importlib
 import inspect
 import json
 import logging
 import os.path
+import posixpath
 import subprocess
 import sys
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from distutils.version import LooseVersion
 from typing import Optional
 
 import pkg_resources
+from retrying import retry
 
 import gen.build_deploy.util as util
 import pkgpanda
@@ -129,6 +135,22 @@ def load_providers():
             for name in provider_names}
 
 
+def artifact_content_hash(artifact):
+    """Return the sha1 of the content of an artifact, None if it isn't known locally.
+
+    The hash of artifacts copied from elsewhere in storage comes from the manifest of the release
+    they are copied from (local_content_hash)."""
+    if 'local_content_hash' in artifact:
+        return artifact['local_content_hash']
+    if 'local_copy_from' in artifact:
+        return None
+    if 'local_content' in artifact:
+        return hashlib.sha1(artifact['local_content'].encode('utf-8')).hexdigest()
+    if 'local_path' in artifact:
+        return pkgpanda.util.sha1(artifact['local_path'])
+    return None
+
+
 # Transforms artifact definitions from the Release Manager into sets of commands
 # the storage providers understand, adding in the full path prefixes as needed
 # so storage provides just have to know how to operate on paths rather than
@@ -166,18 +188,56 @@ class Repository():
     def channel_prefix(self):
         return self.__channel_name + '/' if self.__channel_name else ''
 
+    @property
+    def manifest_path(self):
+        return self.path_channel_prefix + 'manifest.json'
+
     # TODO(cmaloney): This function is too big. Break it into testable chunks.
     # TODO(cmaloney): Assert the same path/destination_path is never used twice.
-    def make_commands(self, metadata):
+    def make_commands(self, metadata, previous_manifest=None):
+        """Return the storage commands to store the artifacts of metadata, by stage.
+
+        The release records a manifest mapping every path it stores to the sha1 of the content
+        stored there, at the commit path and as the manifest of the channel. Content already stored
+        by the release is copied rather than uploaded again. previous_manifest is the manifest of
+        the channel before this release: paths it lists with the same content aren't written again,
+        so releasing mostly unchanged artifacts only writes the manifest and the files which changed
+        (ex: the bootstrap.latest pointers).
+
+        stage0 drops the paths about to change from the manifest of the channel and stage3 writes
+        the new one, so the manifest never lists content which isn't in place.
+        """
         stage1 = []
         stage2 = []
+        previous_manifest = previous_manifest or dict()
+        manifest = dict()
+        # The first path of each content hash, by the headers it is stored with.
+        content_paths = dict()
 
         def process_artifact(artifact, base_artifact):
             # First destination is upload
             # All other destinations are copies from first destination.
             upload_path = None
+            content_hash = artifact_content_hash(artifact)
+
+            def add_dest(stage, destination_path, is_reproducible):
+                nonlocal upload_path
 
-            def add_dest(destination_path, is_reproducible):
+                if content_hash is not None:
+                    manifest[destination_path] = content_hash
+                    if previous_manifest.get(destination_path) == content_hash:
+                        # Already in place, later destinations can copy from it.
+                        if upload_path is None:
+                            upload_path = destination_path
+                            content_paths.setdefault(content_key(is_reproducible), destination_path)
+                        return
+                stage.append(make_command(destination_path, is_reproducible))
+
+            def content_key(is_reproducible):
+                # Copies keep the headers of their source.
+                return content_hash, artifact.get('content_type'), is_reproducible
+
+            def make_command(destination_path, is_reproducible):
                 nonlocal upload_path
 
                 # First action -> upload
@@ -193,6 +253,17 @@ class Repository():
                 # Always set upload_path
                 upload_path = destination_path
 
+                # Copy the same content stored by another artifact rather than uploading it again.
+                if content_key(is_reproducible) in content_paths:
+                    return {
+                        'method': 'copy',
+                        'if_not_exists': is_reproducible,
+                        'args': {
+                            'source_path': content_paths[content_key(is_reproducible)],
+                            'destination_path': destination_path}}
+                if content_hash is not None:
+                    content_paths[content_key(is_reproducible)] = destination_path
+
                 # Copy inside the repository if we have a copy_from source.
                 if 'local_copy_from' in artifact:
                     return {
@@ -223,19 +294,19 @@ class Repository():
                         action['args']['content_type'] = artifact['content_type']
                     return action
 
-            assert artifact.keys() <= {'reproducible_path', 'channel_path', 'content_type',
-                                       'local_path', 'local_content', 'local_copy_from'}, artifact
+            assert artifact.keys() <= {'reproducible_path', 'channel_path', 'content_type', 'local_path',
+                                       'local_content', 'local_copy_from', 'local_content_hash'}, artifact
 
             action_count = 0
             if 'reproducible_path' in artifact:
                 action_count += 1
-                stage1.append(add_dest(self.path_prefix + artifact['reproducible_path'], True))
+                add_dest(stage1, self.path_prefix + artifact['reproducible_path'], True)
 
             if 'channel_path' in artifact:
                 channel_path = artifact['channel_path']
                 action_count += 2
-                stage1.append(add_dest(self.reproducible_artifact_path + channel_path, False))
-                stage2.append(add_dest(self.path_channel_prefix + channel_path, False))
+                add_dest(stage1, self.reproducible_artifact_path + channel_path, False)
+                add_dest(stage2, self.path_channel_prefix + channel_path, False)
 
             # Must have done at least one thing with the artifact (reproducible_path or channel_path).
             assert action_count > 0
@@ -251,9 +322,36 @@ class Repository():
             'local_content': to_json(strip_locals(metadata))
         }, False)
 
+        def upload_manifest(destination_path, data):
+            return {
+                'method': 'upload',
+                'if_not_exists': False,
+                'args': {
+                    'destination_path': destination_path,
+                    'blob': to_json(data).encode('utf-8'),
+                    'no_cache': True,
+                    'content_type': 'application/json; charset=utf-8'}}
+
+        stage0 = []
+        if previous_manifest:
+            unchanged = {path: content_hash for path, content_hash in previous_manifest.items()
+                         if manifest.get(path, content_hash) == content_hash}
+            if unchanged != previous_manifest:
+                stage0.append(upload_manifest(self.manifest_path, unchanged))
+
+        commit_manifest_path = self.reproducible_artifact_path + 'manifest.json'
+        stage3 = [upload_manifest(commit_manifest_path, manifest), {
+            'method': 'copy',
+            'if_not_exists': False,
+            'args': {
+                'source_path': commit_manifest_path,
+                'destination_path': self.manifest_path}}]
+
         return {
+            'stage0': stage0,
             'stage1': stage1,
             'stage2': stage2,
+            'stage3': stage3,
         }
 
 
@@ -675,21 +773,159 @@ def get_storage_provider_factory(kind):
     return module.factories[name]
 
 
-def apply_storage_commands(storage_providers: dict, storage_commands: dict) -> None:
-    assert storage_commands.keys() == {'stage1', 'stage2'}
+# Number of storage commands apply_storage_commands() runs at once.
+max_storage_workers = 8
+# Attempts at each storage command before giving up, waiting exponentially longer between attempts.
+storage_command_attempts = 3
+storage_retry_wait_multiplier_ms = 1000
+# Folders holding at least this many of the paths to check the existence of are listed at once
+# rather than checking each path.
+min_paths_per_listing = 2
+# Folders whose subfolders hold at least this many of the folders with paths to check (ex: one per
+# package) are listed at once instead.
+min_folders_per_listing = 16
+
+
+def existence_listing_prefixes(paths):
+    """Return the sorted prefixes to list to check whether the paths exist with few requests."""
+    folder_paths = collections.Counter(posixpath.dirname(path) for path in paths)
+    parent_folders = collections.Counter(posixpath.dirname(folder) for folder in folder_paths)
+    prefixes = set()
+    for folder, count in folder_paths.items():
+        parent = posixpath.dirname(folder)
+        if parent and parent_folders[parent] >= min_folders_per_listing:
+            prefixes.add(parent + '/')
+        elif folder and count >= min_paths_per_listing:
+            prefixes.add(folder + '/')
+    # Prefixes within other prefixes are already listed.
+    return sorted(prefix for prefix in prefixes if not any(
+        prefix != other and prefix.startswith(other) for other in prefixes))
+
+
+# Where fetched artifacts are cached across runs unless options.fetch_cache is set in the config.
+default_fetch_cache_dir = '~/.cache/dcos-release'
+
+# The stages of storage commands, in the order they are applied.
+storage_stages = ['stage0', 'stage1', 'stage2', 'stage3']
+
+
+def _chain_storage_commands(commands):
+    """Group commands into lists which must be applied in order.
+
+    A copy from the destination of another command of the same stage must wait for that command,
+    the rest can be applied in any order."""
+    chains = list()
+    chain_by_destination = dict()
+    for command in commands:
+        chain = chain_by_destination.get(command['args'].get('source_path')) if command['method'] == 'copy' else None
+        if chain is None:
+            chain = list()
+            chains.append(chain)
+        chain.append(command)
+        chain_by_destination[command['args']['destination_path']] = chain
+    return chains
+
+
+class _StorageProgress():
+    """Prints the progress of applying the storage commands of a stage."""
+
+    def __init__(self, stage, total):
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self.__lock = threading.Lock()
+
+    def report(self, provider_name, path, message):
+        with self.__lock:
+            self.done += 1
+            print("[{} {}/{}] Store to {} artifact {} {}".format(
+                self.stage, self.done, self.total, provider_name, path, message))
+
+
+def _apply_storage_chain(provider_name, provider, existence, chain, progress):
+    def report_retry(ex):
+        if isinstance(ex, release.storage.UnsupportedOperation):
+            return False
+        print("Store to", provider_name, "failed, retrying:", repr(ex))
+        return True
+
+    @retry(
+        stop_max_attempt_number=storage_command_attempts,
+        wait_exponential_multiplier=storage_retry_wait_multiplier_ms,
+        retry_on_exception=report_retry)
+    def apply(command):
+        path = command['args']['destination_path']
+        # If it is only supposed to be if the artifact does not exist, check for existence
+        # and skip if it exists.
+        if command['if_not_exists'] and existence.exists(path):
+            return "skipped because it already exists"
+        getattr(provider, command['method'])(**command['args'])
+        existence.mark_exists(path)
+        return "by method " + command['method']
+
+    for command in chain:
+        progress.report(provider_name, command['args']['destination_path'], apply(command))
+
+
+def _wait_for_all(futures):
+    """Wait for the futures, cancelling those not started yet and raising the error as soon as one fails."""
+    try:
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+    finally:
+        # Only cancels those not started yet, after an error or an interrupt.
+        for future in futures:
+            future.cancel()
+    for future in futures:
+        if future in done and future.exception() is not None:
+            raise future.exception()
 
-    for stage in ['stage1', 'stage2']:
-        commands = storage_commands[stage]
-        for provider_name, provider in storage_providers.items():
-            for artifact in commands:
-                path = artifact['args']['destination_path']
-                # If it is only supposed to be if the artifact does not exist, check for existence
-                # and skip if it exists.
-                if artifact['if_not_exists'] and provider.exists(path):
-                    print("Store to", provider_name, "artifact", path, "skipped because it already exists")
-                    continue
-                print("Store to", provider_name, "artifact", path, "by method", artifact['method'])
-                getattr(provider, artifact['method'])(**artifact['args'])
+
+def _list_existing(provider_name, existence, prefix):
+    try:
+        if not existence.add_prefix(prefix):
+            return
+    except Exception as ex:
+        # Only an optimization, the paths are checked one by one instead.
+        print("Listing", provider_name, "prefix", prefix, "failed, checking paths one by one:", repr(ex))
+        return
+    print("Listed existing", provider_name, "artifacts in", prefix)
+
+
+def apply_storage_commands(storage_providers: dict, storage_commands: dict, max_workers=None) -> None:
+    """Apply the storage commands to all the storage providers, max_workers commands at a time.
+
+    Every command of a stage is applied to every provider before any command of the next stage is
+    started (see storage_stages). If a
+    command fails after retrying the commands not started yet are cancelled and the error is raised.
+    Which artifacts already exist is listed by folder up front where that takes fewer requests (see
+    existence_listing_prefixes()).
+    """
+    assert storage_commands.keys() == set(storage_stages)
+
+    existences = {name: release.storage.ExistenceCache(provider) for name, provider in storage_providers.items()}
+    prefixes = existence_listing_prefixes(
+        command['args']['destination_path']
+        for stage in storage_stages for command in storage_commands[stage] if command['if_not_exists'])
+    if prefixes:
+        with ThreadPoolExecutor(max_workers or max_storage_workers) as executor:
+            for future in [
+                    executor.submit(_list_existing, name, existence, prefix)
+                    for name, existence in existences.items()
+                    for prefix in prefixes]:
+                future.result()
+
+    for stage in storage_stages:
+        chains = _chain_storage_commands(storage_commands[stage])
+        progress = _StorageProgress(stage, len(storage_commands[stage]) * len(storage_providers))
+        if not progress.total:
+            continue
+        with ThreadPoolExecutor(max_workers or max_storage_workers) as executor:
+            futures = [
+                executor.submit(
+                    _apply_storage_chain, provider_name, provider, existences[provider_name], chain, progress)
+                for provider_name, provider in storage_providers.items()
+                for chain in chains]
+            _wait_for_all(futures)
 
 
 # Two stages of uploading artifacts. First puts all the artifacts into their places / uploads
@@ -699,6 +935,7 @@ def apply_storage_commands(storage_providers: dict, storage_commands: dict) -> N
 # artifacts must already be in place. All those artifacts which must be in place get uploaded in
 # upload artifacts. By having the two steps we guarantee that a user is never able to download
 # something such as a cloudformation template which won't work.
+# Around them stage0 and stage3 update the manifest of the channel (see Repository.make_commands()).
 class ReleaseManager():
 
     def _setup_storage(self, storage_config):
@@ -739,12 +976,45 @@ class ReleaseManager():
     def get_metadata(self, src_channel):
         return from_json(self.__preferred_provider.fetch(src_channel + '/metadata.json').decode())
 
-    def fetch_key_artifacts(self, metadata):
+    def get_manifest(self, src_channel):
+        """Return the content manifest of a channel, empty for releases made before there were manifests."""
+        path = src_channel + '/manifest.json'
+        if not self.__preferred_provider.exists(path):
+            return dict()
+        return from_json(self.__preferred_provider.fetch(path).decode())
+
+    def get_previous_manifest(self, repository):
+        """Return the entries of the manifest of the channel of repository all storage providers agree on.
+
+        Paths not in place in every provider are written again."""
+        if self.__noop:
+            return dict()
+        manifests = list()
+        for provider in self.__storage_providers.values():
+            if not provider.exists(repository.manifest_path):
+                return dict()
+            manifests.append(from_json(provider.fetch(repository.manifest_path).decode()))
+        if not manifests:
+            return dict()
+        return {path: content_hash for path, content_hash in manifests[0].items()
+                if all(manifest.get(path) == content_hash for manifest in manifests[1:])}
+
+    def fetch_key_artifacts(self, metadata, manifest=None):
+        """Fetch the artifacts needed to make the channel artifacts of a release.
+
+        The artifacts are marked to be copied from where they are stored, with the content hashes
+        listed in the manifest of the release if given."""
+        manifest = manifest or dict()
         assert metadata['reproducible_artifact_path'][-1] != '/'
         assert metadata['repository_path'][-1] != '/'
+        fetch_cache = release.storage.FetchCache(self.__preferred_provider, os.path.expanduser(
+            self.__config.get('options', dict()).get('fetch_cache', default_fetch_cache_dir)))
+
+        def download(src_path, local_path):
+            hit = fetch_cache.download(src_path, local_path)
+            print("Fetched core artifact", src_path, "(cached)" if hit else "(downloaded)")
 
         def fetch_artifact(artifact):
-            print("Fetching core artifact if it doesn't exist: ", artifact)
             if 'channel_path' in artifact:
                 assert artifact['channel_path'][0] != '/'
                 src_path = metadata['reproducible_artifact_path'] + '/' + artifact['channel_path']
@@ -757,9 +1027,11 @@ class ReleaseManager():
                     dest_path = 'packages/cache/complete/' + dest_path
                 else:
                     dest_path = 'packages/cache/bootstrap/' + dest_path
-                self.__preferred_provider.download(src_path, dest_path)
+                download(src_path, dest_path)
                 artifact['local_copy_from'] = src_path
                 artifact['local_path'] = artifact['channel_path']
+                if src_path in manifest:
+                    artifact['local_content_hash'] = manifest[src_path]
             if 'reproducible_path' in artifact:
                 assert artifact['reproducible_path'][0] != '/'
 
@@ -767,12 +1039,16 @@ class ReleaseManager():
 
                 src_path = metadata['repository_path'] + '/' + artifact['reproducible_path']
 
-                self.__preferred_provider.download_if_not_exist(src_path, local_path)
+                # Reproducible artifacts never change once stored.
+                if not os.path.exists(local_path):
+                    download(src_path, local_path)
                 artifact['local_copy_from'] = src_path
                 artifact['local_path'] = local_path
+                if src_path in manifest:
+                    artifact['local_content_hash'] = manifest[src_path]
 
-        for artifact in metadata['core_artifacts']:
-            fetch_artifact(artifact)
+        with ThreadPoolExecutor(max_storage_workers) as executor:
+            _wait_for_all([executor.submit(fetch_artifact, artifact) for artifact in metadata['core_artifacts']])
 
     def promote(self, src_channel, destination_repository, destination_channel):
         metadata = self.get_metadata(src_channel)
@@ -782,7 +1058,7 @@ class ReleaseManager():
         assert metadata['commit'] == util.dcos_image_commit, "You must promote from a checkout of " \
             "the same commit when `release create` aws run. {}".format(util.dcos_image_commit)
 
-        self.fetch_key_artifacts(metadata)
+        self.fetch_key_artifacts(metadata, self.get_manifest(src_channel))
 
         repository = Repository(destination_repository, destination_channel, 'commit/{}'.format(metadata['commit']))
         set_repository_metadata(
@@ -792,7 +1068,7 @@ class ReleaseManager():
 
         metadata['channel_artifacts'] = make_channel_artifacts(metadata)
 
-        storage_commands = repository.make_commands(metadata)
+        storage_commands = repository.make_commands(metadata, self.get_previous_manifest(repository))
         self.apply_storage_commands(storage_commands)
 
         return metadata
@@ -841,13 +1117,13 @@ class ReleaseManager():
 
         metadata['channel_artifacts'] = make_channel_artifacts(metadata)
 
-        storage_commands = repository.make_commands(metadata)
+        storage_commands = repository.make_commands(metadata, self.get_previous_manifest(repository))
         self.apply_storage_commands(storage_commands)
 
         return metadata
 
     def apply_storage_commands(self, storage_commands):
-        assert storage_commands.keys() == {'stage1', 'stage2'}
+        assert storage_commands.keys() == set(storage_stages)
 
         if self.__noop:
             return
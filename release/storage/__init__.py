@@ -1,7 +1,9 @@
 import abc
 import os.path
+import threading
+import uuid
 
-from pkgpanda.util import make_directory
+from pkgpanda.util import copy_file, hash_str, load_json, make_directory, write_json
 
 
 class UnsupportedOperation(RuntimeError):
@@ -77,6 +79,22 @@ class AbstractStorageProvider(metaclass=abc.ABCMeta):
         If given a file instead of a folder the behavior is unspecified."""
         pass
 
+    def list_prefix(self, prefix):
+        """Return a set of the names of all the files whose name starts with prefix.
+
+        Unlike list_recursive() the prefix doesn't need to be a folder. In the bucket above a call to
+        list_prefix(a/fo) would return: {"a/foo", "a/folder/a", "a/folder/b"}
+
+        Raises UnsupportedOperation if the storage provider can't list files."""
+        raise UnsupportedOperation("list_prefix on {}".format(type(self).__name__))
+
+    def stat(self, path):
+        """Return {'etag': ..., 'size': ...} for the given file, which changes whenever its content does.
+
+        etag is None if the storage provider has no ETags, in which case only the size is known.
+        Raises UnsupportedOperation if the storage provider can't tell."""
+        raise UnsupportedOperation("stat on {}".format(type(self).__name__))
+
     @abc.abstractproperty
     def url(self):
         """The base url which should be used to fetch resources from this storage provider"""
@@ -120,9 +138,121 @@ class ReadOnlyProxy(AbstractStorageProvider):
     def list_recursive(self, folder):
         raise UnsupportedOperation()
 
+    def list_prefix(self, prefix):
+        return self._storage_provider.list_prefix(prefix)
+
+    def stat(self, path):
+        return self._storage_provider.stat(path)
+
     def url(self):
         return self._storage_provider.url(self)
 
     @property
     def read_only(self):
         return True
+
+
+class ExistenceCache():
+    """Answers exists() for a storage provider from listings of name prefixes.
+
+    Names starting with a listed prefix are answered from the listing, others by asking the storage
+    provider. The listings aren't refreshed, so a cache should only be used for one run of storage
+    commands, with the files written during the run marked as they are written.
+    """
+
+    def __init__(self, storage_provider: AbstractStorageProvider):
+        self._storage_provider = storage_provider
+        self.__prefixes = list()
+        self.__names = set()
+        self.__lock = threading.Lock()
+
+    def add_prefix(self, prefix):
+        """List the files starting with prefix. Returns False if the storage provider can't list them."""
+        assert prefix
+        try:
+            names = self._storage_provider.list_prefix(prefix)
+        except UnsupportedOperation:
+            return False
+        with self.__lock:
+            self.__names |= names
+            self.__prefixes.append(prefix)
+        return True
+
+    def exists(self, path):
+        with self.__lock:
+            if path in self.__names:
+                return True
+            listed = any(path.startswith(prefix) for prefix in self.__prefixes)
+        return False if listed else self._storage_provider.exists(path)
+
+    def mark_exists(self, path):
+        with self.__lock:
+            self.__names.add(path)
+
+
+class FetchCache():
+    """Downloads files of a storage provider through a local cache which can be shared across runs.
+
+    A cached file is reused as long as the remote file has the same ETag (or size, for storage
+    providers without ETags) as when it was downloaded, and the cached file hasn't changed since.
+    Downloads go to a temporary file which only replaces the cached file once complete, so an
+    interrupted run leaves the files it finished in the cache for the next one to reuse. Safe to use
+    from several threads and processes at once.
+    """
+
+    def __init__(self, storage_provider: AbstractStorageProvider, cache_dir):
+        self._storage_provider = storage_provider
+        # Files of different storage providers are kept apart.
+        self.cache_dir = os.path.join(cache_dir, hash_str(storage_provider.url))
+
+    def _get_fetched_filename(self, cache_filename):
+        return cache_filename + '.fetched.json'
+
+    def _is_fresh(self, cache_filename, remote):
+        try:
+            fetched = load_json(self._get_fetched_filename(cache_filename))
+            stat = os.stat(cache_filename)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(fetched, dict):
+            return False
+        if fetched.get('local_size') != stat.st_size or fetched.get('mtime_ns') != stat.st_mtime_ns:
+            return False
+        if remote['etag'] is not None and fetched.get('etag') is not None:
+            return remote['etag'] == fetched['etag']
+        return remote['size'] == fetched.get('size')
+
+    def download(self, path, local_path):
+        """Download path to local_path, returning whether the cached copy was used."""
+        try:
+            remote = self._storage_provider.stat(path)
+        except UnsupportedOperation:
+            self._storage_provider.download(path, local_path)
+            return False
+
+        cache_filename = os.path.join(self.cache_dir, path)
+        hit = self._is_fresh(cache_filename, remote)
+        if not hit:
+            partial_filename = '{}.{}.partial'.format(cache_filename, uuid.uuid4().hex)
+            try:
+                self._storage_provider.download(path, partial_filename)
+                os.replace(partial_filename, cache_filename)
+            finally:
+                if os.path.exists(partial_filename):
+                    os.remove(partial_filename)
+            stat = os.stat(cache_filename)
+            write_json(self._get_fetched_filename(cache_filename), dict(
+                remote, local_size=stat.st_size, mtime_ns=stat.st_mtime_ns))
+
+        dirname = os.path.dirname(local_path)
+        if dirname:
+            make_directory(dirname)
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        try:
+            # The files aren't modified once fetched, sharing them saves copying large files.
+            os.link(cache_filename, local_path)
+        except OSError:
+            copy_file(cache_filename, local_path)
+        return hit
@@ -1,10 +1,23 @@
+import hashlib
+import io
+import threading
 from typing import Optional
 
 import boto3
 import botocore
+from boto3.s3.transfer import TransferConfig
 
+from pkgpanda.util import sha1
 from release.storage import AbstractStorageProvider
 
+# Uploads larger than the part size are sent as multipart uploads, max_upload_concurrency parts at a
+# time. Both can be set per storage provider in the release config.
+default_multipart_chunksize = 64 * 1024 * 1024
+default_max_upload_concurrency = 10
+
+# Object metadata holding the sha1 of the content, used to skip uploading unchanged content.
+content_hash_metadata = 'content-sha1'
+
 
 def get_aws_session(access_key_id, secret_access_key, region_name=None):
     """ This method will replace access_key_id and secret_access_key
@@ -31,19 +44,38 @@ class S3StorageProvider(AbstractStorageProvider):
     name = 'aws'
 
     def __init__(self, bucket, object_prefix, download_url,
-                 access_key_id=None, secret_access_key=None, region_name=None):
+                 access_key_id=None, secret_access_key=None, region_name=None, endpoint_url=None,
+                 multipart_chunksize=default_multipart_chunksize,
+                 max_upload_concurrency=default_max_upload_concurrency):
         """ If access_key_id and secret_acccess_key are unset, boto3 will
         try to authenticate by other methods. See here for other credential options:
         http://boto3.readthedocs.io/en/latest/guide/configuration.html#configuring-credentials
+
+        endpoint_url points the provider at an S3 compatible service other than AWS (ex: a local
+        stand-in for testing).
         """
         if object_prefix is not None:
             assert object_prefix and not object_prefix.startswith('/') and not object_prefix.endswith('/')
 
-        self.__session = get_aws_session(access_key_id, secret_access_key, region_name)
-        self.__bucket = self.__session.resource('s3').Bucket(bucket)
+        self.__credentials = (access_key_id, secret_access_key, region_name)
+        self.__endpoint_url = endpoint_url
+        self.__transfer_config = TransferConfig(
+            multipart_threshold=multipart_chunksize,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_upload_concurrency)
+        self.__bucket_name = bucket
+        # boto3 sessions and resources aren't thread safe, each thread using the provider gets its own.
+        self.__local = threading.local()
         self.__object_prefix = object_prefix
         self.__url = download_url
 
+    @property
+    def __bucket(self):
+        if not hasattr(self.__local, 'bucket'):
+            session = get_aws_session(*self.__credentials)
+            self.__local.bucket = session.resource('s3', endpoint_url=self.__endpoint_url).Bucket(self.__bucket_name)
+        return self.__local.bucket
+
     @property
     def object_prefix(self):
         if self.__object_prefix is None:
@@ -88,21 +120,40 @@ class S3StorageProvider(AbstractStorageProvider):
                local_path: Optional[str]=None,
                no_cache: bool=False,
                content_type: Optional[str]=None):
-        extra_args = {}
+        """Upload the content, skipping it if the object already has the same content and headers.
+
+        Content larger than the part size is uploaded in parts, several at a time."""
+        assert local_path is None or blob is None
+        if local_path:
+            content_hash = sha1(local_path)
+        else:
+            assert isinstance(blob, bytes)
+            content_hash = hashlib.sha1(blob).hexdigest()
+
+        extra_args = {'Metadata': {content_hash_metadata: content_hash}}
         if no_cache:
             extra_args['CacheControl'] = 'no-cache'
         if content_type:
             extra_args['ContentType'] = content_type
 
         s3_object = self.get_object(destination_path)
+        if self._is_uploaded(s3_object, extra_args):
+            return
 
-        assert local_path is None or blob is None
         if local_path:
-            with open(local_path, 'rb') as data:
-                s3_object.put(Body=data, **extra_args)
+            s3_object.upload_file(local_path, ExtraArgs=extra_args, Config=self.__transfer_config)
         else:
-            assert isinstance(blob, bytes)
-            s3_object.put(Body=blob, **extra_args)
+            s3_object.upload_fileobj(io.BytesIO(blob), ExtraArgs=extra_args, Config=self.__transfer_config)
+
+    def _is_uploaded(self, s3_object, extra_args):
+        """Return whether s3_object exists with the content hash and headers of extra_args."""
+        try:
+            s3_object.load()
+        except botocore.client.ClientError:
+            return False
+        return s3_object.metadata == extra_args['Metadata'] and \
+            s3_object.cache_control == extra_args.get('CacheControl') and \
+            s3_object.content_type == extra_args.get('ContentType', s3_object.content_type)
 
     def exists(self, path):
         try:
@@ -111,6 +162,11 @@ class S3StorageProvider(AbstractStorageProvider):
         except botocore.client.ClientError:
             return False
 
+    def stat(self, path):
+        s3_object = self.get_object(path)
+        s3_object.load()
+        return {'etag': s3_object.e_tag, 'size': s3_object.content_length}
+
     def list_recursive(self, path):
         prefix_len = len(self.object_prefix)
         names = set()
@@ -126,6 +182,10 @@ class S3StorageProvider(AbstractStorageProvider):
 
         return names
 
+    def list_prefix(self, prefix):
+        prefix_len = len(self.object_prefix)
+        return {object_summary.key[prefix_len:] for object_summary in self._get_objects_with_prefix(prefix)}
+
     def remove_recursive(self, path):
         for obj in self._get_objects_with_prefix(path):
             obj.delete()
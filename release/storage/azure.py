@@ -88,6 +88,10 @@ class AzureBlockBlobStorageProvider(AbstractStorageProvider):
         except azure.common.AzureMissingResourceHttpError:
             return False
 
+    def stat(self, path):
+        properties = self.blob_service.get_blob_properties(self.container, path).properties
+        return {'etag': properties.etag, 'size': properties.content_length}
+
     def fetch(self, path):
         return self.blob_service.get_blob_to_bytes(self.container, path).content
 
@@ -100,6 +104,9 @@ class AzureBlockBlobStorageProvider(AbstractStorageProvider):
             names.add(blob.name)
         return names
 
+    def list_prefix(self, prefix):
+        return {blob.name for blob in self.blob_service.list_blobs(self.container, prefix=prefix)}
+
     def remove_recursive(self, path):
         for blob_name in self.list_recursive(path):
             self.blob_service.delete_blob(self.container, blob_name)
@@ -58,6 +58,12 @@ class LocalStorageProvider(AbstractStorageProvider):
         assert not is_absolute_path(path)
         return os.path.exists(self.__full_path(path))
 
+    def stat(self, path):
+        assert not is_absolute_path(path)
+        stat = os.stat(self.__full_path(path))
+        # Files have no ETag, the modification time stands in for one.
+        return {'etag': '{}-{}'.format(stat.st_mtime_ns, stat.st_size), 'size': stat.st_size}
+
     def remove_recursive(self, path):
         full_path = self.__full_path(path)
 
@@ -77,6 +83,19 @@ class LocalStorageProvider(AbstractStorageProvider):
 
         return final_filenames
 
+    def list_prefix(self, prefix):
+        assert not is_absolute_path(prefix)
+        names = set()
+        for dirpath, _, filenames in os.walk(self.__full_path(prefix.rpartition('/')[0])):
+            assert dirpath.startswith(self.__storage_path)
+            dirpath_no_prefix = dirpath[len(self.__storage_path) + 1:]
+            for filename in filenames:
+                name = dirpath_no_prefix + '/' + filename if dirpath_no_prefix else filename
+                if name.startswith(prefix):
+                    names.add(name)
+
+        return names
+
     @property
     def url(self):
         return 'file://' + self.__storage_path + '/'
@@ -1,7 +1,13 @@
 import copy
+import hashlib
+import http.server
 import logging
 import os
+import socketserver
 import subprocess
+import threading
+import time
+import urllib.parse
 import uuid
 
 import boto3
@@ -9,8 +15,9 @@ import pytest
 
 import release
 import release.storage.aws
+import release.storage.local
 from pkgpanda.build import BuildError
-from pkgpanda.util import is_windows, make_directory, variant_prefix, write_json, write_string
+from pkgpanda.util import is_windows, load_string, make_directory, variant_prefix, write_json, write_string
 
 
 def roundtrip_to_json(data, mid_state, new_end_state=None):
@@ -141,6 +148,7 @@ def exercise_storage_provider(tmpdir, name, config):
             blob=upload_bytes,
             **upload_extra_args)
         check_file(upload_bytes_path, upload_bytes)
+        assert store.stat(upload_bytes_path)['size'] == len(upload_bytes)
 
         # Test uploading the same bytes to a non-existent subdirectory of a subdirectory
         upload_bytes_dir_path = get_path("dir1/bar/upload_bytes2.txt")
@@ -180,6 +188,25 @@ def exercise_storage_provider(tmpdir, name, config):
             get_path('copy_file.txt')
         }
 
+        # Prefixes don't need to be folders.
+        assert store.list_prefix(get_path('upload_')) == {get_path('upload_file.txt'), get_path('upload_bytes.txt')}
+        assert store.list_prefix(get_path('dir1/')) == {get_path('dir1/bar/upload_bytes2.txt')}
+        assert store.list_prefix(get_path('dir1/ba')) == {get_path('dir1/bar/upload_bytes2.txt')}
+        assert store.list_prefix(get_path('dir1/bar/upload_bytes')) == {get_path('dir1/bar/upload_bytes2.txt')}
+        assert store.list_prefix(get_path('dir')) == {get_path('dir1/bar/upload_bytes2.txt')}
+        assert store.list_prefix(get_path('dir2/')) == set()
+        assert store.list_prefix(get_path('missing/dir/')) == set()
+
+        # Existence answered from the listings matches asking the store.
+        existence = release.storage.ExistenceCache(store)
+        assert existence.add_prefix(get_path('dir1/'))
+        assert existence.add_prefix(get_path('upload_'))
+        for path in ['upload_file.txt', 'upload_file', 'upload_bytes.txt', 'dir1/bar/upload_bytes2.txt',
+                     'dir1/bar/upload_bytes3.txt', 'copy_file.txt', 'new_dir/copy_path.txt']:
+            assert existence.exists(get_path(path)) == store.exists(get_path(path)), path
+        existence.mark_exists(get_path('dir1/new.txt'))
+        assert existence.exists(get_path('dir1/new.txt'))
+
         # Check that cleanup removes everything
         store.remove_recursive(test_base_path)
         assert store.list_recursive(test_base_path) == set()
@@ -207,6 +234,192 @@ def test_storage_provider_aws(release_config_aws, tmpdir):
     exercise_storage_provider(tmpdir, 'aws_s3', release_config_aws)
 
 
+class S3StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the part of the S3 API used by S3StorageProvider from memory, with path style addressing.
+
+    Authentication isn't checked. Requests are recorded as (method, path, query) in server.requests."""
+
+    protocol_version = 'HTTP/1.1'
+    object_headers = ['Content-Type', 'Cache-Control']
+
+    def _parse(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+        bucket, _, key = urllib.parse.unquote(url.path).lstrip('/').partition('/')
+        with self.server.lock:
+            self.server.requests.append((self.command, key, sorted(query)))
+        return bucket, key, {name: values[0] for name, values in query.items()}
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _new_object(self, data):
+        headers = {name: self.headers[name] for name in self.object_headers if name in self.headers}
+        headers.update((name, value) for name, value in self.headers.items() if name.lower().startswith('x-amz-meta-'))
+        return {'data': data, 'headers': headers, 'etag': '"{}"'.format(hashlib.md5(data).hexdigest())}
+
+    def _respond(self, code, body=b'', headers=None):
+        self.send_response(code)
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        if self.command != 'HEAD':
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _respond_xml(self, body):
+        self._respond(200, '<?xml version="1.0" encoding="UTF-8"?>{}'.format(body).encode(),
+                      {'Content-Type': 'application/xml'})
+
+    def do_HEAD(self):  # noqa: N802
+        bucket, key, _ = self._parse()
+        obj = self.server.objects.get(key)
+        if obj is None:
+            self._respond(404, headers={'Content-Length': '0'})
+            return
+        headers = dict(obj['headers'], ETag=obj['etag'])
+        headers['Content-Length'] = str(len(obj['data']))
+        self._respond(200, headers=headers)
+
+    def do_GET(self):  # noqa: N802
+        bucket, key, query = self._parse()
+        if key:
+            obj = self.server.objects.get(key)
+            if obj is None:
+                self._respond(404, b'<Error><Code>NoSuchKey</Code></Error>')
+                return
+            self._respond(200, obj['data'], dict(obj['headers'], ETag=obj['etag']))
+            return
+        prefix = query.get('prefix', '')
+        contents = ''.join(
+            '<Contents><Key>{}</Key><Size>{}</Size><ETag>{}</ETag></Contents>'.format(
+                urllib.parse.quote(name) if 'encoding-type' in query else name, len(obj['data']), obj['etag'])
+            for name, obj in sorted(self.server.objects.items()) if name.startswith(prefix))
+        self._respond_xml('<ListBucketResult><Name>{}</Name><Prefix>{}</Prefix><IsTruncated>false</IsTruncated>'
+                          '{}</ListBucketResult>'.format(bucket, prefix, contents))
+
+    def do_PUT(self):  # noqa: N802
+        bucket, key, query = self._parse()
+        data = self._body()
+        if 'uploadId' in query:
+            part = self._new_object(data)
+            self.server.uploads[query['uploadId']]['parts'][int(query['partNumber'])] = part
+            self._respond(200, headers={'ETag': part['etag']})
+        elif 'x-amz-copy-source' in self.headers:
+            source = urllib.parse.unquote(self.headers['x-amz-copy-source']).lstrip('/').partition('/')[2]
+            obj = self.server.objects[key] = copy.deepcopy(self.server.objects[source])
+            self._respond_xml('<CopyObjectResult><ETag>{}</ETag></CopyObjectResult>'.format(obj['etag']))
+        else:
+            obj = self.server.objects[key] = self._new_object(data)
+            self._respond(200, headers={'ETag': obj['etag']})
+
+    def do_POST(self):  # noqa: N802
+        bucket, key, query = self._parse()
+        self._body()
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            self.server.uploads[upload_id] = {'object': self._new_object(b''), 'parts': dict()}
+            self._respond_xml(
+                '<InitiateMultipartUploadResult><Bucket>{}</Bucket><Key>{}</Key><UploadId>{}</UploadId>'
+                '</InitiateMultipartUploadResult>'.format(bucket, key, upload_id))
+        else:
+            upload = self.server.uploads.pop(query['uploadId'])
+            obj = upload['object']
+            obj['data'] = b''.join(part['data'] for _, part in sorted(upload['parts'].items()))
+            obj['etag'] = '"{}-{}"'.format(hashlib.md5(obj['data']).hexdigest(), len(upload['parts']))
+            self.server.objects[key] = obj
+            self._respond_xml(
+                '<CompleteMultipartUploadResult><Bucket>{}</Bucket><Key>{}</Key><ETag>{}</ETag>'
+                '</CompleteMultipartUploadResult>'.format(bucket, key, obj['etag']))
+
+    def do_DELETE(self):  # noqa: N802
+        bucket, key, _ = self._parse()
+        self.server.objects.pop(key, None)
+        self._respond(204)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class S3StandInServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def s3_stand_in():
+    """Serve an S3 stand-in on localhost, returning the release config of a storage provider using it."""
+    server = S3StandInServer(('127.0.0.1', 0), S3StandInHandler)
+    server.objects = dict()
+    server.uploads = dict()
+    server.requests = list()
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    endpoint_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    try:
+        yield server, {
+            'bucket': 'stand-in',
+            'object_prefix': 'prefix',
+            'download_url': endpoint_url + '/stand-in/prefix/',
+            'endpoint_url': endpoint_url,
+            'access_key_id': 'stand-in',
+            'secret_access_key': 'stand-in',
+            'region_name': 'us-east-1'}
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_storage_provider_aws_stand_in(s3_stand_in, tmpdir):
+    server, config = s3_stand_in
+    exercise_storage_provider(tmpdir, 'aws_s3', config)
+
+
+def test_storage_provider_aws_upload(s3_stand_in, tmpdir):
+    server, config = s3_stand_in
+    # The smallest part size S3 allows.
+    part_size = 5 * 1024 * 1024
+    store = release.storage.aws.S3StorageProvider(
+        multipart_chunksize=part_size, max_upload_concurrency=3, **config)
+    local_path = tmpdir.join('installer.sh')
+    local_path.write_binary(os.urandom(part_size * 2 + 1))
+
+    def uploads():
+        requests = [request for request in server.requests if request[0] in ('PUT', 'POST')]
+        del server.requests[:]
+        return requests
+
+    # Large files are uploaded in parts.
+    store.upload('installer.sh', local_path=str(local_path), content_type='text/x-shellscript')
+    assert store.fetch('installer.sh') == local_path.read_binary()
+    assert sorted(uploads()) == [
+        ('POST', 'prefix/installer.sh', ['uploadId']),
+        ('POST', 'prefix/installer.sh', ['uploads'])] + [('PUT', 'prefix/installer.sh', ['partNumber', 'uploadId'])] * 3
+    assert server.objects['prefix/installer.sh']['headers']['Content-Type'] == 'text/x-shellscript'
+
+    # Unchanged content isn't uploaded again, unless other headers are to change.
+    store.upload('installer.sh', local_path=str(local_path), content_type='text/x-shellscript')
+    assert uploads() == []
+    store.upload('installer.sh', local_path=str(local_path), content_type='text/x-shellscript', no_cache=True)
+    assert len(uploads()) == 5
+    assert server.objects['prefix/installer.sh']['headers']['Cache-Control'] == 'no-cache'
+
+    # Small content is uploaded at once.
+    store.upload('a.json', blob=b'{}')
+    store.upload('a.json', blob=b'{}')
+    store.upload('a.json', blob=b'[]')
+    assert uploads() == [('PUT', 'prefix/a.json', [])] * 2
+    assert store.fetch('a.json') == b'[]'
+
+    # Copies keep the content hash.
+    store.copy('a.json', 'b.json')
+    del server.requests[:]
+    store.upload('b.json', blob=b'[]')
+    assert uploads() == []
+
+
 # TODO: DCOS_OSS-3460 - muted Windows tests requiring investigation
 @pytest.mark.skipif(is_windows, reason="Fails on windows, cause unknown")
 def test_storage_provider_local(tmpdir):
@@ -388,7 +601,22 @@ def exercise_make_commands(repository):
         'channel_artifacts': channel_artifacts
     }
 
-    assert repository.make_commands(metadata) == copy_make_commands_result
+    commands = repository.make_commands(metadata)
+    assert commands.keys() == {'stage0', 'stage1', 'stage2', 'stage3'}
+    assert commands['stage0'] == []
+    assert {stage: commands[stage] for stage in ['stage1', 'stage2']} == copy_make_commands_result
+
+    # The manifest lists the paths of the artifacts with known content.
+    manifest_upload, manifest_copy = commands['stage3']
+    commit_path = repository.reproducible_artifact_path
+    assert manifest_upload['args']['destination_path'] == commit_path + 'manifest.json'
+    assert manifest_copy['args'] == {
+        'source_path': commit_path + 'manifest.json', 'destination_path': repository.manifest_path}
+    assert set(release.from_json(manifest_upload['args']['blob'].decode())) == {
+        commit_path + '2.html', repository.path_channel_prefix + '2.html',
+        commit_path + 'cf.json', repository.path_channel_prefix + 'cf.json',
+        repository.path_prefix + 'some_big_hash.txt',
+        commit_path + 'metadata.json', repository.path_channel_prefix + 'metadata.json'}
 
     upload_could_copy_artifacts = [{
         'reproducible_path': 'foo',
@@ -396,7 +624,8 @@ def exercise_make_commands(repository):
 
     # Test a single simple artifact which should hit the upload logic rather than copy
     simple_artifacts = {'core_artifacts': upload_could_copy_artifacts, 'channel_artifacts': []}
-    assert repository.make_commands(simple_artifacts) == upload_make_command_results
+    commands = repository.make_commands(simple_artifacts)
+    assert {stage: commands[stage] for stage in ['stage1', 'stage2']} == upload_make_command_results
 
 
 def test_repository():
@@ -425,6 +654,277 @@ def test_repository():
     # TODO(cmaloney): Exercise make_commands with a channel.
 
 
+def test_apply_storage_commands(monkeypatch, tmpdir):
+    monkeypatch.setattr(release, 'storage_retry_wait_multiplier_ms', 0)
+    applied = list()
+
+    class FlakyStorageProvider(release.storage.local.LocalStorageProvider):
+        def __init__(self, path, failures):
+            super().__init__(path)
+            # Number of times uploading each path fails.
+            self.failures = failures
+
+        def upload(self, destination_path, **kwargs):
+            if self.failures.get(destination_path):
+                self.failures[destination_path] -= 1
+                raise ConnectionError('Upload of {} failed'.format(destination_path))
+            time.sleep(0.01)
+            super().upload(destination_path, **kwargs)
+            applied.append(destination_path)
+
+        def copy(self, source_path, destination_path):
+            # Fails if the source isn't in place yet.
+            super().copy(source_path, destination_path)
+            applied.append(destination_path)
+
+    repository = release.Repository('stable', None, 'commit/c')
+    metadata = {
+        'core_artifacts': [
+            {'reproducible_path': 'packages/{}.tar.xz'.format(i), 'local_content': str(i)} for i in range(20)],
+        'channel_artifacts': [
+            {'channel_path': '{}.json'.format(i), 'reproducible_path': 'bootstrap/{}.json'.format(i),
+             'local_content': 'bootstrap {}'.format(i)}
+            for i in range(5)]}
+    storage_commands = repository.make_commands(metadata)
+    stage1 = {command['args']['destination_path'] for command in storage_commands['stage1']}
+    stage2 = {command['args']['destination_path'] for command in storage_commands['stage2']}
+    manifest_paths = ['stable/commit/c/manifest.json', 'stable/manifest.json']
+
+    store = FlakyStorageProvider(str(tmpdir.mkdir('a')), {'stable/bootstrap/3.json': 2})
+    release.apply_storage_commands({'a': store}, storage_commands, max_workers=4)
+    assert set(applied[:len(stage1)]) == stage1
+    assert set(applied[len(stage1):-2]) == stage2
+    assert applied[-2:] == manifest_paths
+    for i in range(5):
+        assert store.fetch('stable/{}.json'.format(i)) == 'bootstrap {}'.format(i).encode()
+        assert store.fetch('stable/commit/c/{}.json'.format(i)) == 'bootstrap {}'.format(i).encode()
+
+    # Reproducible artifacts which exist are skipped.
+    del applied[:]
+    release.apply_storage_commands({'a': store}, storage_commands, max_workers=4)
+    assert set(applied) == stage2 | {'stable/commit/c/{}.json'.format(i) for i in range(5)} | {
+        'stable/commit/c/metadata.json'} | set(manifest_paths)
+
+    # Which reproducible artifacts exist is listed once per folder rather than checked one by one.
+    exists_calls = list()
+    monkeypatch.setattr(store, 'exists', lambda path: exists_calls.append(path))
+    release.apply_storage_commands({'a': store}, storage_commands, max_workers=4)
+    assert exists_calls == []
+
+    # Once retries run out the error is raised, and none of stage2 is applied.
+    store = FlakyStorageProvider(str(tmpdir.mkdir('b')), {'stable/bootstrap/3.json': 3})
+    with pytest.raises(ConnectionError):
+        release.apply_storage_commands({'b': store}, storage_commands, max_workers=4)
+    assert not store.exists('stable/bootstrap/3.json')
+    assert not any(store.exists(path) for path in stage2)
+
+    # A failure is noticed while earlier commands are still running, the queued ones aren't started.
+    monkeypatch.setattr(release, 'storage_command_attempts', 1)
+
+    class SlowStorageProvider(FlakyStorageProvider):
+        def upload(self, destination_path, **kwargs):
+            if destination_path == 'slow':
+                time.sleep(1)
+            super().upload(destination_path, **kwargs)
+
+    store = SlowStorageProvider(str(tmpdir.mkdir('c')), {'fails': 1})
+    commands = [{'method': 'upload', 'if_not_exists': False, 'args': {'destination_path': path, 'blob': b''}}
+                for path in ['slow', 'fails'] + ['queued/{}'.format(i) for i in range(20)]]
+    del applied[:]
+    with pytest.raises(ConnectionError):
+        release.apply_storage_commands(
+            {'c': store}, {'stage0': [], 'stage1': commands, 'stage2': [], 'stage3': []}, max_workers=2)
+    assert len(applied) < 5
+
+
+def test_make_commands_manifest(tmpdir):
+    repository = release.Repository('stable', None, 'commit/c')
+    store = release.storage.local.LocalStorageProvider(str(tmpdir.mkdir('a')))
+    metadata = {
+        'core_artifacts': [
+            {'reproducible_path': 'packages/{}.tar.xz'.format(i), 'local_content': str(i)} for i in range(3)],
+        'channel_artifacts': [
+            {'channel_path': 'a.latest', 'local_content': 'a'},
+            # Same content as a.latest.
+            {'channel_path': 'b.latest', 'local_content': 'a'},
+            {'channel_path': 'c.latest', 'local_content': 'c'}]}
+
+    def paths(commands):
+        return {stage: [(command['method'], command['args']['destination_path']) for command in stage_commands]
+                for stage, stage_commands in commands.items()}
+
+    def previous_manifest():
+        return release.from_json(store.fetch(repository.manifest_path).decode())
+
+    # Content already stored by the release is copied rather than uploaded again.
+    commands = repository.make_commands(metadata)
+    assert {'source_path': 'stable/commit/c/a.latest', 'destination_path': 'stable/commit/c/b.latest'} in [
+        command['args'] for command in commands['stage1']]
+    release.apply_storage_commands({'a': store}, commands)
+    assert store.fetch('stable/b.latest') == b'a'
+    manifest = previous_manifest()
+    assert manifest['stable/packages/0.tar.xz'] == hashlib.sha1(b'0').hexdigest()
+    assert manifest['stable/b.latest'] == manifest['stable/a.latest'] == hashlib.sha1(b'a').hexdigest()
+
+    # Releasing the same content again only writes the manifest.
+    assert paths(repository.make_commands(metadata, previous_manifest())) == {
+        'stage0': [], 'stage1': [], 'stage2': [],
+        'stage3': [('upload', 'stable/commit/c/manifest.json'), ('copy', 'stable/manifest.json')]}
+
+    # Changed content is written, and taken out of the manifest until it is in place.
+    metadata['channel_artifacts'][2]['local_content'] = 'd'
+    commands = repository.make_commands(metadata, previous_manifest())
+    assert paths(commands) == {
+        'stage0': [('upload', 'stable/manifest.json')],
+        'stage1': [('upload', 'stable/commit/c/c.latest')],
+        'stage2': [('copy', 'stable/c.latest')],
+        'stage3': [('upload', 'stable/commit/c/manifest.json'), ('copy', 'stable/manifest.json')]}
+    interim_manifest = release.from_json(commands['stage0'][0]['args']['blob'].decode())
+    assert interim_manifest.keys() == manifest.keys() - {'stable/commit/c/c.latest', 'stable/c.latest'}
+    release.apply_storage_commands({'a': store}, commands)
+    assert store.fetch('stable/c.latest') == b'd'
+    assert previous_manifest()['stable/c.latest'] == hashlib.sha1(b'd').hexdigest()
+
+    # Artifacts copied from another release use the content hashes of its manifest.
+    promoted = release.Repository('promoted', None, 'commit/c')
+    metadata['core_artifacts'] = [
+        dict(artifact, local_copy_from='stable/' + artifact['reproducible_path'],
+             local_content_hash=manifest['stable/' + artifact['reproducible_path']])
+        for artifact in metadata['core_artifacts']]
+    commands = promoted.make_commands(metadata)
+    assert commands['stage1'][0]['args'] == {
+        'source_path': 'stable/packages/0.tar.xz', 'destination_path': 'promoted/packages/0.tar.xz'}
+    assert release.from_json(commands['stage3'][0]['args']['blob'].decode())['promoted/packages/0.tar.xz'] == \
+        manifest['stable/packages/0.tar.xz']
+
+
+def test_fetch_cache(monkeypatch, tmpdir):
+    store = release.storage.local.LocalStorageProvider(str(tmpdir.mkdir('store')))
+    store.upload('bootstrap/a.tar.xz', blob=b'a')
+    cache_dir = str(tmpdir.join('cache'))
+    downloads = list()
+    download_inner = release.storage.local.LocalStorageProvider.download_inner
+
+    def counting_download_inner(self, path, local_path):
+        downloads.append(path)
+        download_inner(self, path, local_path)
+    monkeypatch.setattr(release.storage.local.LocalStorageProvider, 'download_inner', counting_download_inner)
+
+    def fetch(local_name):
+        # A new cache each time, as for separate runs.
+        local_path = str(tmpdir.join('work', local_name))
+        hit = release.storage.FetchCache(store, cache_dir).download('bootstrap/a.tar.xz', local_path)
+        with open(local_path, 'rb') as f:
+            return hit, f.read()
+
+    assert fetch('1') == (False, b'a')
+    assert fetch('2') == (True, b'a')
+    assert fetch('2') == (True, b'a')
+    assert downloads == ['bootstrap/a.tar.xz']
+
+    # Changes to the remote file are fetched.
+    store.upload('bootstrap/a.tar.xz', blob=b'bb')
+    assert fetch('3') == (False, b'bb')
+    assert fetch('4') == (True, b'bb')
+
+    # So are changes keeping the size (ex: a pointer to another id of the same length).
+    store.upload('bootstrap/a.tar.xz', blob=b'cc')
+    assert fetch('4') == (False, b'cc')
+
+    # Storage providers without ETags are checked by size.
+    monkeypatch.setattr(store, 'stat', lambda path: {'etag': None, 'size': 2})
+    assert fetch('4') == (True, b'cc')
+    monkeypatch.setattr(store, 'stat', lambda path: {'etag': None, 'size': 5})
+    assert fetch('4') == (False, b'cc')
+    monkeypatch.undo()
+    monkeypatch.setattr(release.storage.local.LocalStorageProvider, 'download_inner', counting_download_inner)
+
+    # An interrupted download leaves nothing behind, the next one starts over.
+    store.upload('bootstrap/a.tar.xz', blob=b'ccc')
+
+    def failing_download_inner(self, path, local_path):
+        with open(local_path, 'wb') as f:
+            f.write(b'c')
+        raise ConnectionError('Download of {} failed'.format(path))
+    monkeypatch.setattr(release.storage.local.LocalStorageProvider, 'download_inner', failing_download_inner)
+    with pytest.raises(ConnectionError):
+        fetch('5')
+    monkeypatch.setattr(release.storage.local.LocalStorageProvider, 'download_inner', counting_download_inner)
+    assert not any(name.endswith('.partial') for name in os.listdir(os.path.dirname(
+        release.storage.FetchCache(store, cache_dir).cache_dir + '/bootstrap/a.tar.xz')))
+    assert fetch('5') == (False, b'ccc')
+
+
+def test_fetch_key_artifacts(monkeypatch, tmpdir):
+    store_dir = tmpdir.mkdir('store')
+    store = release.storage.local.LocalStorageProvider(str(store_dir))
+    metadata = {
+        'repository_path': 'testing',
+        'reproducible_artifact_path': 'testing/commit/c',
+        'core_artifacts': [
+            {'reproducible_path': 'packages/{0}/{0}--1.tar.xz'.format(i)} for i in range(10)] + [
+            {'reproducible_path': 'bootstrap/b.bootstrap.tar.xz'},
+            {'channel_path': 'bootstrap.latest'},
+            {'channel_path': 'complete.latest.json'}]}
+    for i in range(10):
+        store.upload('testing/packages/{0}/{0}--1.tar.xz'.format(i), blob=str(i).encode())
+    store.upload('testing/bootstrap/b.bootstrap.tar.xz', blob=b'b')
+    store.upload('testing/commit/c/bootstrap.latest', blob=b'b')
+    store.upload('testing/commit/c/complete.latest.json', blob=b'{}')
+    config = {
+        'storage': {'local': {'kind': 'local_path', 'path': str(store_dir)}},
+        'options': {'preferred': 'local', 'fetch_cache': str(tmpdir.join('cache'))}}
+    manifest = {'testing/packages/0/0--1.tar.xz': hashlib.sha1(b'0').hexdigest()}
+
+    downloads = list()
+    download_inner = release.storage.local.LocalStorageProvider.download_inner
+
+    def counting_download_inner(self, path, local_path):
+        downloads.append(path)
+        download_inner(self, path, local_path)
+    monkeypatch.setattr(release.storage.local.LocalStorageProvider, 'download_inner', counting_download_inner)
+
+    def fetch_key_artifacts(work_dir):
+        monkeypatch.chdir(tmpdir.mkdir(work_dir))
+        fetched = copy.deepcopy(metadata)
+        release.ReleaseManager(config, False).fetch_key_artifacts(fetched, manifest)
+        return fetched
+
+    fetched = fetch_key_artifacts('1')
+    assert len(downloads) == 13
+    assert load_string('packages/cache/packages/3/3--1.tar.xz') == '3'
+    assert load_string('packages/cache/bootstrap/bootstrap.latest') == 'b'
+    assert load_string('packages/cache/complete/complete.latest.json') == '{}'
+    assert fetched['core_artifacts'][0] == {
+        'reproducible_path': 'packages/0/0--1.tar.xz',
+        'local_path': 'packages/cache/packages/0/0--1.tar.xz',
+        'local_copy_from': 'testing/packages/0/0--1.tar.xz',
+        'local_content_hash': manifest['testing/packages/0/0--1.tar.xz']}
+    assert fetched['core_artifacts'][-1] == {
+        'channel_path': 'complete.latest.json',
+        'local_path': 'complete.latest.json',
+        'local_copy_from': 'testing/commit/c/complete.latest.json'}
+
+    # Another run in another checkout fetches what changed only.
+    del downloads[:]
+    store.upload('testing/commit/c/bootstrap.latest', blob=b'bc')
+    fetch_key_artifacts('2')
+    assert downloads == ['testing/commit/c/bootstrap.latest']
+    assert load_string('packages/cache/bootstrap/bootstrap.latest') == 'bc'
+    assert load_string('packages/cache/packages/3/3--1.tar.xz') == '3'
+
+
+def test_existence_listing_prefixes(monkeypatch):
+    monkeypatch.setattr(release, 'min_folders_per_listing', 3)
+    assert release.existence_listing_prefixes([]) == []
+    # Lone paths are checked one by one.
+    assert release.existence_listing_prefixes(['a.txt', 'b.txt', 'x/a.txt', 'y/z/a.txt']) == []
+    assert release.existence_listing_prefixes(['x/a.txt', 'x/b.txt', 'x/y/a.txt', 'x/y/b.txt']) == ['x/']
+    # Enough sibling folders are listed through their parent.
+    assert release.existence_listing_prefixes(
+        ['p/a/a.tar.xz', 'p/b/b.tar.xz', 'p/c/c.tar.xz', 'q/a.json', 'q/b.json', 'r/a/a.json']) == ['p/', 'q/']
+
+
 def test_get_gen_package_artifact(tmpdir):
     assert release.get_gen_package_artifact('foo--test') == {
         'reproducible_path': 'packages/foo/foo--test.tar.xz',
@@ -71,6 +71,7 @@ setup(
             'pkgpanda=pkgpanda.cli:main',
             'mkpanda=pkgpanda.build.cli:main',
             'dcos_installer=dcos_installer.cli:main',
+            'dcos_gen_service=gen.service:main',
         ],
     },
     package_data={